@@ -0,0 +1,117 @@
+"""
+数据库层基准测试
+
+对比旧实现（每次调用 aiosqlite.connect + 提交）与 EngineDatabase 单连接（WAL、复用语句）
+在 N 个并发用户下的单次调用延迟。每个用户依次执行：
+检查下载次数 → 记录生成图片 → 查询今日图片 → 增加下载次数。
+
+用法：
+    python benchmarks/bench_database.py [--users 100] [--rounds 5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine_db import SCHEMA, EngineDatabase, today_str  # noqa: E402
+
+
+class LegacyDatabase:
+    """重构前的实现：每个操作单独 connect/commit（check_download_limit 也会写入）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    async def init(self):
+        async with aiosqlite.connect(self.db_path) as conn:
+            for stmt in SCHEMA:
+                await conn.execute(stmt)
+            await conn.commit()
+
+    async def get_download_count(self, user_id: str) -> int:
+        today = today_str()
+        async with aiosqlite.connect(self.db_path) as conn:
+            await conn.execute('''INSERT OR IGNORE INTO user_downloads
+                (user_id, download_date, download_count) VALUES (?, ?, 0)''', (user_id, today))
+            await conn.commit()
+            cur = await conn.execute('''SELECT download_count FROM user_downloads
+                WHERE user_id=? AND download_date=?''', (user_id, today))
+            row = await cur.fetchone()
+            return row[0] if row else 0
+
+    async def increment_download_count(self, user_id: str):
+        today = today_str()
+        async with aiosqlite.connect(self.db_path) as conn:
+            await conn.execute('''INSERT OR IGNORE INTO user_downloads
+                (user_id, download_date, download_count) VALUES (?, ?, 0)''', (user_id, today))
+            await conn.execute('''UPDATE user_downloads SET download_count=download_count+1,
+                updated_at=CURRENT_TIMESTAMP WHERE user_id=? AND download_date=?''', (user_id, today))
+            await conn.commit()
+
+    async def record_image(self, filename: str, user_id: str):
+        async with aiosqlite.connect(self.db_path) as conn:
+            await conn.execute('''INSERT INTO image_records
+                (filename, user_id, generate_date) VALUES (?, ?, ?)''', (filename, user_id, today_str()))
+            await conn.commit()
+
+    async def get_user_images(self, user_id: str):
+        async with aiosqlite.connect(self.db_path) as conn:
+            cur = await conn.execute('''SELECT filename FROM image_records
+                WHERE user_id=? AND generate_date=?''', (user_id, today_str()))
+            return [row[0] for row in await cur.fetchall()]
+
+    async def close(self):
+        pass
+
+
+async def _user_session(db, user_id: str, rounds: int, samples: dict):
+    for r in range(rounds):
+        for name, call in (
+            ("check_download_limit", lambda: db.get_download_count(user_id)),
+            ("record_image", lambda: db.record_image(f"{user_id}_{r}.png", user_id)),
+            ("get_user_images", lambda: db.get_user_images(user_id)),
+            ("increment_download_count", lambda: db.increment_download_count(user_id)),
+        ):
+            start = time.perf_counter()
+            await call()
+            samples.setdefault(name, []).append(time.perf_counter() - start)
+
+
+async def _run(label: str, db, users: int, rounds: int):
+    samples: dict = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(_user_session(db, f"user{u}", rounds, samples) for u in range(users)))
+    total = time.perf_counter() - start
+    await db.close()
+    print(f"\n== {label}：{users} 并发用户 × {rounds} 轮，总耗时 {total:.2f}s ==")
+    print(f"{'操作':<28}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}")
+    for name, vals in samples.items():
+        vals.sort()
+        p95 = vals[int(len(vals) * 0.95) - 1]
+        print(f"{name:<28}{statistics.median(vals) * 1000:>10.2f}{p95 * 1000:>10.2f}{vals[-1] * 1000:>10.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="数据库层基准测试")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = LegacyDatabase(os.path.join(tmp, "legacy.db"))
+        await legacy.init()
+        await _run("旧实现（每次 connect）", legacy, args.users, args.rounds)
+
+        engine_db = EngineDatabase(os.path.join(tmp, "engine.db"))
+        await engine_db.connect()
+        await _run("EngineDatabase（单连接 WAL）", engine_db, args.users, args.rounds)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
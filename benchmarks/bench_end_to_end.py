@@ -0,0 +1,221 @@
+"""
+端到端吞吐量基准测试 — 真实 WorkflowEngine + 本地 ComfyUI 替身
+
+启动若干个 fake_comfyui 服务器，以固定速率调用 WorkflowEngine.submit_task，
+任务走完整条链路（派发 → 上传 → 下发 prompt → 轮询 history → 自动保存下载 → 结果回调）。
+每种任务类型单独跑一轮（各用一个新引擎和临时目录），报告：
+- 吞吐量（完成数 / 首次提交到最后完成的时间）
+- 提交到结果回调的延迟 P50/P95/P99
+- 各阶段耗时（来自任务追踪 JSONL，与 trace_stats.py 的统计口径一致）
+
+完全离线，只监听 127.0.0.1，可在 CI 中运行。
+注意引擎以固定的 3 秒间隔轮询 history，单个任务的 execute 阶段至少包含一次轮询等待。
+
+用法：
+    python benchmarks/bench_end_to_end.py [--jobs 20] [--rate 2] [--servers 2]
+        [--kinds txt2img,img2img,workflow] [--exec-delay 0.5] [--output-kb 512] [--no-save]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+from fake_comfyui import FakeComfyUI  # noqa: E402
+from trace_stats import STAGE_ORDER, percentile, stage_totals  # noqa: E402
+from workflow_engine import WorkflowEngine  # noqa: E402
+
+WORKFLOW_NAME = "zimage"
+
+
+def _make_config(urls: List[str], data_dir: str, args) -> dict:
+    with open(os.path.join(ROOT, "_conf_schema.json"), encoding="utf-8") as f:
+        config = {k: v.get("default") for k, v in json.load(f).items()}
+    config.update(
+        comfyui_url=[f"{url},fake{i + 1}" for i, url in enumerate(urls)],
+        max_task_queue=max(args.jobs, 10),
+        max_concurrent_tasks_per_user=max(args.jobs, 1),
+        enable_auto_save=not args.no_save,
+        auto_save_directory=os.path.join(data_dir, "output"),
+        enable_task_trace=True,
+        enable_metrics=False,
+    )
+    return config
+
+
+def _make_plugin_dir() -> str:
+    """临时插件目录：只带基准用到的 workflow，数据库、追踪、保存文件都落在这里"""
+    plugin_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    shutil.copytree(os.path.join(ROOT, "workflow", WORKFLOW_NAME),
+                    os.path.join(plugin_dir, "workflow", WORKFLOW_NAME))
+    return plugin_dir
+
+
+def _make_input_image(plugin_dir: str) -> str:
+    from PIL import Image
+    path = os.path.join(plugin_dir, "input.png")
+    # 随机噪声，避免纯色图压缩后小于 MIN_INPUT_IMAGE_BYTES
+    Image.frombytes("RGB", (512, 512), os.urandom(512 * 512 * 3)).save(path)
+    return path
+
+
+def _build_task(eng: WorkflowEngine, kind: str, i: int, img_path: str) -> dict:
+    if kind == "workflow":
+        info = eng.workflows[WORKFLOW_NAME]
+        return {
+            "prompt": eng.build_workflow(info["workflow"], info["config"], {}, []),
+            "workflow_name": WORKFLOW_NAME, "user_id": f"bench{i}",
+            "is_workflow": True, "image_paths": [], "workflow_config": info["config"],
+        }
+    task = {
+        "prompt": f"benchmark prompt {i}", "current_seed": i,
+        "current_width": eng.default_width, "current_height": eng.default_height,
+        "current_batch_size": 1, "lora_list": [], "selected_model": None,
+        "user_id": f"bench{i}",
+    }
+    if kind == "img2img":
+        task.update(img_path=img_path, denoise=0.6)
+    return task
+
+
+async def _shutdown(eng: WorkflowEngine):
+    tasks = [eng.server_monitor_task] + [s.worker for s in eng.comfyui_servers]
+    for task in tasks:
+        if task and not task.done():
+            task.cancel()
+    for task in tasks:
+        if task:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+    await eng.close_database()
+
+
+async def run_kind(kind: str, args) -> dict:
+    fakes = [FakeComfyUI(exec_delay=args.exec_delay, step_delay=args.step_delay,
+                         jitter=args.jitter, output_size=args.output_kb * 1024, seed=i)
+             for i in range(args.servers)]
+    urls = [await fake.start() for fake in fakes]
+    plugin_dir = _make_plugin_dir()
+    try:
+        eng = WorkflowEngine(_make_config(urls, plugin_dir, args), plugin_dir=plugin_dir)
+        img_path = _make_input_image(plugin_dir)
+        await asyncio.sleep(0.5)  # 等待数据库初始化与首次健康检查
+
+        latencies: List[float] = []
+        failures = 0
+        done = asyncio.Event()
+        remaining = args.jobs
+
+        def _on_result(submitted: float):
+            def _cb(result):
+                nonlocal remaining, failures
+                if result.success:
+                    latencies.append(time.monotonic() - submitted)
+                else:
+                    failures += 1
+                remaining -= 1
+                if remaining == 0:
+                    done.set()
+            return _cb
+
+        start = time.monotonic()
+        for i in range(args.jobs):
+            next_at = start + i / args.rate
+            if (delay := next_at - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            task = _build_task(eng, kind, i, img_path)
+            task["callback"] = _on_result(time.monotonic())
+            if not await eng.submit_task(task):
+                failures += 1
+                remaining -= 1
+        if remaining > 0:
+            try:
+                await asyncio.wait_for(done.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                print(f"[{kind}] 超时：{remaining} 个任务未完成")
+        elapsed = time.monotonic() - start
+
+        await _shutdown(eng)
+        stages: Dict[str, List[float]] = defaultdict(list)
+        trace_path = os.path.join(eng.db_dir, "traces", "task_traces.jsonl")
+        if os.path.exists(trace_path):
+            with open(trace_path, encoding="utf-8") as f:
+                for line in f:
+                    for name, value in stage_totals(json.loads(line)).items():
+                        stages[name].append(value)
+        return {
+            "kind": kind, "completed": len(latencies), "failed": failures,
+            "elapsed": elapsed, "latencies": sorted(latencies),
+            "stages": {k: sorted(v) for k, v in stages.items()},
+            "fake_stats": [fake.stats for fake in fakes],
+        }
+    finally:
+        for fake in fakes:
+            await fake.stop()
+        shutil.rmtree(plugin_dir, ignore_errors=True)
+
+
+def report(res: dict):
+    lat = res["latencies"]
+    jobs_s = res["completed"] / res["elapsed"] if res["elapsed"] else 0.0
+    print(f"\n== {res['kind']} ==")
+    print(f"完成 {res['completed']}，失败 {res['failed']}，用时 {res['elapsed']:.1f}s，"
+          f"吞吐量 {jobs_s:.2f} jobs/s")
+    if lat:
+        print(f"延迟  P50 {percentile(lat, 50):.2f}s  P95 {percentile(lat, 95):.2f}s  "
+              f"P99 {percentile(lat, 99):.2f}s  最大 {lat[-1]:.2f}s")
+    polls = sum(s["history_polls"] for s in res["fake_stats"])
+    views = sum(s["views"] for s in res["fake_stats"])
+    uploads = sum(s["uploads"] for s in res["fake_stats"])
+    print(f"ComfyUI 请求：history 轮询 {polls}，view {views}，upload {uploads}")
+    stages = res["stages"]
+    if stages:
+        print(f"{'阶段':<12}{'P50':>10}{'P95':>10}{'P99':>10}{'平均':>10}")
+        names = [n for n in STAGE_ORDER if n in stages] + sorted(set(stages) - set(STAGE_ORDER))
+        for name in names:
+            values = stages[name]
+            print(f"{name:<12}{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}"
+                  f"{percentile(values, 99):>10.3f}{sum(values) / len(values):>10.3f}")
+
+
+async def main_async(args):
+    ok = True
+    for kind in args.kinds.split(","):
+        res = await run_kind(kind.strip(), args)
+        report(res)
+        ok = ok and res["failed"] == 0 and res["completed"] == args.jobs
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端吞吐量基准测试（本地 ComfyUI 替身）")
+    parser.add_argument("--jobs", type=int, default=20, help="每种任务类型的任务数")
+    parser.add_argument("--rate", type=float, default=2.0, help="提交速率（个/秒）")
+    parser.add_argument("--servers", type=int, default=2, help="ComfyUI 替身数量")
+    parser.add_argument("--kinds", default="txt2img,img2img,workflow")
+    parser.add_argument("--exec-delay", type=float, default=0.5, help="每个 prompt 的执行时间（秒）")
+    parser.add_argument("--step-delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--output-kb", type=int, default=512, help="每张输出图的大小")
+    parser.add_argument("--no-save", action="store_true", help="关闭自动保存（不下载输出）")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--verbose", action="store_true", help="显示引擎日志")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    sys.exit(0 if asyncio.run(main_async(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
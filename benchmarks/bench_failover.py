@@ -0,0 +1,284 @@
+"""
+故障切换演练 — 对 ComfyUI 替身注入故障，测量引擎的发现与恢复时间
+
+覆盖 _handle_server_failure、_check_and_clear_queue_if_no_healthy_servers、
+_worker_loop 中的不健康回队，以及 poll_task_status 的空队列检测。
+
+每个场景：两个替身服务器，以固定速率提交文生图任务；第一个任务在 fake1 上执行时
+注入故障，持续 --fault-seconds 秒后清除（restart 为停机时长），然后等引擎空闲。
+引擎的检查间隔按比例缩短（见 ENGINE_TIMINGS），使场景在几十秒内跑完；
+_handle_server_failure 中未达到失败上限时固定的 10 秒退避无法缩短，会计入 recover。
+
+指标（时间从注入 / 清除故障算起）：
+    detect       引擎首次记录该服务器失败（failure_count > 0 或不健康）
+    unhealthy    服务器被标记为不健康
+    recover      清除后服务器重新可派发（健康且过了 retry_after）
+    ok / failed  收到成功 / 失败回调的任务数
+    lost         没有收到任何回调的任务数（被丢弃，或回队时丢了回调）
+    duplicates   同一任务在替身上成功执行多于一次的次数
+
+结果可保存为回归基线（benchmarks/baselines/failover.json），之后用 --check 对比：
+计数不得超过基线，时间不得超过基线 × (1 + tolerance) + slack。
+
+用法：
+    python benchmarks/bench_failover.py [--scenarios drop,hang,...] [--fault-seconds 6]
+        [--save-baseline] [--check]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from bench_end_to_end import _make_config, _make_plugin_dir, _shutdown  # noqa: E402
+from fake_comfyui import FakeComfyUI  # noqa: E402
+from workflow_engine import WorkflowEngine  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines", "failover.json")
+SCENARIOS = ("drop", "hang", "error500", "lose_history", "restart", "all_drop")
+TIME_METRICS = ("detect", "unhealthy", "recover")
+COUNT_METRICS = ("failed", "lost", "duplicates")
+
+# 生产默认值：健康检查 60 秒、失败后 300 秒重试、下发 30 秒后开始检查空队列
+ENGINE_TIMINGS = {
+    "server_check_interval": 1,
+    "retry_delay": 3,
+    "queue_check_delay": 3,
+    "queue_check_interval": 1,
+    "empty_queue_max_retry": 2,
+}
+
+MARKER = re.compile(r"chaos-(\d+)\b")
+
+
+class Watcher:
+    """以固定间隔采样目标服务器的状态，记录故障被发现和恢复的时刻"""
+
+    def __init__(self, server, interval: float = 0.05):
+        self.server = server
+        self.interval = interval
+        self.injected: Optional[float] = None
+        self.cleared: Optional[float] = None
+        self.detect: Optional[float] = None
+        self.unhealthy: Optional[float] = None
+        self.recover: Optional[float] = None
+
+    async def run(self):
+        srv = self.server
+        while True:
+            now = time.monotonic()
+            if self.injected is not None:
+                if self.detect is None and (srv.failure_count > 0 or not srv.healthy):
+                    self.detect = now - self.injected
+                if self.unhealthy is None and not srv.healthy:
+                    self.unhealthy = now - self.injected
+            if self.cleared is not None and self.recover is None and self.detect is not None:
+                if srv.healthy and (not srv.retry_after or datetime.now() >= srv.retry_after):
+                    self.recover = now - self.cleared
+            await asyncio.sleep(self.interval)
+
+
+async def _apply_fault(name: str, fakes: List[FakeComfyUI], seconds: float):
+    """注入故障并在 seconds 后清除；返回清除时刻"""
+    if name == "restart":
+        await fakes[0].restart(seconds)
+        return time.monotonic()
+    targets = fakes if name == "all_drop" else fakes[:1]
+    for fake in targets:
+        fake.inject("drop" if name == "all_drop" else name)
+    await asyncio.sleep(seconds)
+    for fake in targets:
+        fake.clear()
+    return time.monotonic()
+
+
+def _engine_idle(eng: WorkflowEngine) -> bool:
+    return eng.task_queue.empty() and all(s.current_task is None for s in eng.comfyui_servers)
+
+
+async def run_scenario(name: str, args) -> Dict[str, object]:
+    fakes = [FakeComfyUI(exec_delay=args.exec_delay, output_size=16 * 1024, seed=i)
+             for i in range(2)]
+    urls = [await fake.start() for fake in fakes]
+    plugin_dir = _make_plugin_dir()
+    try:
+        config = _make_config(urls, plugin_dir, SimpleNamespace(jobs=args.jobs, no_save=True))
+        config.update({k: v for k, v in ENGINE_TIMINGS.items() if k in config})
+        eng = WorkflowEngine(config, plugin_dir=plugin_dir)
+        for key, value in ENGINE_TIMINGS.items():
+            setattr(eng, key, value)
+        await asyncio.sleep(0.5)
+
+        watcher = Watcher(eng.comfyui_servers[0])
+        watch_task = asyncio.create_task(watcher.run())
+        outcomes: Dict[int, List[bool]] = {}
+
+        def _on_result(i: int):
+            def _cb(result):
+                outcomes.setdefault(i, []).append(result.success)
+            return _cb
+
+        async def _submit_all():
+            start = time.monotonic()
+            for i in range(args.jobs):
+                if (delay := start + i / args.rate - time.monotonic()) > 0:
+                    await asyncio.sleep(delay)
+                await eng.submit_task({
+                    "prompt": f"chaos-{i}", "current_seed": i,
+                    "current_width": 512, "current_height": 512, "current_batch_size": 1,
+                    "lora_list": [], "selected_model": None, "user_id": f"chaos{i}",
+                    "callback": _on_result(i),
+                })
+
+        submitter = asyncio.create_task(_submit_all())
+        # 等第一个任务在 fake1 上开始执行再注入
+        deadline = time.monotonic() + 10
+        while fakes[0].running is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        watcher.injected = time.monotonic()
+        watcher.cleared = await _apply_fault(name, fakes, args.fault_seconds)
+        await submitter
+
+        # 等引擎空闲且恢复（或超时）；丢了回调的任务不会再有回调，只能以空闲为准
+        deadline = time.monotonic() + args.timeout
+        idle_since = None
+        while time.monotonic() < deadline:
+            if len(outcomes) == args.jobs:
+                break
+            if _engine_idle(eng) and (watcher.recover is not None or watcher.detect is None):
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since >= args.settle:
+                    break
+            else:
+                idle_since = None
+            await asyncio.sleep(0.1)
+
+        watch_task.cancel()
+        await _shutdown(eng)
+
+        executions = Counter()
+        for fake in fakes:
+            for fp in fake.completed:
+                if m := MARKER.search(json.dumps(fp.prompt, ensure_ascii=False)):
+                    executions[int(m.group(1))] += 1
+        return {
+            "scenario": name,
+            "detect": _round(watcher.detect),
+            "unhealthy": _round(watcher.unhealthy),
+            "recover": _round(watcher.recover),
+            "ok": sum(1 for v in outcomes.values() if any(v)),
+            "failed": sum(1 for v in outcomes.values() if not any(v)),
+            "lost": args.jobs - len(outcomes),
+            "duplicates": sum(n - 1 for n in executions.values() if n > 1),
+        }
+    finally:
+        for fake in fakes:
+            await fake.stop()
+        shutil.rmtree(plugin_dir, ignore_errors=True)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 2)
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def report(results: List[dict]):
+    cols = ("detect", "unhealthy", "recover", "ok", "failed", "lost", "duplicates")
+    print(f"\n{'场景':<14}" + "".join(f"{c:>11}" for c in cols))
+    for res in results:
+        print(f"{res['scenario']:<14}" + "".join(f"{_fmt(res[c]):>11}" for c in cols))
+
+
+def check(results: List[dict], baseline: dict, tolerance: float, slack: float) -> List[str]:
+    """与基线对比，返回回归说明列表"""
+    problems = []
+    for res in results:
+        base = baseline.get(res["scenario"])
+        if not base:
+            continue
+        for key in COUNT_METRICS:
+            if res[key] > base.get(key, 0):
+                problems.append(f"{res['scenario']}.{key}: {res[key]} > 基线 {base.get(key, 0)}")
+        for key in TIME_METRICS:
+            cur, ref = res[key], base.get(key)
+            if ref is not None and cur is None and key != "detect":
+                problems.append(f"{res['scenario']}.{key}: 未发生（基线 {ref}s）")
+            elif ref is not None and cur is not None and cur > ref * (1 + tolerance) + slack:
+                problems.append(f"{res['scenario']}.{key}: {cur}s > 基线 {ref}s")
+    return problems
+
+
+async def main_async(args) -> List[dict]:
+    results = []
+    for name in args.scenarios.split(","):
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知场景：{name}（可选：{', '.join(SCENARIOS)}）")
+        res = await run_scenario(name, args)
+        print(f"{name}: {json.dumps(res, ensure_ascii=False)}", flush=True)
+        results.append(res)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="故障切换演练")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--rate", type=float, default=1.0, help="提交速率（个/秒）")
+    parser.add_argument("--exec-delay", type=float, default=2.0)
+    parser.add_argument("--fault-seconds", type=float, default=6.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="引擎空闲多久视为结束")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--check", action="store_true", help="与基线对比，回归时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--slack", type=float, default=2.0, help="时间比较的绝对余量（秒）")
+    parser.add_argument("--verbose", action="store_true", help="显示引擎日志")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    results = asyncio.run(main_async(args))
+    report(results)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        for res in results:
+            baseline[res["scenario"]] = {k: v for k, v in res.items() if k != "scenario"}
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n基线已保存：{args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"基线不存在：{args.baseline}")
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = check(results, json.load(f), args.tolerance, args.slack)
+        if problems:
+            print("\n回归：\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("\n与基线一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+ImageCompressor 基准测试
+
+对比逐张 PIL LANCZOS 路径与批量张量插值/无操作快速路径的耗时。
+覆盖批量 1~6、常见手机照片分辨率，以及已在 [min, max] 区间内的图像。
+
+用法：
+    python benchmarks/bench_image_compressor.py [--repeat 5] [--device cpu|cuda]
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_compressor.image_compressor import ImageCompressor  # noqa: E402
+
+# (宽, 高, 说明)
+RESOLUTIONS = [
+    (4032, 3024, "12MP 横拍"),
+    (3024, 4032, "12MP 竖拍"),
+    (4000, 3000, "12MP 4:3"),
+    (1080, 1920, "屏幕截图"),
+    (1200, 900, "区间内（快速路径）"),
+]
+# 与 _build_comfyui_prompt 中节点 53 的参数一致
+LIMITS = dict(min_width=800, min_height=800, max_width=1600, max_height=1600)
+
+
+def _timeit(fn, repeat: int) -> float:
+    fn()  # 预热
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ImageCompressor 基准测试")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    node = ImageCompressor()
+    print(f"{'分辨率':<22}{'批量':>4}{'PIL(ms)':>12}{'新路径(ms)':>12}{'加速比':>8}")
+    for w, h, label in RESOLUTIONS:
+        for batch in range(1, 7):
+            image = torch.rand(batch, h, w, 3, device=args.device)
+            legacy = _timeit(lambda: node._compress_with_pil(image, **LIMITS), args.repeat)
+            fast = _timeit(lambda: node.compress_image(image, **LIMITS), args.repeat)
+            print(f"{f'{w}x{h} {label}':<22}{batch:>4}{legacy * 1000:>12.1f}"
+                  f"{fast * 1000:>12.1f}{legacy / max(fast, 1e-9):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+提示词构建与指令解析微基准
+
+覆盖机器人主机上的 CPU 热路径：
+- _build_comfyui_prompt（文生图 / 图生图 + 多个 LoRA）
+- build_workflow、_inject_images_to_prompt（随插件发布的 workflow/* 与数百节点的合成图）
+- parse_lora_params / parse_model_params（数千个 LoRA / 模型：精确、唯一模糊、歧义、未找到）
+- parse_workflow_params、tokenize_workflow_args（handle_workflow 的参数切分）、parse_command
+
+每项自动确定循环次数（单轮约 --min-time 秒），取 --repeat 轮的中位数，单位微秒/次。
+结果可保存为基线（benchmarks/baselines/prompt_building.json），之后用 --check 对比，
+慢于基线 × (1 + tolerance) + slack 的项视为回归。基线与机器有关，换机器后应重新保存。
+
+用法：
+    python benchmarks/bench_prompt_building.py [--loras 1000 5000] [--nodes 500]
+        [--filter lora] [--save-baseline] [--check] [--tolerance 0.5]
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+from workflow_engine import WorkflowEngine  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines", "prompt_building.json")
+
+
+def _expect_error(fn: Callable, *args):
+    """歧义 / 未找到时解析函数抛 ValueError，这也是被测路径的一部分"""
+    def _run():
+        try:
+            fn(*args)
+        except ValueError:
+            pass
+    return _run
+
+
+def make_engine(lora_count: int, model_count: int, tmp: str) -> WorkflowEngine:
+    with open(os.path.join(ROOT, "_conf_schema.json"), encoding="utf-8") as f:
+        config = {k: v.get("default") for k, v in json.load(f).items()}
+    config.update(
+        comfyui_url=[],
+        auto_save_directory=tmp,
+        lora_config=[f"style_{i:05d}_v{i % 7}.safetensors,风格{i:05d} style {i}"
+                     for i in range(lora_count)],
+        model_config=[f"ckpt_{i:05d}.safetensors,模型{i:05d} model {i}" for i in range(model_count)],
+        max_lora_count=10,
+    )
+    # 没有运行中的事件循环：不启动监控、数据库等后台任务
+    return WorkflowEngine(config, plugin_dir=ROOT)
+
+
+def synthetic_workflow(nodes: int, params: int) -> Tuple[dict, dict]:
+    """nodes 个节点的链式图，其中 params 个节点各暴露一个带别名的参数，前 4 个为图片输入"""
+    graph = {}
+    for i in range(nodes):
+        inputs = {"value": i, "strength": 0.5, "text": f"node {i}"}
+        if i:
+            inputs["input"] = [str(i - 1), 0]
+        graph[str(i)] = {"inputs": inputs, "class_type": "LoadImage" if i < 4 else f"Node{i % 13}",
+                         "_meta": {"title": f"节点{i}"}}
+    graph[str(nodes)] = {"inputs": {"images": [str(nodes - 1), 0]}, "class_type": "SaveImage"}
+    node_configs = {}
+    step = max(1, nodes // params)
+    for j, nid in enumerate(range(4, nodes, step)):
+        if j >= params:
+            break
+        node_configs[str(nid)] = {"value": {"type": "number", "default": j, "aliases": [f"参数{j}", f"p{j}"]}}
+    config = {
+        "name": "synthetic", "prefix": "合成",
+        "input_nodes": ["0", "1", "2", "3"],
+        "input_mappings": {str(i): {"parameter_name": "image", "image_index": i if i % 2 else None}
+                           for i in range(4)},
+        "node_configs": node_configs,
+        "output_nodes": [str(nodes)],
+    }
+    return graph, config
+
+
+def build_cases(eng: WorkflowEngine, args, lora_count: int) -> Dict[str, Callable[[], object]]:
+    cases: Dict[str, Callable[[], object]] = {}
+    suffix = f"[{lora_count}]"
+
+    loras = [{"name": f"风格{i}", "filename": f"style_{i:05d}.safetensors",
+              "strength_model": 1.0, "strength_clip": 1.0} for i in range(5)]
+    cases["build_prompt/txt2img"] = lambda: eng._build_comfyui_prompt(
+        "a cat", 1, 1024, 1024, batch_size=2)
+    cases["build_prompt/img2img+5lora"] = lambda: eng._build_comfyui_prompt(
+        "a cat", 1, 1024, 1024, image_filename="in.png", denoise=0.6, lora_list=loras)
+
+    for wfn, info in sorted(eng.workflows.items()):
+        wcfg, wdata = info["config"], info["workflow"]
+        images = [f"in_{i}.png" for i in range(len(wcfg.get("input_nodes", [])))]
+        text = "一只在雪地里奔跑的狐狸 电影感"
+        for nc in wcfg.get("node_configs", {}).values():
+            for pname, pinfo in nc.items():
+                if "default" in pinfo and pinfo.get("type") == "number":
+                    text += f" {(pinfo.get('aliases') or [pname])[0]}:{pinfo['default']}"
+        wf_args = eng.tokenize_workflow_args(text, wcfg)
+        params = eng.parse_workflow_params(wf_args, wcfg)
+        cases[f"build_workflow/{wfn}"] = (
+            lambda d=wdata, c=wcfg, p=params, im=images: eng.build_workflow(d, c, p, im))
+        cases[f"tokenize/{wfn}"] = lambda t=text, c=wcfg: eng.tokenize_workflow_args(t, c)
+        cases[f"parse_workflow_params/{wfn}"] = lambda a=wf_args, c=wcfg: eng.parse_workflow_params(a, c)
+        if images:
+            # 注入会原地修改图，用副本避免改动已加载的 workflow
+            wcopy = copy.deepcopy(wdata)
+            cases[f"inject_images/{wfn}"] = (
+                lambda d=wcopy, c=wcfg, im=images: eng._inject_images_to_prompt(d, c, im))
+
+    graph, scfg = synthetic_workflow(args.nodes, args.params)
+    s_images = ["a.png", "b.png", "c.png", "d.png"]
+    s_text = "合成图提示词 " + " ".join(f"参数{j}:{j}" for j in range(0, args.params, 3))
+    s_args = eng.tokenize_workflow_args(s_text, scfg)
+    s_params = eng.parse_workflow_params(s_args, scfg)
+    n = f"[{args.nodes}n]"
+    cases[f"build_workflow/synthetic{n}"] = lambda: eng.build_workflow(graph, scfg, s_params, s_images)
+    cases[f"inject_images/synthetic{n}"] = lambda: eng._inject_images_to_prompt(graph, scfg, s_images)
+    cases[f"tokenize/synthetic{n}"] = lambda: eng.tokenize_workflow_args(s_text, scfg)
+    cases[f"parse_workflow_params/synthetic{n}"] = lambda: eng.parse_workflow_params(s_args, scfg)
+
+    cases["parse_command/aimg"] = lambda: eng.parse_command(
+        "@机器人 aimg 一只猫 宽1024,高768 批量2 lora:风格00001:0.8 model:模型00002", "aimg")
+
+    last = lora_count - 1
+    stem = f"style_{last:05d}_v{last % 7}"
+    cases[f"parse_lora/exact{suffix}"] = lambda: eng.parse_lora_params(["一只", "猫", f"lora:{stem}"])
+    # 描述同时出现在「描述」和「文件名」两个键的值里，唯一模糊匹配须用只在文件名中出现的片段
+    cases[f"parse_lora/fuzzy_unique{suffix}"] = lambda: eng.parse_lora_params(
+        [f"lora:{last:05d}_v{last % 7}:0.8!0.6"])
+    cases[f"parse_lora/fuzzy_x3{suffix}"] = lambda: eng.parse_lora_params(
+        [f"lora:{i:05d}_v{i % 7}" for i in (last, last - 1, last - 2)])
+    cases[f"parse_lora/ambiguous{suffix}"] = _expect_error(eng.parse_lora_params, ["lora:风格0000"])
+    cases[f"parse_lora/not_found{suffix}"] = _expect_error(eng.parse_lora_params, ["lora:不存在"])
+    cases[f"parse_lora/no_lora{suffix}"] = lambda: eng.parse_lora_params(
+        ["一只", "猫", "宽1024,高768", "批量2"])
+    cases[f"parse_model/exact{suffix}"] = lambda: eng.parse_model_params([f"model:ckpt_{last:05d}"])
+    cases[f"parse_model/fuzzy_unique{suffix}"] = lambda: eng.parse_model_params([f"model:pt_{last:05d}"])
+    cases[f"parse_model/ambiguous{suffix}"] = _expect_error(eng.parse_model_params, ["model:模型0000"])
+    return cases
+
+
+def measure(fn: Callable[[], object], min_time: float, repeat: int) -> float:
+    """返回单次调用耗时的中位数（微秒）"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4 or number >= 1 << 20:
+            break
+        number *= 2
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number * 1e6)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词构建与指令解析微基准")
+    parser.add_argument("--loras", type=int, nargs="+", default=[1000, 5000],
+                        help="LoRA / 模型条目数（每个规模各跑一遍解析用例）")
+    parser.add_argument("--nodes", type=int, default=500, help="合成图节点数")
+    parser.add_argument("--params", type=int, default=60, help="合成图暴露的参数数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮最短时间（秒）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--check", action="store_true", help="与基线对比，回归时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--slack", type=float, default=2.0, help="绝对余量（微秒），避免几微秒的用例误报")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    # 引擎在没有事件循环时创建的后台协程不会被调度
+    warnings.filterwarnings("ignore", "coroutine .* was never awaited", RuntimeWarning)
+
+    tmp = tempfile.mkdtemp(prefix="bench_prompt_")
+    results: Dict[str, float] = {}
+    try:
+        for lora_count in args.loras:
+            eng = make_engine(lora_count, lora_count, tmp)
+            for name, fn in build_cases(eng, args, lora_count).items():
+                if name in results or args.filter not in name:
+                    continue
+                results[name] = round(measure(fn, args.min_time, args.repeat), 3)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    baseline: Dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'用例':<44}{'µs/次':>12}{'基线':>12}{'变化':>9}")
+    regressions: List[str] = []
+    for name, value in results.items():
+        ref = baseline.get(name)
+        change = f"{(value / ref - 1) * 100:+.0f}%" if ref else ""
+        print(f"{name:<44}{value:>12.2f}{(f'{ref:.2f}' if ref else '-'):>12}{change:>9}")
+        if ref and value > ref * (1 + args.tolerance) + args.slack:
+            regressions.append(f"{name}: {value:.2f}µs > 基线 {ref:.2f}µs")
+
+    if args.save_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n基线已保存：{args.baseline}")
+
+    if args.check:
+        if not baseline:
+            raise SystemExit(f"基线不存在：{args.baseline}")
+        if regressions:
+            print("\n回归：\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\n与基线一致")
+
+
+if __name__ == "__main__":
+    main()
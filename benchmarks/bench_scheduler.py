@@ -0,0 +1,72 @@
+"""
+延迟动作调度基准测试
+
+对比「每个延迟动作一个 sleep 任务」与 DelayedScheduler（最小堆 + 单个定时器）
+在 N 个待撤回消息下的任务数、内存占用与调度开销。
+
+用法：
+    python benchmarks/bench_scheduler.py [--pending 1000 10000 50000] [--delay 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import DelayedScheduler  # noqa: E402
+
+
+async def _recall(event, message_id):
+    pass
+
+
+async def _legacy(pending: int, delay: float):
+    async def _delayed_recall(event, message_id):
+        await asyncio.sleep(delay)
+        await _recall(event, message_id)
+
+    tasks = [asyncio.create_task(_delayed_recall(None, i)) for i in range(pending)]
+    await asyncio.sleep(0)
+    return lambda: [t.cancel() for t in tasks]
+
+
+async def _scheduled(pending: int, delay: float):
+    scheduler = DelayedScheduler()
+    for i in range(pending):
+        scheduler.call_later(delay, _recall, None, i)
+    await asyncio.sleep(0)
+    return scheduler.close
+
+
+async def _measure(label: str, setup, pending: int, delay: float):
+    tracemalloc.start()
+    base_tasks = len(asyncio.all_tasks())
+    start = time.perf_counter()
+    stop = await setup(pending, delay)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tasks = len(asyncio.all_tasks()) - base_tasks
+    tracemalloc.stop()
+    result = stop()
+    if asyncio.iscoroutine(result):
+        await result
+    await asyncio.sleep(0)
+    print(f"{label:<20}{pending:>8}{tasks:>10}{current / 1024 / 1024:>12.2f}{elapsed * 1000:>12.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="延迟动作调度基准测试")
+    parser.add_argument("--pending", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--delay", type=float, default=20)
+    args = parser.parse_args()
+
+    print(f"{'实现':<20}{'待执行':>8}{'任务数':>10}{'内存(MB)':>12}{'调度(ms)':>12}")
+    for pending in args.pending:
+        await _measure("每个动作一个任务", _legacy, pending, args.delay)
+        await _measure("DelayedScheduler", _scheduled, pending, args.delay)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
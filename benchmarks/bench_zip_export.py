@@ -0,0 +1,80 @@
+"""
+输出压缩包导出基准测试
+
+对比旧实现（每次 ZIP_DEFLATED 整体重建）与当日增量压缩包（ZIP_STORED 追加）
+在「忙碌的一天」中重复导出的耗时：首次导出、无新增时再次导出、新增一张后导出。
+
+用法：
+    python benchmarks/bench_zip_export.py [--files 80] [--size-kb 1500]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from workflow_engine import WorkflowEngine  # noqa: E402
+
+
+def _legacy_zip(zip_path: Path, image_files):
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for f in image_files:
+            if os.path.exists(f):
+                zf.write(f, os.path.basename(f))
+
+
+def _make_images(out_dir: Path, start: int, count: int, size: int):
+    files = []
+    for i in range(start, start + count):
+        # 随机数据近似已压缩的 PNG 负载
+        path = out_dir / f"20260101_120000_ComfyUI_{i:05d}_.png"
+        path.write_bytes(b"\x89PNG\r\n\x1a\n" + os.urandom(size))
+        files.append(str(path))
+    return files
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输出压缩包导出基准测试")
+    parser.add_argument("--files", type=int, default=80)
+    parser.add_argument("--size-kb", type=int, default=1500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        out_dir = tmp / "output"
+        out_dir.mkdir()
+        files = _make_images(out_dir, 0, args.files, args.size_kb * 1024)
+        legacy_zip = tmp / "legacy.zip"
+        daily_zip = tmp / "archives" / "2026-01-01" / "daily.zip"
+
+        rows = [("首次导出",
+                 _timed(lambda: _legacy_zip(legacy_zip, files)),
+                 _timed(lambda: WorkflowEngine._update_zip(daily_zip, files))),
+                ("无新增再次导出",
+                 _timed(lambda: _legacy_zip(legacy_zip, files)),
+                 _timed(lambda: WorkflowEngine._update_zip(daily_zip, files)))]
+        files += _make_images(out_dir, args.files, 1, args.size_kb * 1024)
+        rows.append(("新增一张后导出",
+                     _timed(lambda: _legacy_zip(legacy_zip, files)),
+                     _timed(lambda: WorkflowEngine._update_zip(daily_zip, files))))
+
+        print(f"{args.files} 个文件 × {args.size_kb}KB")
+        print(f"{'场景':<16}{'旧实现(ms)':>12}{'增量(ms)':>12}{'加速比':>8}")
+        for label, legacy, incremental in rows:
+            print(f"{label:<16}{legacy * 1000:>12.1f}{incremental * 1000:>12.1f}"
+                  f"{legacy / max(incremental, 1e-9):>7.1f}x")
+        with zipfile.ZipFile(daily_zip) as zf:
+            assert zf.testzip() is None and len(zf.namelist()) == len(files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""
+ComfyUI 替身服务器 — 不需要 GPU，用于吞吐量基准测试和故障演练
+
+实现引擎用到的接口：
+    POST /prompt            入队，返回 prompt_id
+    GET  /history/{id}      完成后返回 outputs 与 status（含 execution_start/success 时间戳）
+    GET  /api/queue, /queue queue_running / queue_pending
+    POST /queue             {"delete": [...]} 删除排队中的 prompt
+    POST /interrupt         中断正在执行的 prompt（可带 prompt_id）
+    GET  /view              返回指定大小的输出文件
+    POST /upload/image      接收上传，返回文件名
+    GET  /system_stats      静态的系统信息
+    GET  /object_info       常用节点的最小定义
+    GET  /ws?clientId=      推送 execution_start / progress / executing / execution_success
+
+故障注入（inject / clear / restart，或 POST /_chaos {"mode", "paths", "duration"}）：
+    drop          直接断开连接（客户端看到 ServerDisconnected）
+    hang          请求挂起直到故障清除（客户端超时）
+    error500      返回 HTTP 500
+    lose_history  prompt 照常执行，但不写入 history（引擎只能靠空队列检测发现）
+    restart       停止监听 duration 秒，丢弃排队、执行中和历史记录后在原端口重启
+paths 为路径前缀列表，只对匹配的请求生效（默认全部，/_chaos 本身不受影响）。
+
+与真实 ComfyUI 一样按提交顺序串行执行；每个 prompt 的执行时间为
+exec_delay + steps × step_delay（加上 ±jitter 的随机抖动），批量数从
+EmptyLatentImage / RepeatLatentBatch 等节点读取，每个 Save* 节点输出 batch 个文件。
+
+单独运行：
+    python benchmarks/fake_comfyui.py --port 8188 --exec-delay 2 --output-kb 800
+    curl -X POST localhost:8188/_chaos -d '{"mode": "error500", "paths": ["/history"], "duration": 30}'
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+FAULT_MODES = ("drop", "hang", "error500", "lose_history")
+
+
+class FakePrompt:
+    __slots__ = ("prompt_id", "number", "client_id", "prompt", "steps", "batch",
+                 "outputs", "messages", "done", "interrupted")
+
+    def __init__(self, prompt_id: str, number: int, client_id: str, prompt: dict):
+        self.prompt_id = prompt_id
+        self.number = number
+        self.client_id = client_id
+        self.prompt = prompt
+        self.steps = 20
+        self.batch = 1
+        self.outputs: Dict[str, dict] = {}
+        self.messages: List[list] = []
+        self.done = False
+        self.interrupted = False
+
+
+class FakeComfyUI:
+    """ComfyUI 替身"""
+
+    HISTORY_SIZE = 10000
+
+    def __init__(self, exec_delay: float = 1.0, step_delay: float = 0.0, jitter: float = 0.0,
+                 output_size: int = 512 * 1024, fail_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            exec_delay: 每个 prompt 的固定执行时间（秒）
+            step_delay: 每个采样步的额外时间（秒），并按步推送 progress
+            jitter: 执行时间的随机抖动比例（0.1 表示 ±10%）
+            output_size: 每个输出文件的字节数
+            fail_rate: prompt 执行失败（history 中 status_str=error）的概率
+        """
+        self.exec_delay = exec_delay
+        self.step_delay = step_delay
+        self.jitter = jitter
+        self.output_size = output_size
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.pending: "OrderedDict[str, FakePrompt]" = OrderedDict()
+        self.running: Optional[FakePrompt] = None
+        self.history: "OrderedDict[str, FakePrompt]" = OrderedDict()
+        self.uploads: Dict[str, int] = {}
+        self.sockets: Dict[str, web.WebSocketResponse] = {}
+        self.stats = {"prompts": 0, "uploads": 0, "views": 0, "history_polls": 0,
+                      "queue_polls": 0, "interrupts": 0}
+        self._counter = 0
+        self._wakeup = asyncio.Event()
+        self._cancel_running = asyncio.Event()
+        self._executor: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._payload = self._make_payload(output_size)
+        self.url = ""
+        self._host = "127.0.0.1"
+        self._port = 0
+        # 故障注入状态
+        self.fault: Optional[str] = None
+        self.fault_paths: tuple = ()
+        self._fault_cleared = asyncio.Event()
+        self._fault_cleared.set()
+        self._fault_timer: Optional[asyncio.TimerHandle] = None
+        # 执行成功的 prompt（按完成顺序），供故障演练统计重复执行
+        self.completed: List[FakePrompt] = []
+
+    # ==================== 生命周期 ====================
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024,
+                              middlewares=[self._fault_middleware])
+        r = app.router
+        r.add_post("/_chaos", self.handle_chaos)
+        r.add_post("/prompt", self.handle_prompt)
+        r.add_get("/history/{prompt_id}", self.handle_history)
+        r.add_get("/api/queue", self.handle_queue)
+        r.add_get("/queue", self.handle_queue)
+        r.add_post("/queue", self.handle_queue_delete)
+        r.add_post("/interrupt", self.handle_interrupt)
+        r.add_get("/view", self.handle_view)
+        r.add_post("/upload/image", self.handle_upload)
+        r.add_get("/system_stats", self.handle_system_stats)
+        r.add_get("/object_info", self.handle_object_info)
+        r.add_get("/ws", self.handle_ws)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """启动服务，port=0 时随机分配端口；返回基础 URL"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port, reuse_address=True)
+        await site.start()
+        sock = site._server.sockets[0]
+        self._host, self._port = host, sock.getsockname()[1]
+        self.url = f"http://{host}:{self._port}"
+        self._executor = asyncio.create_task(self._execute_loop())
+        return self.url
+
+    async def stop(self):
+        self.clear()
+        if self._executor:
+            self._executor.cancel()
+            try:
+                await self._executor
+            except asyncio.CancelledError:
+                pass
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # ==================== 故障注入 ====================
+
+    def inject(self, mode: str, paths=None, duration: float = 0):
+        """开始注入故障；duration > 0 时到期自动清除"""
+        if mode not in FAULT_MODES:
+            raise ValueError(f"未知故障类型：{mode}")
+        self.clear()
+        self.fault = mode
+        self.fault_paths = tuple(paths or ())
+        self._fault_cleared.clear()
+        if duration > 0:
+            self._fault_timer = asyncio.get_event_loop().call_later(duration, self.clear)
+
+    def clear(self):
+        if self._fault_timer is not None:
+            self._fault_timer.cancel()
+            self._fault_timer = None
+        self.fault = None
+        self.fault_paths = ()
+        self._fault_cleared.set()
+
+    async def restart(self, down_for: float = 1.0):
+        """模拟 ComfyUI 进程重启：断开所有连接，丢失排队、执行中和历史，在原端口重新监听"""
+        await self.stop()
+        self.pending.clear()
+        self.running = None
+        self.history.clear()
+        await asyncio.sleep(down_for)
+        await self.start(self._host, self._port)
+
+    def _fault_applies(self, path: str) -> bool:
+        if self.fault is None or self.fault == "lose_history" or path == "/_chaos":
+            return False
+        return not self.fault_paths or path.startswith(self.fault_paths)
+
+    @web.middleware
+    async def _fault_middleware(self, request: web.Request, handler):
+        if self._fault_applies(request.path):
+            if self.fault == "drop":
+                # 关闭底层连接，响应不会再发出
+                request.transport.close()
+                return web.Response(status=204)
+            if self.fault == "error500":
+                return web.Response(status=500, text="fault injection")
+            if self.fault == "hang":
+                await self._fault_cleared.wait()
+        return await handler(request)
+
+    async def handle_chaos(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        mode = body.get("mode")
+        duration = float(body.get("duration", 0))
+        if mode == "restart":
+            asyncio.create_task(self.restart(duration or 1.0))
+        elif mode in (None, "", "clear"):
+            self.clear()
+        elif mode in FAULT_MODES:
+            self.inject(mode, body.get("paths"), duration)
+        else:
+            return web.json_response({"error": f"unknown mode {mode}"}, status=400)
+        return web.json_response({"mode": mode or "clear"})
+
+    # ==================== 执行 ====================
+
+    @staticmethod
+    def _make_payload(size: int) -> bytes:
+        size = max(size, len(PNG_SIGNATURE))
+        return PNG_SIGNATURE + os.urandom(size - len(PNG_SIGNATURE))
+
+    @staticmethod
+    def _inspect(prompt: dict, fp: FakePrompt):
+        """从图中读取步数、批量和输出节点"""
+        for nid, node in prompt.items():
+            if not isinstance(node, dict):
+                continue
+            inputs = node.get("inputs", {})
+            ctype = node.get("class_type", "")
+            if isinstance(inputs.get("steps"), int):
+                fp.steps = inputs["steps"]
+            for key in ("batch_size", "amount"):
+                if isinstance(inputs.get(key), int):
+                    fp.batch = max(fp.batch, inputs[key])
+            if ctype.startswith(("Save", "Preview")) and ctype != "SaveImageWebsocket":
+                fp.outputs[nid] = {}
+
+    def _duration(self, fp: FakePrompt) -> float:
+        base = self.exec_delay + fp.steps * self.step_delay
+        if self.jitter:
+            base *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+    async def _send(self, fp: FakePrompt, msg_type: str, data: dict):
+        ws = self.sockets.get(fp.client_id)
+        if ws is None or ws.closed:
+            return
+        try:
+            await ws.send_str(json.dumps({"type": msg_type, "data": data}))
+        except ConnectionError:
+            pass
+
+    async def _execute_loop(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            _, fp = self.pending.popitem(last=False)
+            self.running = fp
+            self._cancel_running.clear()
+            now_ms = lambda: int(time.time() * 1000)
+            fp.messages.append(["execution_start", {"prompt_id": fp.prompt_id, "timestamp": now_ms()}])
+            await self._send(fp, "execution_start", {"prompt_id": fp.prompt_id})
+            duration = self._duration(fp)
+            steps = fp.steps if self.step_delay > 0 else 1
+            for step in range(1, steps + 1):
+                try:
+                    await asyncio.wait_for(self._cancel_running.wait(), duration / steps)
+                except asyncio.TimeoutError:
+                    if self.step_delay > 0:
+                        await self._send(fp, "progress", {"value": step, "max": steps,
+                                                          "prompt_id": fp.prompt_id})
+                else:
+                    fp.interrupted = True
+                    break
+            failed = not fp.interrupted and self.fail_rate and self.rng.random() < self.fail_rate
+            if fp.interrupted:
+                fp.messages.append(["execution_interrupted", {"prompt_id": fp.prompt_id,
+                                                             "timestamp": now_ms()}])
+            elif failed:
+                fp.messages.append(["execution_error", {"prompt_id": fp.prompt_id,
+                                                       "timestamp": now_ms()}])
+            else:
+                for nid in fp.outputs:
+                    fp.outputs[nid] = {"images": [
+                        {"filename": f"fake_{fp.prompt_id[:8]}_{nid}_{i:05d}_.png",
+                         "subfolder": "", "type": "output"} for i in range(fp.batch)]}
+                fp.messages.append(["execution_success", {"prompt_id": fp.prompt_id,
+                                                         "timestamp": now_ms()}])
+                self.completed.append(fp)
+            fp.done = True
+            self.running = None
+            if self.fault != "lose_history":
+                self.history[fp.prompt_id] = fp
+            while len(self.history) > self.HISTORY_SIZE:
+                self.history.popitem(last=False)
+            await self._send(fp, "executing", {"node": None, "prompt_id": fp.prompt_id})
+            if not fp.interrupted and not failed:
+                await self._send(fp, "execution_success", {"prompt_id": fp.prompt_id})
+
+    # ==================== 接口 ====================
+
+    async def handle_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({"error": {"type": "prompt_no_outputs"}}, status=400)
+        self._counter += 1
+        fp = FakePrompt(str(uuid.uuid4()), self._counter, body.get("client_id", ""), prompt)
+        self._inspect(prompt, fp)
+        if not fp.outputs:
+            return web.json_response({"error": {"type": "prompt_no_outputs"}}, status=400)
+        self.pending[fp.prompt_id] = fp
+        self.stats["prompts"] += 1
+        self._wakeup.set()
+        return web.json_response({"prompt_id": fp.prompt_id, "number": fp.number, "node_errors": {}})
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        self.stats["history_polls"] += 1
+        fp = self.history.get(request.match_info["prompt_id"])
+        if fp is None:
+            return web.json_response({})
+        success = fp.messages and fp.messages[-1][0] == "execution_success"
+        return web.json_response({fp.prompt_id: {
+            "prompt": [fp.number, fp.prompt_id, fp.prompt, {"client_id": fp.client_id}, list(fp.outputs)],
+            "outputs": fp.outputs if success else {},
+            "status": {"status_str": "success" if success else "error",
+                       "completed": bool(success), "messages": fp.messages},
+        }})
+
+    def _queue_item(self, fp: FakePrompt) -> list:
+        return [fp.number, fp.prompt_id, {}, {"client_id": fp.client_id}, list(fp.outputs)]
+
+    async def handle_queue(self, request: web.Request) -> web.Response:
+        self.stats["queue_polls"] += 1
+        return web.json_response({
+            "queue_running": [self._queue_item(self.running)] if self.running else [],
+            "queue_pending": [self._queue_item(fp) for fp in self.pending.values()],
+        })
+
+    async def handle_queue_delete(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("clear"):
+            self.pending.clear()
+        for pid in body.get("delete", []):
+            self.pending.pop(pid, None)
+        return web.json_response({})
+
+    async def handle_interrupt(self, request: web.Request) -> web.Response:
+        self.stats["interrupts"] += 1
+        try:
+            body = await request.json()
+        except ValueError:
+            body = {}
+        pid = body.get("prompt_id") if isinstance(body, dict) else None
+        if self.running and (not pid or pid == self.running.prompt_id):
+            self._cancel_running.set()
+        return web.json_response({})
+
+    async def handle_view(self, request: web.Request) -> web.StreamResponse:
+        self.stats["views"] += 1
+        if not request.query.get("filename"):
+            return web.Response(status=400)
+        return web.Response(body=self._payload, content_type="image/png")
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        reader = await request.multipart()
+        name, size = "upload.png", 0
+        async for part in reader:
+            if part.name == "image":
+                name = part.filename or name
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+            else:
+                await part.release()
+        self.uploads[name] = size
+        self.stats["uploads"] += 1
+        return web.json_response({"name": name, "subfolder": "", "type": "input"})
+
+    async def handle_system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "system": {"os": "posix", "python_version": "3.11", "comfyui_version": "fake",
+                       "ram_total": 64 << 30, "ram_free": 48 << 30},
+            "devices": [{"name": "fake:0", "type": "cuda", "index": 0,
+                         "vram_total": 24 << 30, "vram_free": 20 << 30}],
+        })
+
+    async def handle_object_info(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "KSampler": {"input": {"required": {"steps": ["INT", {"default": 20}]}},
+                         "output": ["LATENT"], "category": "sampling"},
+            "CheckpointLoaderSimple": {"input": {"required": {"ckpt_name": [["fake.safetensors"]]}},
+                                       "output": ["MODEL", "CLIP", "VAE"], "category": "loaders"},
+            "SaveImage": {"input": {"required": {"images": ["IMAGE"]}}, "output": [],
+                          "output_node": True, "category": "image"},
+        })
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self.sockets[client_id] = ws
+        try:
+            await ws.send_str(json.dumps({"type": "status", "data": {
+                "status": {"exec_info": {"queue_remaining": len(self.pending)}}, "sid": client_id}}))
+            async for _ in ws:
+                pass
+        finally:
+            self.sockets.pop(client_id, None)
+        return ws
+
+
+async def _serve(args):
+    fake = FakeComfyUI(exec_delay=args.exec_delay, step_delay=args.step_delay,
+                       jitter=args.jitter, output_size=args.output_kb * 1024,
+                       fail_rate=args.fail_rate)
+    url = await fake.start(args.host, args.port)
+    print(f"ComfyUI 替身已启动: {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ComfyUI 替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--exec-delay", type=float, default=1.0)
+    parser.add_argument("--step-delay", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--output-kb", type=int, default=512)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
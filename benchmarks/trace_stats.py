@@ -0,0 +1,119 @@
+"""
+任务追踪统计 — 从 task_traces.jsonl 计算各阶段耗时分位数
+
+每个任务先按阶段名合并（多段 download 求和），再对所有任务计算 P50/P90/P99/最大值。
+额外列出：
+- comfy_exec：ComfyUI 历史记录中的实际执行时长
+- wait+poll：execute 减去 comfy_exec，即 ComfyUI 内部排队与轮询发现完成的延迟
+- total：入队到结果发送完成
+
+用法：
+    python benchmarks/trace_stats.py <task_traces.jsonl> [更多文件...]
+        [--kind txt2img] [--server 名称] [--status success] [--hours 24] [--slowest 5]
+"""
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+STAGE_ORDER = ["queue", "upload", "prompt", "execute", "comfy_exec", "wait+poll",
+               "download", "send", "total"]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩法分位数，values 须已排序"""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def load(paths: List[str], args) -> List[dict]:
+    since = time.time() - args.hours * 3600 if args.hours else 0
+    records = []
+    for path in paths:
+        try:
+            f = open(path, encoding="utf-8")
+        except OSError as e:
+            print(f"跳过 {path}: {e}", file=sys.stderr)
+            continue
+        with f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("ts", 0) < since:
+                    continue
+                if args.kind and rec.get("kind") != args.kind:
+                    continue
+                if args.server and rec.get("server") != args.server:
+                    continue
+                if args.status and rec.get("status") != args.status:
+                    continue
+                records.append(rec)
+    return records
+
+
+def stage_totals(rec: dict) -> Dict[str, float]:
+    totals: Dict[str, float] = defaultdict(float)
+    for name, _, dur in rec.get("spans", []):
+        totals[name] += dur
+    comfy = (rec.get("attrs") or {}).get("comfy_exec")
+    if comfy is not None:
+        totals["comfy_exec"] = comfy
+        if "execute" in totals:
+            totals["wait+poll"] = max(0.0, totals["execute"] - comfy)
+    totals["total"] = rec.get("total", 0.0)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务追踪各阶段耗时分位数")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--kind", help="只统计该任务类型（txt2img / img2img / wf:<名称>）")
+    parser.add_argument("--server", help="只统计该服务器")
+    parser.add_argument("--status", help="只统计该状态（success / failed / cancelled / dropped）")
+    parser.add_argument("--hours", type=float, default=0, help="只统计最近若干小时")
+    parser.add_argument("--slowest", type=int, default=0, help="列出最慢的 N 个任务")
+    args = parser.parse_args()
+
+    records = load(args.paths, args)
+    if not records:
+        print("没有符合条件的记录")
+        return
+
+    per_stage: Dict[str, List[float]] = defaultdict(list)
+    for rec in records:
+        for name, value in stage_totals(rec).items():
+            per_stage[name].append(value)
+
+    statuses = defaultdict(int)
+    for rec in records:
+        statuses[rec.get("status", "")] += 1
+    print(f"任务数：{len(records)}（" + "，".join(f"{k} {v}" for k, v in sorted(statuses.items())) + "）\n")
+
+    print(f"{'阶段':<12}{'次数':>8}{'P50':>10}{'P90':>10}{'P99':>10}{'最大':>10}{'平均':>10}")
+    names = [n for n in STAGE_ORDER if n in per_stage] + sorted(set(per_stage) - set(STAGE_ORDER))
+    for name in names:
+        values = sorted(per_stage[name])
+        print(f"{name:<12}{len(values):>8}"
+              f"{percentile(values, 50):>10.2f}{percentile(values, 90):>10.2f}"
+              f"{percentile(values, 99):>10.2f}{values[-1]:>10.2f}"
+              f"{sum(values) / len(values):>10.2f}")
+
+    if args.slowest:
+        print(f"\n最慢的 {args.slowest} 个任务：")
+        for rec in sorted(records, key=lambda r: r.get("total", 0), reverse=True)[:args.slowest]:
+            totals = stage_totals(rec)
+            detail = " ".join(f"{n}={totals[n]:.1f}" for n in STAGE_ORDER
+                              if n in totals and n != "total")
+            when = time.strftime("%m-%d %H:%M:%S", time.localtime(rec.get("ts", 0)))
+            print(f"  {rec.get('trace_id')} {when} {rec.get('kind')} @{rec.get('server')} "
+                  f"total={rec.get('total', 0):.1f}s  {detail}")
+
+
+if __name__ == "__main__":
+    main()
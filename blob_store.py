@@ -0,0 +1,153 @@
+"""
+内容寻址存储 — 相同内容的文件只写一次
+
+blobs/<hash[:2]>/<hash[2:4]>/<sha256><ext> 保存文件内容，日期目录中的文件是指向它的硬链接。
+首次存储时探测一次硬链接支持：不支持（或 blobs 与保存目录跨设备）时不再写 blob，
+文件按普通方式直接保存、不返回内容哈希，行为与旧版一致，不会出现 blob 与副本各占一份空间。
+
+所有方法都是同步的文件操作，由调用方放到线程池中执行。
+"""
+import hashlib
+import logging
+import os
+import secrets
+import shutil
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger("BlobStore")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore:
+    """auto_save_dir 下的内容寻址存储"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._hardlinks: Optional[bool] = None
+
+    def blob_path(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{ext.lower()}"
+
+    @property
+    def enabled(self) -> bool:
+        """文件系统是否支持从 blobs 硬链接到保存目录（首次访问时探测）"""
+        if self._hardlinks is None:
+            self._hardlinks = self._probe_hardlinks()
+            if not self._hardlinks:
+                logger.warning(f"{self.root} 不支持硬链接，去重存储停用，文件按普通方式保存")
+        return self._hardlinks
+
+    def _probe_hardlinks(self) -> bool:
+        token = secrets.token_hex(4)
+        src = self.root / f".probe.{token}"
+        dst = self.root.parent / f".probe.{token}"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            src.touch()
+            os.link(src, dst)
+            return True
+        except OSError as e:
+            logger.debug(f"硬链接探测失败: {e}")
+            return False
+        finally:
+            for path in (src, dst):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def store_bytes(self, data: bytes, dest: Path) -> Optional[str]:
+        """保存内容并在 dest 建立链接，返回内容哈希；不支持硬链接时直接写入 dest，返回 None"""
+        if not self.enabled:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with open(dest, "wb") as f:
+                f.write(data)
+            return None
+        digest = sha256_bytes(data)
+        self._store(self.blob_path(digest, dest.suffix), lambda f: f.write(data), dest)
+        return digest
+
+    def store_file(self, src: str, dest: Path) -> Optional[str]:
+        """保存已有文件的内容并在 dest 建立链接，返回内容哈希；不支持硬链接时复制到 dest，返回 None"""
+        if not self.enabled:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src, dest)
+            return None
+        digest = sha256_file(src)
+
+        def _copy(f):
+            with open(src, "rb") as s:
+                shutil.copyfileobj(s, f, CHUNK_SIZE)
+        self._store(self.blob_path(digest, dest.suffix), _copy, dest)
+        return digest
+
+    def _store(self, blob: Path, write, dest: Path) -> None:
+        if not blob.exists():
+            self._atomic_write(blob, write)
+        try:
+            self._link(blob, dest)
+        except FileNotFoundError:
+            # blob 恰好被保留策略回收，重新写入
+            self._atomic_write(blob, write)
+            self._link(blob, dest)
+
+    def release(self, digest: str, ext: str) -> bool:
+        """
+        日期目录中的链接删除后调用：没有其他链接引用时删除 blob
+
+        Returns:
+            blob 是否被删除
+        """
+        blob = self.blob_path(digest, ext)
+        try:
+            if os.stat(blob).st_nlink > 1:
+                return False
+            os.remove(blob)
+        except FileNotFoundError:
+            return False
+        for parent in (blob.parent, blob.parent.parent):
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+        return True
+
+    @staticmethod
+    def _atomic_write(blob: Path, write) -> None:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = blob.with_name(f".{blob.name}.{secrets.token_hex(4)}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, blob)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def _link(self, blob: Path, dest: Path) -> None:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if dest.exists():
+            dest.unlink()
+        try:
+            os.link(blob, dest)
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            # 探测通过后的个别失败（如链接数达到上限）：复制一份，没有其他引用的 blob 随即删除
+            logger.debug(f"硬链接失败，改为复制 {dest}: {e}")
+            shutil.copy2(blob, dest)
+            self.release(blob.stem, blob.suffix)
@@ -0,0 +1,476 @@
+"""
+引擎数据库层 — 单个长连接的 aiosqlite 封装
+
+- 整个引擎共用一条连接（WAL 模式），不再每次调用都重新 connect
+- SQL 语句以模块级常量复用，由 sqlite3 的语句缓存复用预编译结果
+- 读操作不提交事务；写操作串行化，每次只提交一次
+- 图片生成记录采用写后缓冲：按行数或时间间隔合并为一个事务批量写入
+
+写后缓冲的持久性：close()（插件卸载/重载时由引擎调用）会先落盘缓冲再关闭连接；
+但进程被强制终止或崩溃时，缓冲中尚未落盘的记录（最多 flush_interval 秒、
+不超过 flush_rows 条）会丢失。这些只是目录记录，对应文件仍在磁盘上。
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger("EngineDatabase")
+
+
+# ===== 表结构 =====
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS user_downloads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        download_date TEXT NOT NULL,
+        download_count INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, download_date))''',
+    '''CREATE TABLE IF NOT EXISTS rate_buckets (
+        bucket_key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS task_durations (
+        stat_key TEXT PRIMARY KEY,
+        samples INTEGER NOT NULL,
+        mean_seconds REAL NOT NULL,
+        updated_at REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS pending_deletions (
+        path TEXT PRIMARY KEY,
+        due_at REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS image_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        generate_date TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_path TEXT,
+        file_size INTEGER,
+        media_type TEXT,
+        prompt TEXT,
+        workflow TEXT,
+        category TEXT DEFAULT 'outputs',
+        content_hash TEXT)''',
+]
+
+# 旧版数据库缺少的列（表名, 列名, 类型），连接时按需 ALTER TABLE 补齐
+MIGRATION_COLUMNS = [
+    ("image_records", "file_path", "TEXT"),
+    ("image_records", "file_size", "INTEGER"),
+    ("image_records", "media_type", "TEXT"),
+    ("image_records", "prompt", "TEXT"),
+    ("image_records", "workflow", "TEXT"),
+    # ADD COLUMN 的常量默认值会填充到已有行：旧记录都是输出图片
+    ("image_records", "category", "TEXT DEFAULT 'outputs'"),
+    ("image_records", "content_hash", "TEXT"),
+]
+
+# 索引在补齐列之后创建
+INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS idx_image_records_user_date
+        ON image_records (user_id, generate_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_image_records_date
+        ON image_records (generate_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_image_records_category
+        ON image_records (category)''',
+]
+
+# 目录表中的文件类别（与 auto_save_dir 下的子目录对应）
+CATEGORY_OUTPUTS = "outputs"
+CATEGORY_IMG2IMG_INPUTS = "img2img_inputs"
+CATEGORY_WORKFLOW_INPUTS = "workflow_inputs"
+CATEGORY_INPUTS = "inputs"
+
+# ===== 复用的语句 =====
+
+SQL_GET_DOWNLOAD_COUNT = '''SELECT download_count FROM user_downloads
+    WHERE user_id=? AND download_date=?'''
+SQL_INCREMENT_DOWNLOAD = '''INSERT INTO user_downloads (user_id, download_date, download_count)
+    VALUES (?, ?, 1)
+    ON CONFLICT(user_id, download_date) DO UPDATE SET
+        download_count=download_count+1, updated_at=CURRENT_TIMESTAMP'''
+SQL_INSERT_IMAGE_RECORD = '''INSERT INTO image_records
+    (filename, user_id, generate_date, file_path, file_size, media_type, prompt, workflow,
+     category, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SQL_USER_IMAGES_BY_DATE = '''SELECT filename FROM image_records
+    WHERE category='outputs' AND user_id=? AND generate_date=?'''
+SQL_USER_RECORDS_BY_DATE = '''SELECT filename, file_path, media_type FROM image_records
+    WHERE user_id=? AND generate_date=? AND category='outputs' ORDER BY id'''
+SQL_RECORDS_BY_DATE = '''SELECT filename, file_path, media_type FROM image_records
+    WHERE generate_date=? AND category='outputs' ORDER BY id'''
+# 容量按内容去重：同一 content_hash 的多个链接只计一次（无哈希的记录各自计入）
+SQL_CATEGORY_USAGE = '''SELECT category, SUM(links), COALESCE(SUM(size), 0) FROM (
+        SELECT category, COUNT(*) AS links, MAX(file_size) AS size FROM image_records
+        GROUP BY category, COALESCE(content_hash, 'id:' || id))
+    GROUP BY category'''
+SQL_TOTAL_USAGE = '''SELECT COALESCE(SUM(size), 0) FROM (
+        SELECT MAX(file_size) AS size FROM image_records
+        GROUP BY COALESCE(content_hash, 'id:' || id))'''
+SQL_OLDEST_RECORDS = '''SELECT id, filename, file_path, file_size, generate_date, category, content_hash
+    FROM image_records ORDER BY id LIMIT ?'''
+SQL_OLDEST_RECORDS_IN_CATEGORY = '''SELECT id, filename, file_path, file_size, generate_date, category, content_hash
+    FROM image_records WHERE category=? ORDER BY id LIMIT ?'''
+SQL_RECORDS_BEFORE_DATE = '''SELECT id, filename, file_path, file_size, generate_date, category, content_hash
+    FROM image_records WHERE generate_date<? ORDER BY id LIMIT ?'''
+SQL_RECORDS_IN_CATEGORY_AFTER = '''SELECT id, filename, file_path, file_size, generate_date, category, content_hash
+    FROM image_records WHERE category=? AND id>? ORDER BY id LIMIT ?'''
+SQL_DELETE_RECORD = "DELETE FROM image_records WHERE id=?"
+SQL_ADD_PENDING_DELETION = '''INSERT OR REPLACE INTO pending_deletions (path, due_at)
+    VALUES (?, ?)'''
+SQL_REMOVE_PENDING_DELETION = "DELETE FROM pending_deletions WHERE path=?"
+SQL_PENDING_DELETIONS = "SELECT path, due_at FROM pending_deletions ORDER BY due_at"
+SQL_SAVE_RATE_BUCKET = '''INSERT OR REPLACE INTO rate_buckets (bucket_key, tokens, updated_at)
+    VALUES (?, ?, ?)'''
+SQL_DELETE_RATE_BUCKET = "DELETE FROM rate_buckets WHERE bucket_key=?"
+SQL_RATE_BUCKETS = "SELECT bucket_key, tokens, updated_at FROM rate_buckets"
+SQL_SAVE_TASK_DURATION = '''INSERT OR REPLACE INTO task_durations
+    (stat_key, samples, mean_seconds, updated_at) VALUES (?, ?, ?, ?)'''
+SQL_TASK_DURATIONS = "SELECT stat_key, samples, mean_seconds FROM task_durations"
+SQL_TRANSCODE_CANDIDATES = '''SELECT id, filename, file_path, file_size, content_hash
+    FROM image_records WHERE category='outputs' AND media_type='image/png'
+        AND generate_date<=? AND id>? ORDER BY id LIMIT ?'''
+SQL_UPDATE_RECORD_FILE = '''UPDATE image_records
+    SET filename=?, file_path=?, file_size=?, media_type=?, content_hash=? WHERE id=?'''
+
+
+def today_str() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+class EngineDatabase:
+    """引擎持有的数据库连接（进程内单连接）"""
+
+    def __init__(self, db_path: str, flush_rows: int = 50, flush_interval: float = 0.5):
+        """
+        Args:
+            db_path: 数据库文件路径
+            flush_rows: 写后缓冲中累计多少条图片记录时立即落盘
+            flush_interval: 缓冲中最早一条记录最多等待多少秒后落盘；
+                进程崩溃时最多丢失这段时间内的记录
+        """
+        self.db_path = db_path
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = max(0.0, flush_interval)
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        # 写事务串行化：避免一个协程的 commit 提交了另一个协程未完成的多语句事务
+        self._write_lock = asyncio.Lock()
+        # 图片记录写后缓冲
+        self._pending_images: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # ==================== 连接管理 ====================
+
+    async def connect(self) -> aiosqlite.Connection:
+        """获取连接；首次调用时打开并初始化（WAL、表结构）"""
+        if self._conn is not None:
+            return self._conn
+        async with self._open_lock:
+            if self._conn is None:
+                db_dir = os.path.dirname(self.db_path)
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+                conn = await aiosqlite.connect(self.db_path, cached_statements=256)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute("PRAGMA busy_timeout=5000")
+                for stmt in SCHEMA:
+                    await conn.execute(stmt)
+                await self._migrate(conn)
+                for stmt in INDEXES:
+                    await conn.execute(stmt)
+                await conn.commit()
+                self._conn = conn
+                logger.info(f"数据库连接已打开(WAL): {self.db_path}")
+        return self._conn
+
+    @staticmethod
+    async def _migrate(conn: aiosqlite.Connection):
+        """为旧版数据库补齐新增的列"""
+        columns: dict = {}
+        for table, column, col_type in MIGRATION_COLUMNS:
+            if table not in columns:
+                async with conn.execute(f"PRAGMA table_info({table})") as cur:
+                    columns[table] = {row[1] for row in await cur.fetchall()}
+            if column not in columns[table]:
+                await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+                columns[table].add(column)
+                logger.info(f"数据库迁移: {table} 新增列 {column}")
+
+    async def close(self):
+        """落盘缓冲中的记录后关闭连接"""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"关闭前写入缓冲记录失败（{len(self._pending_images)}条）: {e}")
+        if self._conn is None:
+            return
+        async with self._write_lock:
+            try:
+                await self._conn.close()
+            finally:
+                self._conn = None
+        logger.info("数据库连接已关闭")
+
+    async def _fetchall(self, sql: str, params: tuple = ()) -> List[tuple]:
+        conn = await self.connect()
+        async with conn.execute(sql, params) as cur:
+            return list(await cur.fetchall())
+
+    async def _fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        conn = await self.connect()
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchone()
+
+    async def _write(self, sql: str, params: tuple = ()):
+        conn = await self.connect()
+        async with self._write_lock:
+            await conn.execute(sql, params)
+            await conn.commit()
+
+    # ==================== 下载次数 ====================
+
+    async def get_download_count(self, user_id: str, date: Optional[str] = None) -> int:
+        row = await self._fetchone(SQL_GET_DOWNLOAD_COUNT, (user_id, date or today_str()))
+        return row[0] if row else 0
+
+    async def increment_download_count(self, user_id: str, date: Optional[str] = None):
+        await self._write(SQL_INCREMENT_DOWNLOAD, (user_id, date or today_str()))
+
+    # ==================== 图片生成记录 ====================
+
+    @staticmethod
+    def _image_row(filename: str, user_id: str, date: Optional[str], file_path: Optional[str],
+                   file_size: Optional[int], media_type: Optional[str],
+                   prompt: Optional[str], workflow: Optional[str], category: str,
+                   content_hash: Optional[str]) -> tuple:
+        return (filename, user_id, date or today_str(), file_path, file_size,
+                media_type, prompt, workflow, category, content_hash)
+
+    async def record_image(self, filename: str, user_id: str, date: Optional[str] = None, *,
+                           file_path: Optional[str] = None, file_size: Optional[int] = None,
+                           media_type: Optional[str] = None, prompt: Optional[str] = None,
+                           workflow: Optional[str] = None, category: str = CATEGORY_OUTPUTS,
+                           content_hash: Optional[str] = None):
+        """立即写入一条图片记录（单独提交）"""
+        await self._write(SQL_INSERT_IMAGE_RECORD, self._image_row(
+            filename, user_id, date, file_path, file_size, media_type, prompt, workflow,
+            category, content_hash))
+
+    def add_image_record(self, filename: str, user_id: str, date: Optional[str] = None, *,
+                         file_path: Optional[str] = None, file_size: Optional[int] = None,
+                         media_type: Optional[str] = None, prompt: Optional[str] = None,
+                         workflow: Optional[str] = None, category: str = CATEGORY_OUTPUTS,
+                         content_hash: Optional[str] = None):
+        """
+        将图片记录放入写后缓冲（不等待落盘）
+        
+        缓冲达到 flush_rows 条时立即在后台落盘，否则最多等待 flush_interval 秒。
+        """
+        self._pending_images.append(self._image_row(
+            filename, user_id, date, file_path, file_size, media_type, prompt, workflow,
+            category, content_hash))
+        if len(self._pending_images) >= self.flush_rows:
+            self._start_background_flush()
+        elif self._flush_timer is None:
+            loop = asyncio.get_event_loop()
+            self._flush_timer = loop.call_later(self.flush_interval, self._start_background_flush)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending_images)
+
+    def _start_background_flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._background_flush())
+
+    async def _background_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            # 记录已放回缓冲，稍后重试
+            logger.error(f"批量写入图片记录失败，将重试（{len(self._pending_images)}条）: {e}")
+            if self._flush_timer is None and self._pending_images:
+                loop = asyncio.get_event_loop()
+                self._flush_timer = loop.call_later(max(self.flush_interval, 1.0),
+                                                    self._start_background_flush)
+
+    async def flush(self) -> int:
+        """
+        把缓冲中的全部图片记录在一个事务中写入
+        
+        Returns:
+            写入的行数；失败时记录放回缓冲头部并抛出异常
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        async with self._flush_lock:
+            rows, self._pending_images = self._pending_images, []
+            if not rows:
+                return 0
+            try:
+                conn = await self.connect()
+                async with self._write_lock:
+                    try:
+                        await conn.executemany(SQL_INSERT_IMAGE_RECORD, rows)
+                        await conn.commit()
+                    except Exception:
+                        await conn.rollback()
+                        raise
+            except Exception:
+                self._pending_images[:0] = rows
+                raise
+            return len(rows)
+
+    async def get_user_images(self, user_id: str, date: Optional[str] = None) -> List[str]:
+        # 先落盘缓冲中的记录，保证刚生成的图片可见
+        if self._pending_images:
+            await self.flush()
+        rows = await self._fetchall(SQL_USER_IMAGES_BY_DATE, (user_id, date or today_str()))
+        return [row[0] for row in rows]
+
+    async def get_image_records(self, date: Optional[str] = None,
+                                user_id: Optional[str] = None) -> List[tuple]:
+        """
+        按日期（可选限定用户）查询输出图片记录，走 (user_id, generate_date) / generate_date 索引
+        
+        Returns:
+            [(filename, file_path, media_type), ...]，按写入顺序；旧记录的 file_path/media_type 为 None
+        """
+        if self._pending_images:
+            await self.flush()
+        if user_id is None:
+            return await self._fetchall(SQL_RECORDS_BY_DATE, (date or today_str(),))
+        return await self._fetchall(SQL_USER_RECORDS_BY_DATE, (user_id, date or today_str()))
+
+    # ==================== 保留策略 ====================
+
+    async def get_category_usage(self) -> Dict[str, Tuple[int, int]]:
+        """{类别: (记录数, 按内容去重后的总字节数)}"""
+        if self._pending_images:
+            await self.flush()
+        rows = await self._fetchall(SQL_CATEGORY_USAGE)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    async def get_total_usage(self) -> int:
+        """全部类别按内容去重后的总字节数（跨类别共用的内容也只计一次）"""
+        if self._pending_images:
+            await self.flush()
+        row = await self._fetchone(SQL_TOTAL_USAGE)
+        return row[0] if row else 0
+
+    async def get_records_in_category(self, category: str, after_id: int, limit: int) -> List[tuple]:
+        """按 id 分页遍历某个类别的记录，字段同 get_oldest_records"""
+        if self._pending_images:
+            await self.flush()
+        return await self._fetchall(SQL_RECORDS_IN_CATEGORY_AFTER, (category, after_id, limit))
+
+    async def get_oldest_records(self, limit: int, category: Optional[str] = None,
+                                 before_date: Optional[str] = None) -> List[tuple]:
+        """
+        按写入顺序取最旧的记录
+        
+        Returns:
+            [(id, filename, file_path, file_size, generate_date, category, content_hash), ...]
+        """
+        if self._pending_images:
+            await self.flush()
+        if before_date is not None:
+            return await self._fetchall(SQL_RECORDS_BEFORE_DATE, (before_date, limit))
+        if category is not None:
+            return await self._fetchall(SQL_OLDEST_RECORDS_IN_CATEGORY, (category, limit))
+        return await self._fetchall(SQL_OLDEST_RECORDS, (limit,))
+
+    async def delete_records(self, ids: List[int]):
+        if not ids:
+            return
+        conn = await self.connect()
+        async with self._write_lock:
+            await conn.executemany(SQL_DELETE_RECORD, [(i,) for i in ids])
+            await conn.commit()
+
+    # ==================== 转码 ====================
+
+    async def get_transcode_candidates(self, before_date: str, after_id: int,
+                                       limit: int) -> List[tuple]:
+        """
+        取 before_date 及之前保存、id 大于 after_id 的 PNG 输出记录
+
+        Returns:
+            [(id, filename, file_path, file_size, content_hash), ...]
+        """
+        if self._pending_images:
+            await self.flush()
+        return await self._fetchall(SQL_TRANSCODE_CANDIDATES, (before_date, after_id, limit))
+
+    async def update_record_file(self, record_id: int, filename: str, file_path: str,
+                                 file_size: int, media_type: str, content_hash: Optional[str]):
+        await self._write(SQL_UPDATE_RECORD_FILE,
+                          (filename, file_path, file_size, media_type, content_hash, record_id))
+
+    # ==================== 待删除文件 ====================
+
+    async def save_pending_deletions(self, add: List[Tuple[str, float]], remove: List[str]):
+        """在一个事务中登记新的待删除文件、移除已删除的文件"""
+        conn = await self.connect()
+        async with self._write_lock:
+            try:
+                if add:
+                    await conn.executemany(SQL_ADD_PENDING_DELETION, add)
+                if remove:
+                    await conn.executemany(SQL_REMOVE_PENDING_DELETION, [(p,) for p in remove])
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def get_pending_deletions(self) -> List[Tuple[str, float]]:
+        return await self._fetchall(SQL_PENDING_DELETIONS)
+
+    # ==================== 限流状态 ====================
+
+    async def save_rate_buckets(self, save: List[Tuple[str, float, float]], drop: List[str]):
+        conn = await self.connect()
+        async with self._write_lock:
+            try:
+                if save:
+                    await conn.executemany(SQL_SAVE_RATE_BUCKET, save)
+                if drop:
+                    await conn.executemany(SQL_DELETE_RATE_BUCKET, [(k,) for k in drop])
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def get_rate_buckets(self) -> List[Tuple[str, float, float]]:
+        return await self._fetchall(SQL_RATE_BUCKETS)
+
+    # ==================== 任务耗时统计 ====================
+
+    async def save_task_durations(self, rows: List[Tuple[str, int, float, float]]):
+        if not rows:
+            return
+        conn = await self.connect()
+        async with self._write_lock:
+            try:
+                await conn.executemany(SQL_SAVE_TASK_DURATION, rows)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def get_task_durations(self) -> List[Tuple[str, int, float]]:
+        return await self._fetchall(SQL_TASK_DURATIONS)
@@ -0,0 +1,155 @@
+"""
+任务耗时统计与排队预估
+
+按 (任务类型/工作流, 分辨率档位, 批量, 服务器) 记录成功任务的滚动平均耗时，
+再结合队列中排在前面的任务和各服务器正在执行的任务，模拟派发顺序，
+估算新任务的开始时间和完成时间。
+
+统计项缺失时逐级回退：同服务器 → 任意服务器 → 该类型的单张平均耗时 × 批量
+→ 全部任务的单张平均耗时 × 批量 → DEFAULT_SECONDS × 批量。
+"""
+import heapq
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("EtaEstimator")
+
+# (类型, 宽, 高, 批量)
+TaskShape = Tuple[str, int, int, int]
+
+
+def resolution_bucket(width: int, height: int) -> str:
+    """分辨率按 0.25 百万像素取整分档，未知尺寸记为 "?" """
+    if not width or not height:
+        return "?"
+    return f"{max(1, round(width * height / 250000)) / 4:g}MP"
+
+
+class EtaEstimator:
+    """滚动耗时统计 + 排队模拟"""
+
+    # 没有任何历史数据时的单张耗时（秒）
+    DEFAULT_SECONDS = 60.0
+    # 样本数达到 1/ALPHA 后改为指数滑动平均，跟随模型、服务器负载变化
+    ALPHA = 0.2
+    # 统计写入数据库的合并间隔（秒）
+    PERSIST_DELAY = 30.0
+
+    def __init__(self, store=None, scheduler=None):
+        """
+        Args:
+            store: 提供 save_task_durations / get_task_durations 的数据库对象，为 None 时不持久化
+            scheduler: DelayedScheduler，用于合并写入
+        """
+        self.store = store
+        self.scheduler = scheduler
+        # 统计键 -> [样本数, 平均耗时]
+        self._stats: Dict[str, List[float]] = {}
+        self._dirty: set = set()
+        self._persist_pending = False
+
+    # ==================== 统计 ====================
+
+    @staticmethod
+    def _keys(shape: TaskShape, server: str) -> Tuple[str, str, str]:
+        kind, width, height, batch = shape
+        res = resolution_bucket(width, height)
+        return (f"{kind}|{res}|{batch}|{server}", f"{kind}|{res}|{batch}|*", f"{kind}|unit")
+
+    def record(self, shape: TaskShape, server: str, seconds: float):
+        """记录一个成功任务的耗时"""
+        if seconds <= 0:
+            return
+        batch = max(1, shape[3])
+        exact, any_server, unit = self._keys(shape, server)
+        for key, value in ((exact, seconds), (any_server, seconds),
+                           (unit, seconds / batch), ("*|unit", seconds / batch)):
+            stat = self._stats.setdefault(key, [0, 0.0])
+            stat[0] += 1
+            stat[1] += (value - stat[1]) * max(1.0 / stat[0], self.ALPHA)
+            self._dirty.add(key)
+        self._request_persist()
+
+    def estimate(self, shape: TaskShape, server: Optional[str] = None) -> float:
+        """单个任务在指定服务器（None 为任意服务器）上的预计耗时（秒）"""
+        batch = max(1, shape[3])
+        exact, any_server, unit = self._keys(shape, server or "*")
+        for key in (exact, any_server):
+            stat = self._stats.get(key)
+            if stat:
+                return stat[1]
+        for key in (unit, "*|unit"):
+            stat = self._stats.get(key)
+            if stat:
+                return stat[1] * batch
+        return self.DEFAULT_SECONDS * batch
+
+    # ==================== 排队模拟 ====================
+
+    def simulate(self, servers: Iterable[Tuple[str, float]], queued: Iterable[TaskShape],
+                 position: int) -> Optional[Tuple[float, float]]:
+        """
+        模拟空闲服务器依次领取队列任务
+
+        Args:
+            servers: 可用服务器 (名称, 当前任务剩余秒数)
+            queued: 按队列顺序排列的任务
+            position: 目标任务在 queued 中的下标
+
+        Returns:
+            (距开始秒数, 距完成秒数)；没有可用服务器时返回 None
+        """
+        heap = [(remaining, i, name) for i, (name, remaining) in enumerate(servers)]
+        if not heap:
+            return None
+        heapq.heapify(heap)
+        for index, shape in enumerate(queued):
+            free_at, i, name = heapq.heappop(heap)
+            finish = free_at + self.estimate(shape, name)
+            if index == position:
+                return free_at, finish
+            heapq.heappush(heap, (finish, i, name))
+        return None
+
+    # ==================== 持久化 ====================
+
+    def _request_persist(self):
+        if self.store is None or self.scheduler is None or self._persist_pending:
+            return
+        self._persist_pending = True
+        self.scheduler.call_later(self.PERSIST_DELAY, self.persist)
+
+    async def persist(self):
+        self._persist_pending = False
+        if self.store is None or not self._dirty:
+            return
+        now = time.time()
+        rows = [(key, int(self._stats[key][0]), self._stats[key][1], now)
+                for key in self._dirty if key in self._stats]
+        self._dirty.clear()
+        try:
+            await self.store.save_task_durations(rows)
+        except Exception as e:
+            logger.error(f"保存任务耗时统计失败: {e}")
+
+    async def restore(self) -> int:
+        if self.store is None:
+            return 0
+        rows = await self.store.get_task_durations()
+        for key, samples, mean in rows:
+            self._stats[key] = [samples, mean]
+        return len(rows)
+
+    # ==================== 提示 ====================
+
+    @staticmethod
+    def format_duration(seconds: float) -> str:
+        seconds = int(seconds + 0.5)
+        if seconds < 60:
+            return f"{max(seconds, 1)}秒"
+        minutes = (seconds + 30) // 60
+        if minutes < 60:
+            return f"{minutes}分钟"
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}小时{minutes}分钟" if minutes else f"{hours}小时"
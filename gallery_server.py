@@ -0,0 +1,242 @@
+"""
+输出画廊服务器 — 以链接代替压缩包上传
+
+在插件事件循环内运行一个 aiohttp 服务，按用户、按日期展示自动保存的输出图片：
+- 文件列表来自数据库 image_records（与压缩包导出同一份目录），不扫描目录
+- 缩略图首次访问时在线程池中生成并缓存到磁盘，按源文件路径、大小和修改时间命名
+- 原图/缩略图由 FileResponse 发送，支持 ETag / If-None-Match 与 Range
+- 链接带有效期和 HMAC 签名，过期或被篡改时返回 403
+"""
+import asyncio
+import hashlib
+import hmac
+import html
+import logging
+import os
+import secrets
+import shutil
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from aiohttp import web
+from PIL import Image, ImageOps
+
+logger = logging.getLogger("GalleryServer")
+
+
+class GalleryServer:
+    """输出画廊 HTTP 服务"""
+
+    THUMB_SIZE = 320
+    THUMB_QUALITY = 80
+    # 缩略图缓存保留天数（按日期目录清理）
+    THUMB_KEEP_DAYS = 2
+
+    def __init__(self, engine, host: str = "0.0.0.0", port: int = 7779,
+                 public_url: str = "", secret: str = "", link_ttl: int = 3600):
+        """
+        Args:
+            engine: WorkflowEngine 实例（提供 db、auto_save_dir、only_own_images）
+            host: 监听地址
+            port: 监听端口
+            public_url: 对外访问的基础地址，为空时使用 http://host:port
+            secret: 链接签名密钥，为空时每次启动随机生成（重启后旧链接失效）
+            link_ttl: 链接有效期（秒）
+        """
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.public_url = (public_url or f"http://{host}:{port}").rstrip("/")
+        self.secret = (secret or secrets.token_hex(32)).encode()
+        self.link_ttl = link_ttl
+        self.thumb_dir = Path(engine.auto_save_dir) / "thumbs"
+        self._runner: Optional[web.AppRunner] = None
+        self._thumb_locks: Dict[str, asyncio.Lock] = {}
+
+    # ==================== 生命周期 ====================
+
+    async def start(self) -> bool:
+        if self._runner is not None:
+            return True
+        try:
+            app = web.Application()
+            app.router.add_get("/g/{date}/{owner}", self._handle_index)
+            app.router.add_get("/g/{date}/{owner}/file/{name}", self._handle_file)
+            app.router.add_get("/g/{date}/{owner}/thumb/{name}", self._handle_thumb)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, self.port).start()
+            self._runner = runner
+            await asyncio.get_event_loop().run_in_executor(None, self._sweep_thumbs)
+            # 之后随引擎的保留策略循环定期清理
+            self.engine.maintenance_callbacks.append(self._sweep_thumbs)
+            logger.info(f"画廊服务器已启动: {self.public_url}")
+            return True
+        except Exception as e:
+            logger.error(f"画廊服务器启动失败: {e}")
+            return False
+
+    async def stop(self):
+        if self._runner is None:
+            return
+        if self._sweep_thumbs in self.engine.maintenance_callbacks:
+            self.engine.maintenance_callbacks.remove(self._sweep_thumbs)
+        try:
+            await self._runner.cleanup()
+        finally:
+            self._runner = None
+        logger.info("画廊服务器已停止")
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    # ==================== 签名链接 ====================
+
+    def _owner_for(self, user_id: str) -> str:
+        return user_id if self.engine.only_own_images else "all"
+
+    def _sign(self, date: str, owner: str, expires: int) -> str:
+        msg = f"{date}:{owner}:{expires}".encode()
+        return hmac.new(self.secret, msg, hashlib.sha256).hexdigest()[:32]
+
+    def make_link(self, user_id: str, date: Optional[str] = None) -> str:
+        """生成用户当日画廊的签名链接"""
+        date = date or datetime.now().strftime("%Y-%m-%d")
+        owner = self._owner_for(user_id)
+        expires = int(time.time()) + self.link_ttl
+        return (f"{self.public_url}/g/{date}/{quote(owner)}"
+                f"?{self._query(date, owner, expires)}")
+
+    def _query(self, date: str, owner: str, expires: int) -> str:
+        return f"exp={expires}&sig={self._sign(date, owner, expires)}"
+
+    def _verify(self, request: web.Request) -> tuple:
+        date = request.match_info["date"]
+        owner = request.match_info["owner"]
+        try:
+            expires = int(request.query.get("exp", "0"))
+        except ValueError:
+            raise web.HTTPForbidden(text="invalid link")
+        sig = request.query.get("sig", "")
+        if expires < time.time() or not hmac.compare_digest(sig, self._sign(date, owner, expires)):
+            raise web.HTTPForbidden(text="link expired or invalid")
+        return date, owner, expires
+
+    # ==================== 文件目录 ====================
+
+    async def _list_files(self, date: str, owner: str) -> Dict[str, str]:
+        """{文件名: 本地路径}，只包含数据库中登记且仍存在的图片"""
+        rows = await self.engine.db.get_image_records(date, None if owner == "all" else owner)
+        day_dir = Path(self.engine.auto_save_dir).joinpath(*date.split("-"))
+        files: Dict[str, str] = {}
+        for filename, file_path, media_type in rows:
+            path = file_path or str(day_dir / filename)
+            if (media_type or "").startswith("image/") or filename.lower().endswith(
+                    ('.png', '.jpg', '.jpeg', '.webp', '.gif')):
+                files.setdefault(os.path.basename(path), path)
+        return files
+
+    async def _resolve(self, request: web.Request) -> tuple:
+        date, owner, expires = self._verify(request)
+        name = request.match_info["name"]
+        path = (await self._list_files(date, owner)).get(name)
+        if not path or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return date, owner, expires, name, path
+
+    # ==================== 请求处理 ====================
+
+    async def _handle_index(self, request: web.Request) -> web.Response:
+        date, owner, expires = self._verify(request)
+        files = await self._list_files(date, owner)
+        base = f"/g/{date}/{quote(owner)}"
+        query = self._query(date, owner, expires)
+        items = []
+        for name in files:
+            q = quote(name)
+            items.append(
+                f'<a href="{base}/file/{q}?{query}" target="_blank">'
+                f'<img loading="lazy" src="{base}/thumb/{q}?{query}" title="{html.escape(name)}"></a>')
+        body = "\n".join(items) or "<p>今天还没有生成的图片</p>"
+        page = f"""<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>ComfyUI 输出 {html.escape(date)}</title>
+<style>
+body{{font-family:sans-serif;background:#f5f5f5;margin:16px}}
+.grid{{display:flex;flex-wrap:wrap;gap:8px}}
+.grid img{{width:{self.THUMB_SIZE // 2}px;height:{self.THUMB_SIZE // 2}px;object-fit:cover;border-radius:6px;background:#ddd}}
+</style></head><body>
+<h3>ComfyUI 输出 {html.escape(date)}（{len(files)} 张）</h3>
+<div class="grid">
+{body}
+</div></body></html>"""
+        return web.Response(text=page, content_type="text/html",
+                            headers={"Cache-Control": "private, no-store"})
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        *_, path = await self._resolve(request)
+        # FileResponse 自带 ETag/Last-Modified 校验与 Range 分段
+        return web.FileResponse(path, headers={"Cache-Control": "private, max-age=86400"})
+
+    async def _handle_thumb(self, request: web.Request) -> web.StreamResponse:
+        date, _, _, name, path = await self._resolve(request)
+        try:
+            thumb = self.thumb_dir / date / self._thumb_name(path)
+        except OSError:
+            raise web.HTTPNotFound()
+        if not thumb.exists():
+            lock = self._thumb_locks.setdefault(str(thumb), asyncio.Lock())
+            try:
+                async with lock:
+                    if not thumb.exists():
+                        await asyncio.get_event_loop().run_in_executor(
+                            None, self._make_thumb, path, thumb)
+            except Exception as e:
+                logger.warning(f"生成缩略图失败 {name}: {e}")
+                raise web.HTTPNotFound()
+            finally:
+                if not lock.locked():
+                    self._thumb_locks.pop(str(thumb), None)
+        return web.FileResponse(thumb, headers={"Cache-Control": "private, max-age=86400"})
+
+    # ==================== 缩略图 ====================
+
+    @staticmethod
+    def _thumb_name(source: str) -> str:
+        """
+        缩略图文件名：源文件路径、大小和修改时间的哈希
+        
+        同名不同扩展名（x.png / x.webp）的图片各有缩略图；源文件被替换后
+        名字随之变化，不依赖缩略图与源文件的 mtime 比较。旧缩略图由 _sweep_thumbs 清理。
+        """
+        st = os.stat(source)
+        key = f"{os.path.abspath(source)}\0{st.st_size}\0{st.st_mtime_ns}"
+        return hashlib.sha256(key.encode()).hexdigest()[:32] + ".jpg"
+
+    def _make_thumb(self, source: str, thumb: Path):
+        """生成 JPEG 缩略图（线程池中执行），先写临时文件再原子替换"""
+        thumb.parent.mkdir(parents=True, exist_ok=True)
+        with Image.open(source) as img:
+            img.draft("RGB", (self.THUMB_SIZE, self.THUMB_SIZE))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((self.THUMB_SIZE, self.THUMB_SIZE))
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            tmp = thumb.with_suffix(f".{secrets.token_hex(4)}.tmp")
+            img.save(tmp, "JPEG", quality=self.THUMB_QUALITY, optimize=True)
+        os.replace(tmp, thumb)
+
+    def _sweep_thumbs(self):
+        """删除超过保留天数的缩略图日期目录"""
+        if not self.thumb_dir.exists():
+            return
+        keep = {(datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
+                for i in range(self.THUMB_KEEP_DAYS)}
+        for d in self.thumb_dir.iterdir():
+            if d.is_dir() and d.name not in keep:
+                shutil.rmtree(d, ignore_errors=True)
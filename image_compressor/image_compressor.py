@@ -1,7 +1,7 @@
 import torch
+import torch.nn.functional as F
 from PIL import Image
 import numpy as np
-import comfy.utils
 
 class ImageCompressor:
     """
@@ -57,63 +57,89 @@ class ImageCompressor:
     FUNCTION = "compress_image"
     CATEGORY = "图像处理/压缩"  # 节点分类保持不变
     
+    @staticmethod
+    def _target_size(width, height, min_width, min_height, max_width, max_height):
+        """
+        按「先放大到最小分辨率、再缩小到最大分辨率」的规则计算目标尺寸
+        返回 (new_width, new_height)；与原图相同时表示无需缩放
+        """
+        current_width, current_height = width, height
+
+        # 第一步：处理最小分辨率约束（放大）
+        if current_width < min_width or current_height < min_height:
+            # 计算「达到最小分辨率」所需的缩放比例（取较大值，确保宽高都达标）
+            width_ratio_min = min_width / current_width if current_width != 0 else 1.0
+            height_ratio_min = min_height / current_height if current_height != 0 else 1.0
+            scale_ratio = max(width_ratio_min, height_ratio_min)
+            current_width = max(int(current_width * scale_ratio), min_width)
+            current_height = max(int(current_height * scale_ratio), min_height)
+
+        # 第二步：处理最大分辨率约束（缩小）
+        if current_width > max_width or current_height > max_height:
+            # 计算「不超过最大分辨率」的缩放比例（取较小值，确保宽高都不超标）
+            width_ratio_max = max_width / current_width
+            height_ratio_max = max_height / current_height
+            scale_ratio = min(width_ratio_max, height_ratio_max)
+            # 缩小后二次确认不小于最小分辨率
+            current_width = max(int(current_width * scale_ratio), min_width)
+            current_height = max(int(current_height * scale_ratio), min_height)
+
+        return current_width, current_height
+
     def compress_image(self, image, min_width, min_height, max_width, max_height):
         """
         核心逻辑：同时满足最小分辨率和最大分辨率的图像缩放
         处理流程：
-        1. 原图尺寸 → 2. 若小于最小分辨率：放大至最小分辨率以上
-        3. 若大于最大分辨率：缩小至最大分辨率以内 → 4. 最终确保尺寸在 [min, max] 区间
+        1. 原图尺寸在 [min, max] 区间内：直接返回输入张量（不做任何拷贝/转换）
+        2. 整个批次尺寸一致（IMAGE 张量 [B, H, W, C]）：在张量所在设备上一次性批量插值
+        3. 其他情况（尺寸不一的图像列表）：逐张走 PIL LANCZOS 路径
         """
-        # 1. Tensor转PIL图像（保持原逻辑）
-        pil_images = []
+        if isinstance(image, torch.Tensor) and image.dim() == 4:
+            height, width = image.shape[1], image.shape[2]
+            new_width, new_height = self._target_size(
+                width, height, min_width, min_height, max_width, max_height
+            )
+            # 快速路径：无需缩放
+            if (new_width, new_height) == (width, height):
+                return (image,)
+            return (self._resize_batch(image, new_width, new_height),)
+
+        return (self._compress_with_pil(image, min_width, min_height, max_width, max_height),)
+
+    @staticmethod
+    def _resize_batch(image, new_width, new_height):
+        """批量缩放 [B, H, W, C] 张量（带抗锯齿的双三次插值，缩小/放大通用）"""
+        samples = image.movedim(-1, 1)
+        orig_dtype = samples.dtype
+        if orig_dtype not in (torch.float32, torch.float64):
+            samples = samples.float()
+        resized = F.interpolate(samples, size=(new_height, new_width),
+                                mode="bicubic", align_corners=False, antialias=True)
+        # 双三次插值可能产生轻微越界，保持 IMAGE 的 [0, 1] 取值范围
+        resized = resized.clamp_(0.0, 1.0).to(orig_dtype)
+        return resized.movedim(1, -1).contiguous()
+
+    def _compress_with_pil(self, image, min_width, min_height, max_width, max_height):
+        """逐张处理（原逻辑）：Tensor → PIL → LANCZOS 缩放 → Tensor"""
+        processed_images = []
         for img in image:
             img_np = img.cpu().numpy()
             img_np = np.clip(img_np * 255.0, 0, 255).astype(np.uint8)
             pil_img = Image.fromarray(img_np)
-            pil_images.append(pil_img)
-        
-        processed_images = []
-        for pil_img in pil_images:
+
             original_width, original_height = pil_img.size
-            current_img = pil_img
-            
-            # 第一步：处理最小分辨率约束（放大）
-            if original_width < min_width or original_height < min_height:
-                # 计算「达到最小分辨率」所需的缩放比例（取较大值，确保宽高都达标）
-                width_ratio_min = min_width / original_width if original_width != 0 else 1.0
-                height_ratio_min = min_height / original_height if original_height != 0 else 1.0
-                scale_ratio = max(width_ratio_min, height_ratio_min)
-                
-                # 计算放大后的尺寸（确保不小于最小分辨率）
-                new_width = max(int(original_width * scale_ratio), min_width)
-                new_height = max(int(original_height * scale_ratio), min_height)
-                
-                # 高质量放大（LANCZOS算法支持放大和缩小）
-                current_img = current_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # 第二步：处理最大分辨率约束（缩小）
-            current_width, current_height = current_img.size
-            if current_width > max_width or current_height > max_height:
-                # 计算「不超过最大分辨率」的缩放比例（取较小值，确保宽高都不超标）
-                width_ratio_max = max_width / current_width
-                height_ratio_max = max_height / current_height
-                scale_ratio = min(width_ratio_max, height_ratio_max)
-                
-                # 计算缩小后的尺寸，并二次确认不小于最小分辨率
-                new_width = max(int(current_width * scale_ratio), min_width)
-                new_height = max(int(current_height * scale_ratio), min_height)
-                
-                # 高质量缩小
-                current_img = current_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            resized_img = current_img
-            
-            # 5. PIL转Tensor（保持原逻辑）
-            img_np = np.array(resized_img).astype(np.float32) / 255.0
+            new_width, new_height = self._target_size(
+                original_width, original_height, min_width, min_height, max_width, max_height
+            )
+            if (new_width, new_height) != (original_width, original_height):
+                # 高质量缩放（LANCZOS算法支持放大和缩小）
+                pil_img = pil_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+            img_np = np.array(pil_img).astype(np.float32) / 255.0
             processed_images.append(torch.from_numpy(img_np))
-        
+
         # 堆叠图像并返回（保持原逻辑）
-        return (torch.stack(processed_images),)
+        return torch.stack(processed_images)
 
 # 节点注册（保持原逻辑）
 NODE_CLASS_MAPPINGS = {
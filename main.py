@@ -12,6 +12,7 @@ ComfyUI AI绘画插件 — AstrBot 平台适配层
 """
 import asyncio
 import aiohttp
+import hashlib
 import io
 import json
 import logging
@@ -21,6 +22,7 @@ import re
 import threading
 import time
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
@@ -32,7 +34,6 @@ from astrbot.api.event.filter import CustomFilter
 from astrbot.api.message_components import Image, Node, Nodes, Plain, Record, Reply, Video
 from astrbot.api.star import Context, Star, StarTools, register
 from astrbot.api import llm_tool
-from aiohttp import web
 
 import sys
 import os
@@ -40,7 +41,10 @@ import os
 _plugin_dir = os.path.dirname(os.path.abspath(__file__))
 if _plugin_dir not in sys.path:
     sys.path.insert(0, _plugin_dir)
-from workflow_engine import WorkflowEngine, WorkflowResult
+from workflow_engine import TaskEvent, WorkflowEngine, WorkflowResult
+from eta_estimator import EtaEstimator
+from gallery_server import GalleryServer
+from metrics import MetricsServer
 from gui_server import GuiServer
 
 # 模块级 WorkflowFilter — 直接引用引擎的 workflow_prefixes
@@ -109,6 +113,10 @@ class ModComfyUI(Star):
                 return False
             return event.message_obj.message_str.strip() in ["aimg", "img2img"]
 
+    class CancelTaskFilter(CustomFilter):
+        def filter(self, event, cfg):
+            return event.message_obj.message_str.strip() in ("取消任务", "取消全部任务")
+
     class OutputZipFilter(CustomFilter):
         def filter(self, event, cfg):
             msgs = event.get_messages()
@@ -130,22 +138,24 @@ class ModComfyUI(Star):
         self.group_whitelist = [str(g) for g in config.get("group_whitelist", [])]
         self.enable_auto_recall = config.get("enable_auto_recall", False)
         self.auto_recall_delay = config.get("auto_recall_delay", 20)
+        self.progress_update_interval = config.get("progress_update_interval", 30)
         self.enable_help_image = config.get("enable_help_image", True)
-        self.help_server_port = config.get("help_server_port", 8080)
         self.enable_output_zip = config.get("enable_output_zip", True)
         self.enable_fake_forward = config.get("enable_fake_forward", False)
         self.fake_forward_threshold = config.get("fake_forward_threshold", 2)
         self.fake_forward_qq = config.get("fake_forward_qq", "")
         self.enable_audio_to_voice = config.get("enable_audio_to_voice", True)
         self.daily_download_limit = config.get("daily_download_limit", 1)
+        self.image_fetch_concurrency = config.get("image_fetch_concurrency", 4)
+        self.image_fetch_timeout = config.get("image_fetch_timeout", 30)
 
-        # 3. 帮助服务器
-        self.help_server_thread: Optional[threading.Thread] = None
-        self.help_server_runner: Optional[web.AppRunner] = None
-        self.help_server_site: Optional[web.TCPSite] = None
-        self.actual_help_port = self.help_server_port
+        # 3. 帮助图片缓存（PNG 字节，键为配置哈希 + 服务器状态快照）
+        self._help_image_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._help_assets: Optional[tuple] = None
+        self._help_render_lock = threading.Lock()
         self.data_dir = StarTools.get_data_dir()
         self.data_dir.mkdir(exist_ok=True)
+        self.engine.temp_dirs.append(str(self.data_dir / "temp"))
 
         # 4. 设置模块级引擎引用（供 WorkflowFilter 直接读取 workflow_prefixes）
         global _workflow_engine_ref
@@ -155,6 +165,14 @@ class ModComfyUI(Star):
         self.gui_server: Optional[GuiServer] = None
         self._init_gui(config)
 
+        # 6. 输出画廊服务器
+        self.gallery_server: Optional[GalleryServer] = None
+        self._init_gallery(config)
+
+        # 7. 指标服务
+        self.metrics_server: Optional[MetricsServer] = None
+        self._init_metrics_server(config)
+
         # 激活 LLM 工具
         self.context.activate_llm_tool("comfyui_txt2img")
 
@@ -176,6 +194,31 @@ class ModComfyUI(Star):
         self.gui_server.init_app()
         self.gui_server.start()
 
+    def _init_gallery(self, config: dict):
+        """初始化输出画廊服务器（在事件循环中异步启动）"""
+        if not config.get("enable_gallery", False):
+            return
+        self.gallery_server = GalleryServer(
+            self.engine,
+            host=config.get("gallery_host", "0.0.0.0"),
+            port=config.get("gallery_port", 7779),
+            public_url=config.get("gallery_public_url", ""),
+            secret=config.get("gallery_secret", ""),
+            link_ttl=config.get("gallery_link_ttl", 3600),
+        )
+        asyncio.create_task(self.gallery_server.start())
+
+    def _init_metrics_server(self, config: dict):
+        """初始化 Prometheus 指标服务（默认只监听本机）"""
+        if not config.get("enable_metrics", False):
+            return
+        self.metrics_server = MetricsServer(
+            self.engine.metrics,
+            host=config.get("metrics_host", "127.0.0.1"),
+            port=config.get("metrics_port", 7780),
+        )
+        asyncio.create_task(self.metrics_server.start())
+
     # ========== 结果回调处理 ==========
 
     def _make_result_callback(self, event: AstrMessageEvent, task_type: str = "txt2img",
@@ -336,7 +379,13 @@ class ModComfyUI(Star):
         if not self.enable_auto_recall:
             await event.send(message_content)
             return None
+        result = await self._send_recallable(event, message_content)
+        if result is not None:
+            self.engine.delay_scheduler.call_later(self.auto_recall_delay, self._recall_message, event, result)
+        return result
 
+    async def _send_recallable(self, event: AstrMessageEvent, message_content: Any) -> Optional[Any]:
+        """发送消息；aiocqhttp 平台的纯文本消息经 bot 直接发送并返回发送结果（供撤回），其余返回 None"""
         has_non_text = False
         if hasattr(message_content, '__iter__') and not isinstance(message_content, str):
             try:
@@ -363,7 +412,6 @@ class ModComfyUI(Star):
                     result = await client.send_group_msg(group_id=int(group_id), message=message_to_send)
                 else:
                     result = await client.send_private_msg(user_id=int(sender_id), message=message_to_send)
-                asyncio.create_task(self._delayed_recall(event, result))
                 return result
             else:
                 await event.send(message_content)
@@ -428,9 +476,9 @@ class ModComfyUI(Star):
             return ''.join(parts)
         return getattr(content, 'text', str(content) if not hasattr(content, '__iter__') else '')
 
-    async def _delayed_recall(self, event, sent_message):
+    async def _recall_message(self, event, sent_message):
+        """撤回已发送的消息（由调度器在 auto_recall_delay 秒后调用）"""
         try:
-            await asyncio.sleep(self.auto_recall_delay)
             mid = None
             if hasattr(sent_message, 'message_id'):
                 mid = sent_message.message_id
@@ -458,34 +506,78 @@ class ModComfyUI(Star):
 
     # ========== 帮助系统 ==========
 
+    # 帮助图片缓存最多保留的条目数
+    HELP_IMAGE_CACHE_SIZE = 16
+
     async def _send_help_as_image(self, event: AstrMessageEvent):
-        """发送图片格式帮助"""
-        server_url = None
-        img_path = None
+        """发送图片格式帮助（命中缓存时直接从内存发送）"""
         try:
-            server_url = await self._start_help_server()
-            img_path = await self._html_to_image(server_url)
-            await event.send(event.image_result(img_path))
-            await asyncio.sleep(2)
+            png = await self._get_help_image()
+            await event.send(event.chain_result([Image.fromBytes(png)]))
         except Exception as e:
             logger.error(f"发送帮助图片失败: {e}")
             await self._send_help_as_text(event)
-        finally:
-            if img_path and os.path.exists(img_path):
-                try:
-                    os.remove(img_path)
-                except Exception:
-                    pass
-            if server_url:
-                try:
-                    await self._stop_help_server()
-                except Exception:
-                    pass
+
+    async def _get_help_image(self) -> bytes:
+        """获取帮助图片 PNG 字节：缓存未命中时收集数据并在线程池中渲染"""
+        key = (self._help_config_hash(), self._help_status_snapshot())
+        png = self._help_image_cache.get(key)
+        if png is not None:
+            self._help_image_cache.move_to_end(key)
+            return png
+        sections = self._build_help_sections()
+        loop = asyncio.get_event_loop()
+        png = await loop.run_in_executor(None, self._render_help_image, sections)
+        self._help_image_cache[key] = png
+        while len(self._help_image_cache) > self.HELP_IMAGE_CACHE_SIZE:
+            self._help_image_cache.popitem(last=False)
+        return png
+
+    def _help_config_hash(self) -> str:
+        """帮助内容相关配置（插件配置 + 已加载 workflow）的哈希"""
+        eng = self.engine
+        workflows = [(wfn, info["config"].get("name"), info["config"].get("prefix"),
+                      info["config"].get("description")) for wfn, info in eng.workflows.items()]
+        raw = json.dumps([dict(self.config), workflows], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _help_status_snapshot(self) -> tuple:
+        """帮助图片中会变化的运行状态：服务器健康/系统信息快照时间 + 队列统计"""
+        eng = self.engine
+        servers = tuple((s.name, s.healthy, s.system_stats_at) for s in eng.comfyui_servers)
+        return (servers, eng.queued_count(), sum(eng.user_task_counts.values()),
+                len(eng.user_task_counts))
+
+    def _load_help_assets(self) -> tuple:
+        """加载帮助图片使用的字体和 logo，仅首次调用时读取文件"""
+        if self._help_assets is not None:
+            return self._help_assets
+        from PIL import Image as PILImage, ImageFont
+        try:
+            fp = os.path.join(self.plugin_dir, "1.ttf")
+            if os.path.exists(fp):
+                fonts = (ImageFont.truetype(fp, 52), ImageFont.truetype(fp, 32), ImageFont.truetype(fp, 24))
+            else:
+                fonts = (ImageFont.load_default(),) * 3
+        except Exception:
+            fonts = (ImageFont.load_default(),) * 3
+        logo = None
+        try:
+            ap = os.path.join(self.plugin_dir, "Astrbot.png")
+            if os.path.exists(ap):
+                with PILImage.open(ap) as ai:
+                    ath = 60
+                    atw = int(ath * ai.width / ai.height)
+                    logo = ai.resize((atw, ath), PILImage.Resampling.LANCZOS)
+        except Exception:
+            pass
+        self._help_assets = (*fonts, logo)
+        return self._help_assets
 
     async def _send_help_as_text(self, event: AstrMessageEvent):
         """发送文本帮助（与原版 main1.py 一致）"""
         eng = self.engine
-        current_queue = eng.task_queue.qsize()
+        current_queue = eng.queued_count()
         total_tasks = sum(eng.user_task_counts.values())
 
         model_details = []
@@ -510,7 +602,7 @@ class ModComfyUI(Star):
             lora_details.append("  • 暂无可用LoRA")
         lora_help = "\n✨ 可用LoRA列表：\n" + "\n".join(lora_details) + "\n\nLoRA使用说明：\n  - 基础格式：lora:描述（使用默认强度1.0/1.0）\n  - 仅模型强度：lora:描述:0.8\n  - 仅CLIP强度：lora:描述!1.0\n  - 双强度：lora:描述:0.8!1.3\n  - 多LoRA：空格分隔多个lora参数（例：lora:儿童 lora:学生:0.9）"
 
-        server_info = await self._build_server_info_text(eng)
+        server_info = self._build_server_info_text(eng)
         workflow_help = eng.generate_workflow_text_help()
 
         help_text = f"""
@@ -532,6 +624,7 @@ class ModComfyUI(Star):
   例：img2img 猫咪 噪声:0.7 批量2 model:动漫风格 lora:动物:1.2!0.9 + 图片/引用图片消息
 
 • 输出压缩包：发送「comfyuioutput」获取今天生成的图片压缩包（需开启自动保存）
+• 取消任务：发送「取消任务」取消最近提交的任务，「取消全部任务」取消自己的全部任务（排队中的直接移除，执行中的立即中断）
 • 小番茄解密：发送「小番茄图片解密」获取图片解密工具（支持批量解密小番茄混淆加密的图片）
 
 • 自定义Workflow：发送「<前缀> [参数名:值 ...]」+ 图片（如需要），支持中英文参数名
@@ -586,12 +679,13 @@ class ModComfyUI(Star):
                 items.append(f"  • {desc} (文件: {fn})")
         return "\n✨ 可用LoRA列表：\n" + "\n".join(items) + "\n\nLoRA使用说明：\n  - 格式：lora:描述[:强度][!CLIP强度]"
 
-    async def _build_server_info_text(self, eng: WorkflowEngine) -> str:
+    @staticmethod
+    def _build_server_info_text(eng: WorkflowEngine) -> str:
         parts = ["\n🌐 服务器信息："]
         for srv in eng.comfyui_servers:
             if srv.healthy:
                 parts.append(f"\n📊 【{srv.name}】")
-                info = await eng._get_server_system_info(srv)
+                info = eng._get_server_system_info(srv)
                 if info:
                     sys_data = info.get("system", {})
                     devs = info.get("devices", [])
@@ -609,211 +703,122 @@ class ModComfyUI(Star):
                 parts.append(f"\n📊 【{srv.name}】\n  ❌ 服务器不可用")
         return "".join(parts)
 
-    async def _start_help_server(self) -> str:
-        """启动帮助 HTTP 服务器"""
-        if self.help_server_runner is not None:
-            return f"http://localhost:{self.actual_help_port}"
-
-        async def _find_port(sp):
-            for p in range(sp, sp + 100):
-                try:
-                    _, w = await asyncio.wait_for(
-                        asyncio.open_connection('localhost', p), timeout=1.0
-                    )
-                    w.close()
-                    await w.wait_closed()
-                except Exception:
-                    return p
-            return random.randint(49152, 65535)
-
-        self.actual_help_port = await _find_port(self.help_server_port)
+    def _build_help_sections(self) -> List[Tuple[str, List[str]]]:
+        """收集帮助图片的各段内容（标题, 行列表）"""
         eng = self.engine
-
-        def gen_html():
-            model_items = ""
-            seen_m = set()
+        sections = []
+        qsize = eng.queued_count()
+        utc = sum(eng.user_task_counts.values())
+
+        sections.append(("🎯 主要功能", [
+            "• 文生图: 发送「aimg <提示词> [宽X,高Y] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」参数可选，非必填",
+            "• 图生图: 发送「img2img <提示词> [噪声:数值] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」+ 图片或引用包含图片的消息",
+            "• 输出压缩包: comfyuioutput",
+            "• 取消任务: 取消任务 / 取消全部任务",
+            "• 小番茄解密：发送「小番茄图片解密」",
+            "• 帮助信息: 单独输入 aimg 或 img2img"
+        ]))
+        sections.append(("📊 实时状态", [
+            f"• 当前排队任务: {qsize} 个",
+            f"• 总任务: {utc} 个",
+            f"• 队列容量: {eng.max_task_queue} 个",
+            f"• 活跃用户数: {len(eng.user_task_counts)} 个"
+        ]))
+        sections.append(("⚙️ 基本配置", [
+            f"• 默认模型: {eng.ckpt_name or '未配置'}",
+            f"• 文生图批量: {eng.txt2img_batch_size}",
+            f"• 图生图批量: {eng.img2img_batch_size}",
+            f"• 默认噪声: {eng.default_denoise}",
+            f"• 自动保存: {'开启' if eng.enable_auto_save else '关闭'}",
+            f"• 输出压缩包: {'开启' if eng.enable_output_zip else '关闭'}",
+            f"• 每日下载限制: {eng.daily_download_limit} 次",
+            f"• 仅限自己图片: {'是' if eng.only_own_images else '否'}",
+            f"• 开放时间: {eng.open_time_ranges}"
+        ]))
+        sections.append(("📏 参数限制", [
+            f"• 分辨率: {eng.min_width}~{eng.max_width} x {eng.min_height}~{eng.max_height}",
+            f"• 文生图最大批量: {eng.max_txt2img_batch}",
+            f"• 图生图最大批量: {eng.max_img2img_batch}",
+            f"• 任务队列最大: {eng.max_task_queue}",
+            f"• 每用户最大并发: {eng.max_concurrent_tasks_per_user}"
+        ]))
+        seen_m = set()
+        ms = ["格式: model:描述"]
+        if eng.model_name_map:
             for _, (fn, desc) in eng.model_name_map.items():
                 if desc not in seen_m:
                     seen_m.add(desc)
-                    model_items += f'<li>{desc} (文件: {fn})</li>'
-            lora_items = ""
-            seen_l = set()
+                    ms.append(f"• {desc} (文件: {fn})")
+        else:
+            ms.append("• 暂无可用模型")
+        sections.append(("🎨 可用模型列表", ms))
+        seen_l = set()
+        ls = ["格式: lora:描述[:强度][!CLIP强度]"]
+        if eng.lora_name_map:
             for _, (fn, desc) in eng.lora_name_map.items():
                 if desc not in seen_l:
                     seen_l.add(desc)
-                    lora_items += f'<li>{desc} (文件: {fn})</li>'
-            server_items = "".join(
-                f'<li>{s.name}</li>' for s in eng.comfyui_servers if s.healthy
-            )
-            return f"""<!DOCTYPE html><html lang="zh-CN"><head>
-<meta charset="UTF-8"><title>ComfyUI AI绘画帮助</title>
-<style>
-body{{font-family:'Microsoft YaHei',Arial,sans-serif;line-height:1.8;margin:0;padding:20px;
-background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
-.container{{max-width:800px;margin:0 auto;background:#fff;border-radius:15px;box-shadow:0 10px 30px rgba(0,0,0,.2);overflow:hidden}}
-.header{{background:linear-gradient(45deg,#4a90e2,#357abd);color:#fff;padding:30px;text-align:center}}
-.header h1{{margin:0;font-size:2.5em}}
-.content{{padding:30px}}
-.section{{margin-bottom:30px;padding:20px;background:#f8f9fa;border-radius:10px;border-left:4px solid #4a90e2}}
-.section h2{{margin-top:0;color:#333}}
-.section ul{{margin:10px 0;padding-left:20px}}
-.section li{{margin:8px 0;color:#555}}
-.footer{{background:#333;color:#fff;text-align:center;padding:20px}}
-</style></head><body>
-<div class="container"><div class="header"><h1>🎨 ComfyUI AI绘画帮助</h1></div>
-<div class="content">
-<div class="section"><h2>🎯 主要功能</h2><ul>
-<li>文生图: 发送「aimg &lt;提示词&gt; [宽X,高Y] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」</li>
-<li>图生图: 发送「img2img &lt;提示词&gt; [噪声:数值] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」+ 图片</li>
-<li>帮助信息: 单独输入 aimg 或 img2img</li></ul></div>
-<div class="section"><h2>⚙️ 基本配置</h2><ul>
-<li>默认模型: {eng.ckpt_name or '未配置'}</li>
-<li>文生图批量: {eng.txt2img_batch_size}｜图生图批量: {eng.img2img_batch_size}</li>
-<li>默认噪声: {eng.default_denoise}｜开放时间: {eng.open_time_ranges}</li></ul></div>
-<div class="section"><h2>📏 参数限制</h2><ul>
-<li>分辨率: {eng.min_width}~{eng.max_width} x {eng.min_height}~{eng.max_height}</li>
-<li>文生图最大批量: {eng.max_txt2img_batch}｜图生图最大批量: {eng.max_img2img_batch}</li>
-<li>任务队列: {eng.max_task_queue}｜每用户最大并发: {eng.max_concurrent_tasks_per_user}</li></ul></div>
-<div class="section"><h2>🎨 可用模型列表</h2><ul>{model_items}</ul></div>
-<div class="section"><h2>✨ 可用LoRA列表</h2><ul>{lora_items}</ul></div>
-<div class="section"><h2>🌐 服务器信息</h2><ul>{server_items}</ul></div>
-<div class="section"><h2>🔧 可用Workflow列表</h2><ul>{eng.generate_workflow_html_items()}</ul></div>
-</div><div class="footer"><p>生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p></div></div></body></html>"""
-
-        async def handle(req):
-            return web.Response(text=gen_html(), content_type='text/html')
-
-        app = web.Application()
-        app.router.add_get('/', handle)
-        self.help_server_runner = web.AppRunner(app)
-        await self.help_server_runner.setup()
-        self.help_server_site = web.TCPSite(self.help_server_runner, 'localhost', self.actual_help_port)
-        await self.help_server_site.start()
-        logger.info(f"帮助图片服务器已启动: http://localhost:{self.actual_help_port}")
-        return f"http://localhost:{self.actual_help_port}"
-
-    async def _html_to_image(self, html_url: str) -> str:
-        """HTML 转图片（PIL 渲染）"""
-        try:
-            from PIL import Image as PILImage, ImageDraw, ImageFont
-            try:
-                fp = os.path.join(self.plugin_dir, "1.ttf")
-                if os.path.exists(fp):
-                    tf = ImageFont.truetype(fp, 52)
-                    nf = ImageFont.truetype(fp, 32)
-                    sf = ImageFont.truetype(fp, 24)
-                else:
-                    tf = nf = sf = ImageFont.load_default()
-            except Exception:
-                tf = nf = sf = ImageFont.load_default()
-
-            eng = self.engine
-            sections = []
-            qsize = eng.task_queue.qsize()
-            utc = sum(eng.user_task_counts.values())
-
-            sections.append(("🎯 主要功能", [
-                "• 文生图: 发送「aimg <提示词> [宽X,高Y] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」参数可选，非必填",
-                "• 图生图: 发送「img2img <提示词> [噪声:数值] [批量N] [model:描述] [lora:描述[:强度][!CLIP强度]]」+ 图片或引用包含图片的消息",
-                "• 输出压缩包: comfyuioutput",
-                "• 小番茄解密：发送「小番茄图片解密」",
-                "• 帮助信息: 单独输入 aimg 或 img2img"
-            ]))
-            sections.append(("📊 实时状态", [
-                f"• 当前排队任务: {qsize} 个",
-                f"• 总任务: {utc} 个",
-                f"• 队列容量: {eng.max_task_queue} 个",
-                f"• 活跃用户数: {len(eng.user_task_counts)} 个"
-            ]))
-            sections.append(("⚙️ 基本配置", [
-                f"• 默认模型: {eng.ckpt_name or '未配置'}",
-                f"• 文生图批量: {eng.txt2img_batch_size}",
-                f"• 图生图批量: {eng.img2img_batch_size}",
-                f"• 默认噪声: {eng.default_denoise}",
-                f"• 自动保存: {'开启' if eng.enable_auto_save else '关闭'}",
-                f"• 输出压缩包: {'开启' if eng.enable_output_zip else '关闭'}",
-                f"• 每日下载限制: {eng.daily_download_limit} 次",
-                f"• 仅限自己图片: {'是' if eng.only_own_images else '否'}",
-                f"• 开放时间: {eng.open_time_ranges}"
-            ]))
-            sections.append(("📏 参数限制", [
-                f"• 分辨率: {eng.min_width}~{eng.max_width} x {eng.min_height}~{eng.max_height}",
-                f"• 文生图最大批量: {eng.max_txt2img_batch}",
-                f"• 图生图最大批量: {eng.max_img2img_batch}",
-                f"• 任务队列最大: {eng.max_task_queue}",
-                f"• 每用户最大并发: {eng.max_concurrent_tasks_per_user}"
-            ]))
-            seen_m = set()
-            ms = ["格式: model:描述"]
-            if eng.model_name_map:
-                for _, (fn, desc) in eng.model_name_map.items():
-                    if desc not in seen_m:
-                        seen_m.add(desc)
-                        ms.append(f"• {desc} (文件: {fn})")
-            else:
-                ms.append("• 暂无可用模型")
-            sections.append(("🎨 可用模型列表", ms))
-            seen_l = set()
-            ls = ["格式: lora:描述[:强度][!CLIP强度]"]
-            if eng.lora_name_map:
-                for _, (fn, desc) in eng.lora_name_map.items():
-                    if desc not in seen_l:
-                        seen_l.add(desc)
-                        ls.append(f"• {desc} (文件: {fn})")
-            else:
-                ls.append("• 暂无可用LoRA")
-            sections.append(("✨ 可用LoRA列表", ls))
+                    ls.append(f"• {desc} (文件: {fn})")
+        else:
+            ls.append("• 暂无可用LoRA")
+        sections.append(("✨ 可用LoRA列表", ls))
 
-            # 服务器信息（与原版完全一致）
-            server_items = []
-            for srv in eng.comfyui_servers:
-                if srv.healthy:
-                    server_items.append(f"📊 【{srv.name}】")
-                    info = await eng._get_server_system_info(srv)
-                    if info:
-                        sd = info.get("system", {})
-                        dd = info.get("devices", [])
-                        rt = sd.get("ram_total", 0) / (1024**3)
-                        rf = sd.get("ram_free", 0) / (1024**3)
-                        ru = rt - rf
-                        server_items.append(f"  系统: {sd.get('os','未知')}")
-                        server_items.append(f"  PyTorch: {sd.get('pytorch_version','未知')}")
-                        server_items.append(f"  内存: {ru:.1f}GB / {rt:.1f}GB")
-                        if dd:
-                            for i, d in enumerate(dd):
-                                dn = d.get("name", "未知设备")
-                                dt = d.get("type", "未知")
-                                vt = d.get("vram_total", 0) / (1024**3)
-                                vf = d.get("vram_free", 0) / (1024**3)
-                                vu = vt - vf
-                                server_items.append(f"  GPU{i+1}: {dn}")
-                                server_items.append(f"    类型: {dt}")
-                                server_items.append(f"    显存: {vu:.1f}GB / {vt:.1f}GB")
-                        else:
-                            server_items.append(f"  GPU: 未检测到GPU设备")
+        # 服务器信息（与原版完全一致）
+        server_items = []
+        for srv in eng.comfyui_servers:
+            if srv.healthy:
+                server_items.append(f"📊 【{srv.name}】")
+                info = eng._get_server_system_info(srv)
+                if info:
+                    sd = info.get("system", {})
+                    dd = info.get("devices", [])
+                    rt = sd.get("ram_total", 0) / (1024**3)
+                    rf = sd.get("ram_free", 0) / (1024**3)
+                    ru = rt - rf
+                    server_items.append(f"  系统: {sd.get('os','未知')}")
+                    server_items.append(f"  PyTorch: {sd.get('pytorch_version','未知')}")
+                    server_items.append(f"  内存: {ru:.1f}GB / {rt:.1f}GB")
+                    if dd:
+                        for i, d in enumerate(dd):
+                            dn = d.get("name", "未知设备")
+                            dt = d.get("type", "未知")
+                            vt = d.get("vram_total", 0) / (1024**3)
+                            vf = d.get("vram_free", 0) / (1024**3)
+                            vu = vt - vf
+                            server_items.append(f"  GPU{i+1}: {dn}")
+                            server_items.append(f"    类型: {dt}")
+                            server_items.append(f"    显存: {vu:.1f}GB / {vt:.1f}GB")
                     else:
-                        server_items.append(f"  ❌ 无法获取系统信息")
+                        server_items.append(f"  GPU: 未检测到GPU设备")
                 else:
-                    server_items.append(f"📊 【{srv.name}】")
-                    server_items.append(f"  ❌ 服务器不可用")
-            sections.append(("🌐 服务器信息", server_items))
-
-            # Workflow 列表
-            wf_items = ["格式: <前缀> [参数名:值 ...]"]
-            if eng.workflows:
-                for wfn, info in eng.workflows.items():
-                    cfg = info["config"]
-                    name = cfg.get("name", wfn)
-                    prefix = cfg.get("prefix", "")
-                    desc = cfg.get("description", "")
-                    if desc:
-                        wf_items.append(f"• {name} (前缀: {prefix}) - {desc}")
-                    else:
-                        wf_items.append(f"• {name} (前缀: {prefix})")
+                    server_items.append(f"  ❌ 无法获取系统信息")
             else:
-                wf_items.append("• 暂无可用Workflow")
-            sections.append(("🔧 可用Workflow列表", wf_items))
-
+                server_items.append(f"📊 【{srv.name}】")
+                server_items.append(f"  ❌ 服务器不可用")
+        sections.append(("🌐 服务器信息", server_items))
+
+        # Workflow 列表
+        wf_items = ["格式: <前缀> [参数名:值 ...]"]
+        if eng.workflows:
+            for wfn, info in eng.workflows.items():
+                cfg = info["config"]
+                name = cfg.get("name", wfn)
+                prefix = cfg.get("prefix", "")
+                desc = cfg.get("description", "")
+                if desc:
+                    wf_items.append(f"• {name} (前缀: {prefix}) - {desc}")
+                else:
+                    wf_items.append(f"• {name} (前缀: {prefix})")
+        else:
+            wf_items.append("• 暂无可用Workflow")
+        sections.append(("🔧 可用Workflow列表", wf_items))
+        return sections
+
+    def _render_help_image(self, sections: List[Tuple[str, List[str]]]) -> bytes:
+        """将帮助内容渲染为 PNG（CPU 密集，在线程池中调用）"""
+        from PIL import Image as PILImage, ImageDraw
+        with self._help_render_lock:
+            tf, nf, sf, logo = self._load_help_assets()
             width = 1200
             base_h = 120
             bh = 80
@@ -845,37 +850,13 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
             draw.text((50, height - 35),
                       "https://github.com/tjc6666666666666/astrbot_plugin_ComfyUI_promax",
                       fill='#666', font=sf)
-            try:
-                ap = os.path.join(self.plugin_dir, "Astrbot.png")
-                if os.path.exists(ap):
-                    ai = PILImage.open(ap)
-                    ath = 60
-                    atw = int(ath * ai.width / ai.height)
-                    ar = ai.resize((atw, ath), PILImage.Resampling.LANCZOS)
-                    img.paste(ar, (width - atw - 10, height - ath - 10),
-                              ar if ar.mode == 'RGBA' else None)
-            except Exception:
-                pass
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            op = os.path.join(self.plugin_dir, f"help_{ts}.png")
-            img.save(op, 'PNG', quality=95)
-            logger.info(f"帮助图片已生成: {op}")
-            return op
-        except Exception as e:
-            logger.error(f"HTML转图片失败: {e}")
-            raise
-
-    async def _stop_help_server(self):
-        try:
-            if self.help_server_site:
-                await self.help_server_site.stop()
-                self.help_server_site = None
-            if self.help_server_runner:
-                await self.help_server_runner.cleanup()
-                self.help_server_runner = None
-            logger.info("帮助服务器已停止")
-        except Exception as e:
-            logger.error(f"停止帮助服务器失败: {e}")
+            if logo is not None:
+                img.paste(logo, (width - logo.width - 10, height - logo.height - 10),
+                          logo if logo.mode == 'RGBA' else None)
+            buf = io.BytesIO()
+            img.save(buf, format='PNG')
+            logger.info("帮助图片已生成")
+            return buf.getvalue()
 
     def _filter_server_urls(self, text: str) -> str:
         return self.engine._filter_server_urls(text)
@@ -889,13 +870,7 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
         return str(gid) in self.group_whitelist
 
     def _parse_command(self, full_text: str, keyword: str) -> Tuple[str, list]:
-        mention_pat = r'@[\w\d]+'
-        text = re.sub(mention_pat, '', full_text).strip()
-        parts = text.split()
-        if not parts or parts[0] != keyword:
-            return ("", [])
-        mentions = " ".join(re.findall(mention_pat, full_text))
-        return (mentions, parts[1:])
+        return self.engine.parse_command(full_text, keyword)
 
     def _truncate_prompt(self, prompt: str, max_len: int = 8) -> str:
         return prompt[:max_len] + "..." if len(prompt) > max_len else prompt
@@ -968,22 +943,31 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
             seed = random.randint(1, 2147483647)
 
         uid = str(event.get_sender_id())
+        gid = event.get_group_id() or None
+        wait = eng.check_rate_limit(uid, gid)
+        if wait:
+            await self._send_with_auto_recall(event, event.plain_result(f"\n{eng.rate_limit_message(wait)}！"))
+            return
         if not await eng._increment_user_task_count(uid):
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result(f"\n您当前任务数已达上限（{eng.max_concurrent_tasks_per_user}个）！"))
             return
 
-        if eng.task_queue.full():
+        if eng.queue_full():
             await eng._decrement_user_task_count(uid)
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result(f"\n任务队列已满（{eng.max_task_queue}个）！"))
             return
 
-        await eng.submit_task({
+        task = {
             "prompt": pure, "current_seed": seed,
             "current_width": w, "current_height": h,
             "current_batch_size": bs, "lora_list": lora_list,
             "selected_model": selected_model, "user_id": uid,
-            "callback": self._make_result_callback(event, "txt2img")
-        })
+            "callback": self._make_result_callback(event, "txt2img"),
+            "on_event": self._make_event_callback(event),
+        }
+        await eng.submit_task(task)
 
         mf = ""
         if selected_model:
@@ -991,8 +975,9 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
             mf = f"\n使用模型：{md}"
 
         await self._send_with_auto_recall(event, event.plain_result(
-            f"\n文生图任务已加入队列（排队：{eng.task_queue.qsize()}个）\n"
-            f"提示词：{self._truncate_prompt(pure)}\nSeed：{seed}\n"
+            f"\n文生图任务已加入队列（排队：{eng.queued_count()}个）\n"
+            + self._eta_line(task)
+            + f"提示词：{self._truncate_prompt(pure)}\nSeed：{seed}\n"
             f"分辨率：{w}x{h}\n批量数：{bs}"
             + mf
             + (f"\n可用服务器：{'、'.join(s.name for s in eng.comfyui_servers if s.healthy)}"
@@ -1054,11 +1039,9 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
 
         try:
             img_path = await img_seg.convert_to_file_path()
-            if not os.path.exists(img_path):
-                raise Exception("图片下载失败")
-            fs = os.path.getsize(img_path)
-            if fs < 10240:
-                raise Exception("图片文件过小")
+            err = await eng.validate_input_image(img_path)
+            if err:
+                raise Exception(err)
         except Exception as e:
             await self._send_with_auto_recall(event, event.plain_result(f"\n图片下载失败：{str(e)[:200]}"))
             return
@@ -1074,26 +1057,36 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
             seed = random.randint(1, 2147483647)
 
         uid = str(event.get_sender_id())
+        gid = event.get_group_id() or None
+        wait = eng.check_rate_limit(uid, gid)
+        if wait:
+            await self._send_with_auto_recall(event, event.plain_result(f"\n{eng.rate_limit_message(wait)}！"))
+            return
         if not await eng._increment_user_task_count(uid):
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result(f"\n并发任务数已达上限！"))
             return
-        if eng.task_queue.full():
+        if eng.queue_full():
             await eng._decrement_user_task_count(uid)
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result(f"\n任务队列已满！"))
             return
 
-        await eng.submit_task({
+        task = {
             "prompt": pure, "current_seed": seed,
             "current_width": eng.default_width, "current_height": eng.default_height,
             "current_batch_size": bs, "lora_list": lora_list,
             "selected_model": selected_model, "user_id": uid,
             "img_path": img_path, "denoise": denoise,
-            "callback": self._make_result_callback(event, "img2img")
-        })
+            "callback": self._make_result_callback(event, "img2img"),
+            "on_event": self._make_event_callback(event),
+        }
+        await eng.submit_task(task)
 
         await self._send_with_auto_recall(event, event.plain_result(
-            f"\n图生图任务已加入队列（排队：{eng.task_queue.qsize()}个）\n"
-            f"提示词：{self._truncate_prompt(pure)}\nSeed：{seed}\n噪声：{denoise}"
+            f"\n图生图任务已加入队列（排队：{eng.queued_count()}个）\n"
+            + self._eta_line(task)
+            + f"提示词：{self._truncate_prompt(pure)}\nSeed：{seed}\n噪声：{denoise}"
         ))
 
     # --- Workflow ---
@@ -1129,41 +1122,7 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
 
         # 参数解析
         params_text = full_text[len(prefix):].strip()
-        node_configs = cfg.get("node_configs", {})
-        known_keys = set()
-        for _, nc in node_configs.items():
-            for pn, pi in nc.items():
-                known_keys.add(pn)
-                known_keys.update(pi.get("aliases", []))
-        param_pat = '|'.join(re.escape(k) for k in known_keys)
-        regex = rf'(?<!\S)({param_pat})(?=\s*:)'
-        matches = list(re.finditer(regex, params_text))
-        args = []
-        prompt_parts = []
-        last_end = 0
-        for m in matches:
-            ps = m.start()
-            if ps > last_end:
-                pp = params_text[last_end:ps].strip()
-                if pp:
-                    prompt_parts.append(pp)
-            cp = params_text.find(':', ps)
-            if cp == -1:
-                continue
-            nps = len(params_text)
-            idx = matches.index(m)
-            if idx + 1 < len(matches):
-                nps = matches[idx + 1].start()
-            val = params_text[cp + 1:nps].strip()
-            args.append(f"{m.group(1)}:{val}")
-            last_end = nps
-        if last_end < len(params_text):
-            pp = params_text[last_end:].strip()
-            if pp:
-                prompt_parts.append(pp)
-        prompt_text = ' '.join(prompt_parts).strip()
-        if prompt_text:
-            args.insert(0, f"提示词:{prompt_text}")
+        args = eng.tokenize_workflow_args(params_text, cfg)
 
         params = eng.parse_workflow_params(args, cfg)
         missing = eng.validate_required_params(cfg, params)
@@ -1187,51 +1146,142 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
                 await self._send_with_auto_recall(event, event.plain_result("此workflow需要图片输入"))
                 return
             uid = str(event.get_sender_id())
-            for i, seg in enumerate(img_segs):
-                try:
-                    ip = await seg.convert_to_file_path()
-                    if not os.path.exists(ip):
-                        raise Exception("文件下载失败")
-                    fs = os.path.getsize(ip)
-                    if fs < 10240:
-                        raise Exception("文件过小")
-                    if eng.enable_auto_save:
-                        saved = await eng.save_input_image_permanently(ip, "workflow", uid, wfn, i)
-                        image_paths.append(saved or ip)
-                    else:
-                        image_paths.append(ip)
-                except Exception as e:
-                    err = str(e)
-                    if "PERMANENT_ERROR:" in err:
-                        await self._send_with_auto_recall(event, event.plain_result(err.replace("PERMANENT_ERROR:", "")))
-                    else:
-                        await self._send_with_auto_recall(event, event.plain_result(f"第{i+1}张图片失败：{err[:200]}"))
-                    return
+            try:
+                image_paths = await self._fetch_input_images(img_segs, uid, wfn)
+            except Exception as e:
+                idx = getattr(e, "image_index", None)
+                err = str(e)
+                if "PERMANENT_ERROR:" in err:
+                    await self._send_with_auto_recall(event, event.plain_result(err.replace("PERMANENT_ERROR:", "")))
+                elif idx is not None:
+                    await self._send_with_auto_recall(event, event.plain_result(f"第{idx+1}张图片失败：{err[:200]}"))
+                else:
+                    await self._send_with_auto_recall(event, event.plain_result(f"图片获取失败：{err[:200]}"))
+                return
 
         # 构建 workflow
         final_wf = eng.build_workflow(wf_data, cfg, params, [])
 
         # 入队
         uid = str(event.get_sender_id())
+        gid = event.get_group_id() or None
+        wait = eng.check_rate_limit(uid, gid)
+        if wait:
+            await self._send_with_auto_recall(event, event.plain_result(eng.rate_limit_message(wait)))
+            return
         if not await eng._increment_user_task_count(uid):
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result(f"并发任务数已达上限"))
             return
-        if eng.task_queue.full():
+        if eng.queue_full():
             await eng._decrement_user_task_count(uid)
+            eng.refund_rate_limit(uid, gid)
             await self._send_with_auto_recall(event, event.plain_result("队列已满"))
             return
 
-        await eng.submit_task({
+        task = {
             "prompt": final_wf,
             "workflow_name": wfn, "user_id": uid,
             "is_workflow": True, "image_paths": image_paths,
             "workflow_config": cfg,
-            "callback": self._make_result_callback(event, "workflow")
-        })
+            "callback": self._make_result_callback(event, "workflow"),
+            "on_event": self._make_event_callback(event),
+        }
+        await eng.submit_task(task)
         await self._send_with_auto_recall(event, event.plain_result(
-            f"Workflow「{cfg['name']}」已加入队列（排队：{eng.task_queue.qsize()}个）"
+            f"Workflow「{cfg['name']}」已加入队列（排队：{eng.queued_count()}个）"
+            + ("\n" + self._eta_line(task)).rstrip()
         ))
 
+    def _make_event_callback(self, event: AstrMessageEvent):
+        """
+        创建任务生命周期事件回调：排队位置、开始执行、采样进度
+        
+        距上一条消息（含入队确认）不足 progress_update_interval 秒的事件直接丢弃；
+        新的进度消息发出后撤回上一条，任务结束时撤回最后一条，群里只保留一条进度。
+        """
+        if self.progress_update_interval <= 0:
+            return None
+        state = {"last": time.monotonic(), "sent": None, "done": False}
+        lock = asyncio.Lock()
+        fmt = EtaEstimator.format_duration
+
+        async def _on_event(ev: TaskEvent):
+            async with lock:
+                if state["done"]:
+                    return
+                if ev.kind == "finished":
+                    state["done"] = True
+                    text = None
+                else:
+                    if time.monotonic() - state["last"] < self.progress_update_interval:
+                        return
+                    if ev.kind == "queued":
+                        text = f"排队中：前面还有{ev.position - 1}个任务"
+                        if ev.eta:
+                            text += f"，预计{fmt(ev.eta[0])}后开始"
+                    elif ev.kind == "dispatched":
+                        text = f"任务已在服务器【{ev.server}】开始执行"
+                        if ev.eta:
+                            text += f"，预计{fmt(ev.eta[1])}后完成"
+                    elif ev.kind == "progress" and ev.maximum > 0:
+                        text = f"生成中：{ev.value}/{ev.maximum} 步（{ev.value * 100 // ev.maximum}%）"
+                    else:
+                        return
+                prev = state["sent"]
+                state["sent"] = None
+                if text:
+                    state["last"] = time.monotonic()
+                    state["sent"] = await self._send_recallable(event, event.plain_result(text))
+                if prev is not None:
+                    await self._recall_message(event, prev)
+
+        return _on_event
+
+    def _eta_line(self, task: dict) -> str:
+        """确认消息中的排队预估行（含换行），无法估算时为空"""
+        eta = self.engine.format_task_eta(task)
+        return f"{eta}\n" if eta else ""
+
+    async def _fetch_input_images(self, img_segs: list, user_id: str, workflow_name: str) -> List[str]:
+        """
+        并发下载并校验 workflow 输入图片（有并发上限和单张超时）
+        
+        Returns:
+            与 img_segs 顺序一致的本地路径列表
+        Raises:
+            第一张（按序号）失败图片的异常，异常带有 image_index 属性
+        """
+        eng = self.engine
+        sem = asyncio.Semaphore(max(1, self.image_fetch_concurrency))
+
+        async def _fetch(i: int, seg) -> str:
+            async with sem:
+                try:
+                    ip = await asyncio.wait_for(seg.convert_to_file_path(), timeout=self.image_fetch_timeout)
+                except asyncio.TimeoutError:
+                    raise Exception(f"下载超时（{self.image_fetch_timeout}秒）")
+                err = await eng.validate_input_image(ip)
+                if err:
+                    raise Exception(err)
+                if eng.enable_auto_save:
+                    saved = await eng.save_input_image_permanently(ip, "workflow", user_id, workflow_name, i)
+                    return saved or ip
+                return ip
+
+        tasks = [asyncio.create_task(_fetch(i, seg)) for i, seg in enumerate(img_segs)]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for i, t in enumerate(tasks):
+            if t in done and not t.cancelled() and t.exception() is not None:
+                exc = t.exception()
+                exc.image_index = i
+                raise exc
+        return [t.result() for t in tasks]
+
     async def _send_workflow_help(self, event: AstrMessageEvent, prefix: str):
         """发送 workflow 帮助"""
         eng = self.engine
@@ -1257,11 +1307,13 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
                 return True
             help_text = self._generate_workflow_help_text(prefix, cfg)
             title = cfg.get("name", "工作流帮助")
-            img_data = self._create_help_image(help_text, title)
+            loop = asyncio.get_event_loop()
+            img_data = await loop.run_in_executor(None, self._create_help_image, help_text, title)
             if img_data:
-                wf_dir.mkdir(parents=True, exist_ok=True)
-                with open(hip, 'wb') as f:
-                    f.write(img_data)
+                def _write():
+                    wf_dir.mkdir(parents=True, exist_ok=True)
+                    hip.write_bytes(img_data)
+                await loop.run_in_executor(None, _write)
                 await event.send(event.image_result(str(hip)))
                 return True
             return False
@@ -1342,67 +1394,56 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
         return examples
 
     def _create_help_image(self, text: str, title: str = "工作流帮助") -> Optional[bytes]:
+        """渲染 workflow 帮助图片（CPU 密集，在线程池中调用）"""
         try:
-            from PIL import Image as PILImage, ImageDraw, ImageFont
-            width = 1200
-            pad = 50
-            lh = 35
-            fst = 52
-            fsn = 32
-            fss = 24
-            bh = 120
-            bth = 80
-            try:
-                fp = os.path.join(self.plugin_dir, "1.ttf")
-                tf = ImageFont.truetype(fp, fst) if os.path.exists(fp) else ImageFont.load_default()
-                nf = ImageFont.truetype(fp, fsn) if os.path.exists(fp) else ImageFont.load_default()
-                sf = ImageFont.truetype(fp, fss) if os.path.exists(fp) else ImageFont.load_default()
-            except Exception:
-                tf = nf = sf = ImageFont.load_default()
-            lines = text.split('\n')
-            ch = len(lines) * lh + 50
-            height = max(800, bh + ch + bth)
-            img = PILImage.new('RGB', (width, height), '#ffffff')
-            draw = ImageDraw.Draw(img)
-            draw.rectangle([0, 0, width, 80], fill='#4a90e2')
-            tt = f"🎨 ComfyUI AI绘画 - {title}"
-            tb = draw.textbbox((0, 0), tt, font=tf)
-            draw.text(((width - (tb[2] - tb[0])) // 2, 25), tt, fill='white', font=tf)
-            yo = bh
-            for line in lines:
-                if line.startswith('🔧'):
-                    draw.text((pad, yo), line, fill='#333', font=nf)
-                elif line.startswith('='):
-                    draw.text((pad, yo), line, fill='#34495e', font=nf)
-                elif line.startswith(('📝', '⚙️', '💡', '⚠️')):
-                    draw.text((pad, yo), line, fill='#2980b9' if line.startswith('📝') else '#27ae60', font=nf)
-                elif line.startswith('🔸'):
-                    draw.text((pad, yo), line, fill='#8e44ad', font=sf)
-                elif line.startswith(('   ', '  ')):
-                    draw.text((pad, yo), line, fill='#34495e' if line.startswith('   ') else '#16a085', font=sf)
-                else:
-                    draw.text((pad, yo), line, fill='#666', font=sf)
-                yo += lh
-            draw.rectangle([0, height - 80, width, height], fill='#f5f5f5')
-            draw.text((50, height - 60), f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill='#999', font=sf)
-            draw.text((50, height - 35), "https://github.com/tjc6666666666666/astrbot_plugin_ComfyUI_promax", fill='#666', font=sf)
-            try:
-                ap = os.path.join(self.plugin_dir, "Astrbot.png")
-                if os.path.exists(ap):
-                    ai = PILImage.open(ap)
-                    ath = 60
-                    atw = int(ath * ai.width / ai.height)
-                    ar = ai.resize((atw, ath), PILImage.Resampling.LANCZOS)
-                    img.paste(ar, (width - atw - 10, height - ath - 10), ar if ar.mode == 'RGBA' else None)
-            except Exception:
-                pass
-            buf = io.BytesIO()
-            img.save(buf, format='PNG', quality=95)
-            return buf.getvalue()
+            with self._help_render_lock:
+                return self._draw_workflow_help(text, title)
         except Exception as e:
             logger.error(f"创建工作流帮助图片失败: {e}")
             return None
 
+    def _draw_workflow_help(self, text: str, title: str) -> bytes:
+        from PIL import Image as PILImage, ImageDraw
+        tf, nf, sf, logo = self._load_help_assets()
+        width = 1200
+        pad = 50
+        lh = 35
+        bh = 120
+        bth = 80
+        lines = text.split('\n')
+        ch = len(lines) * lh + 50
+        height = max(800, bh + ch + bth)
+        img = PILImage.new('RGB', (width, height), '#ffffff')
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([0, 0, width, 80], fill='#4a90e2')
+        tt = f"🎨 ComfyUI AI绘画 - {title}"
+        tb = draw.textbbox((0, 0), tt, font=tf)
+        draw.text(((width - (tb[2] - tb[0])) // 2, 25), tt, fill='white', font=tf)
+        yo = bh
+        for line in lines:
+            if line.startswith('🔧'):
+                draw.text((pad, yo), line, fill='#333', font=nf)
+            elif line.startswith('='):
+                draw.text((pad, yo), line, fill='#34495e', font=nf)
+            elif line.startswith(('📝', '⚙️', '💡', '⚠️')):
+                draw.text((pad, yo), line, fill='#2980b9' if line.startswith('📝') else '#27ae60', font=nf)
+            elif line.startswith('🔸'):
+                draw.text((pad, yo), line, fill='#8e44ad', font=sf)
+            elif line.startswith(('   ', '  ')):
+                draw.text((pad, yo), line, fill='#34495e' if line.startswith('   ') else '#16a085', font=sf)
+            else:
+                draw.text((pad, yo), line, fill='#666', font=sf)
+            yo += lh
+        draw.rectangle([0, height - 80, width, height], fill='#f5f5f5')
+        draw.text((50, height - 60), f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill='#999', font=sf)
+        draw.text((50, height - 35), "https://github.com/tjc6666666666666/astrbot_plugin_ComfyUI_promax", fill='#666', font=sf)
+        if logo is not None:
+            img.paste(logo, (width - logo.width - 10, height - logo.height - 10),
+                      logo if logo.mode == 'RGBA' else None)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
     # --- 帮助 ---
     @filter.custom_filter(HelpFilter)
     async def send_help(self, event: AstrMessageEvent):
@@ -1414,6 +1455,28 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
         else:
             await self._send_help_as_text(event)
 
+    # --- 取消任务 ---
+    @filter.custom_filter(CancelTaskFilter)
+    async def handle_cancel_task(self, event: AstrMessageEvent):
+        """「取消任务」取消最近提交的一个任务，「取消全部任务」取消自己的全部任务"""
+        if not self._check_group_whitelist(event):
+            await self._send_with_auto_recall(event, event.plain_result("❌ 不在白名单中"))
+            return
+        uid = str(event.get_sender_id())
+        all_tasks = event.message_obj.message_str.strip() == "取消全部任务"
+        counts = await self.engine.cancel_user_tasks(uid, all_tasks=all_tasks)
+        if not any(counts.values()):
+            await self._send_with_auto_recall(event, event.plain_result("\n您当前没有排队或执行中的任务"))
+            return
+        parts = []
+        if counts["queued"]:
+            parts.append(f"已取消{counts['queued']}个排队中的任务")
+        if counts["running"]:
+            parts.append(f"已中断{counts['running']}个执行中的任务")
+        if counts["finished"]:
+            parts.append(f"{counts['finished']}个任务已生成完成，正在发送结果，无法取消")
+        await self._send_with_auto_recall(event, event.plain_result("\n" + "，".join(parts)))
+
     # --- 输出压缩包 ---
     @filter.custom_filter(OutputZipFilter)
     async def handle_output_zip(self, event: AstrMessageEvent):
@@ -1429,26 +1492,26 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
         if not files:
             await self._send_with_auto_recall(event, event.plain_result("\n今天还没有生成的图片！"))
             return
+        if self.gallery_server and self.gallery_server.running:
+            link = self.gallery_server.make_link(uid)
+            ttl_min = max(1, self.gallery_server.link_ttl // 60)
+            await self._increment_download_count(uid)
+            await event.send(event.plain_result(
+                f"\n今日图片共 {len(files)} 张，画廊链接（{ttl_min}分钟内有效）：\n{link}"))
+            return
         zip_path = await self.engine.create_zip(files, uid)
         if not zip_path or not os.path.exists(zip_path):
             await self._send_with_auto_recall(event, event.plain_result("\n压缩包创建失败！"))
             return
         await self._increment_download_count(uid)
+        # 发送的是当日压缩包的快照，上传期间其他导出可以继续更新压缩包；快照到期由引擎删除
         await self._upload_zip_file(event, zip_path)
-        self._schedule_cleanup(zip_path)
 
     async def _increment_download_count(self, user_id: str):
         await self.engine.increment_download_count(user_id)
 
     def _schedule_cleanup(self, path: str, delay: int = 10):
-        async def _cl():
-            await asyncio.sleep(delay)
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except Exception:
-                pass
-        asyncio.create_task(_cl())
+        self.engine.delay_scheduler.delete_later(path, delay)
 
     async def _upload_zip_file(self, event: AstrMessageEvent, zip_path: str) -> bool:
         try:
@@ -1684,21 +1747,29 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
         if not any(s.healthy for s in eng.comfyui_servers):
             return "当前没有可用的ComfyUI服务器。"
         uid = str(event.get_sender_id())
+        gid = event.get_group_id() or None
+        wait = eng.check_rate_limit(uid, gid)
+        if wait:
+            return eng.rate_limit_message(wait)
         if not await eng._increment_user_task_count(uid):
+            eng.refund_rate_limit(uid, gid)
             return f"您的并发任务数已达上限（{eng.max_concurrent_tasks_per_user}个）"
-        if eng.task_queue.full():
+        if eng.queue_full():
             await eng._decrement_user_task_count(uid)
+            eng.refund_rate_limit(uid, gid)
             return f"任务队列已满（{eng.max_task_queue}个上限）"
-        await eng.submit_task({
+        task = {
             "prompt": prompt, "current_seed": seed,
             "current_width": w, "current_height": h,
             "current_batch_size": 1, "lora_list": [],
             "selected_model": None, "user_id": uid,
-            "callback": self._make_result_callback(event, "llm_tool")
-        })
+            "callback": self._make_result_callback(event, "llm_tool"),
+            "on_event": self._make_event_callback(event),
+        }
+        await eng.submit_task(task)
         servers = [s.name for s in eng.comfyui_servers if s.healthy]
         sf = f"\n可用服务器：{'、'.join(servers)}" if servers else "\n当前无可用服务器，任务将在服务器恢复后处理"
-        return f"文生图任务已加入队列（排队：{eng.task_queue.qsize()}个）\n提示词：{prompt}\nSeed：{seed}\n分辨率：{w}x{h}{sf}"
+        return f"文生图任务已加入队列（排队：{eng.queued_count()}个）\n{self._eta_line(task)}提示词：{prompt}\nSeed：{seed}\n分辨率：{w}x{h}{sf}"
 
     # ========== 清理 ==========
 
@@ -1712,6 +1783,14 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
                     await eng.server_monitor_task
                 except asyncio.CancelledError:
                     pass
+            for task in (eng.retention_task, eng.transcode_task):
+                if task and not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+            eng.shutdown_transcoder()
             for srv in eng.comfyui_servers:
                 if srv.worker and not srv.worker.done():
                     srv.worker.cancel()
@@ -1720,7 +1799,11 @@ background:linear-gradient(135deg,#667eea,#764ba2);min-height:100vh}}
                     except asyncio.CancelledError:
                         pass
                     srv.worker = None
-            await self._stop_help_server()
+            if self.gallery_server:
+                await self.gallery_server.stop()
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            await eng.close_database()
             logger.info("清理完成")
         except Exception as e:
             logger.error(f"清理时出错: {e}")
@@ -0,0 +1,236 @@
+"""
+引擎指标 — 计数器、仪表、直方图，以 Prometheus 文本格式导出
+
+不依赖 prometheus_client。热路径上的一次观测只有一次字典查找（带标签时）加几次整数/浮点运算：
+- Counter.inc / Histogram.observe 不加锁（全部在事件循环线程中调用）
+- 直方图用 bisect 定位桶，只累加单个桶，导出时再转为累计值
+- 队列长度、服务器状态等仪表用回调在导出时读取，不在热路径上更新
+
+MetricsServer 是可选的本地 HTTP 服务，GET /metrics 返回 text/plain; version=0.0.4。
+"""
+import logging
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger("Metrics")
+
+# 默认耗时桶（秒），覆盖 0.01 秒的上传到数分钟的视频工作流
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """取（或创建）对应标签值的子指标；热路径上可缓存返回值"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_str(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in self._children.items():
+            yield from self._render_child(values, child)
+
+    def _render_child(self, values: tuple, child) -> Iterable[str]:
+        yield f"{self.name}{self._label_str(values)} {_fmt(child.value)}"
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._children[()].value += amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], object]] = None):
+        """
+        Args:
+            callback: 导出时调用；无标签时返回数值，有标签时返回 {标签值元组: 数值}
+        """
+        super().__init__(name, doc, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._children[()].value = value
+
+    def render(self) -> Iterable[str]:
+        if self.callback is not None:
+            try:
+                data = self.callback()
+            except Exception as e:
+                logger.debug(f"读取指标 {self.name} 失败: {e}")
+                return
+            yield f"# HELP {self.name} {self.doc}"
+            yield f"# TYPE {self.name} gauge"
+            items = data.items() if isinstance(data, dict) else [((), data)]
+            for values, value in items:
+                yield f"{self.name}{self._label_str(values)} {_fmt(float(value))}"
+            return
+        yield from super().render()
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(b) for b in buckets if b != math.inf))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _render_child(self, values: tuple, child: _HistogramValue) -> Iterable[str]:
+        total = 0
+        for bound, count in zip(self.bounds + (math.inf,), child.counts):
+            total += count
+            le = 'le="%s"' % _fmt(bound)
+            yield f"{self.name}_bucket{self._label_str(values, le)} {total}"
+        yield f"{self.name}_sum{self._label_str(values)} {_fmt(child.sum)}"
+        yield f"{self.name}_count{self._label_str(values)} {total}"
+
+
+class MetricsRegistry:
+    """引擎内的指标集合"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(self.prefix + name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Tuple[str, ...] = (),
+              callback: Optional[Callable[[], object]] = None) -> Gauge:
+        return self._add(Gauge(self.prefix + name, doc, labelnames, callback))
+
+    def histogram(self, name: str, doc: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, doc, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """只提供 GET /metrics 的本地 HTTP 服务"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 7780):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> bool:
+        if self._runner is not None:
+            return True
+        try:
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle_metrics)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, self.port).start()
+            self._runner = runner
+            logger.info(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+            return True
+        except Exception as e:
+            logger.error(f"指标服务启动失败: {e}")
+            return False
+
+    async def stop(self):
+        if self._runner is None:
+            return
+        try:
+            await self._runner.cleanup()
+        finally:
+            self._runner = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
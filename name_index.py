@@ -0,0 +1,71 @@
+"""
+名称子串索引 — LoRA / 模型的模糊查找
+
+lora_name_map / model_name_map 的结构为 {小写键: (文件名, 描述)}。原先的模糊匹配对每个
+lora: / model: 参数线性扫描全部条目，检查输入是否为「键」或「描述小写」的子串。
+
+这里对每个条目的键和描述小写建立 1~3 字符 n-gram 倒排表（条目下标按映射顺序递增）：
+- 输入不超过 3 个字符：该 n-gram 的倒排表就是结果
+- 更长的输入：取输入中最稀有的 3-gram 的倒排表作为候选，再逐个做子串校验
+结果（含顺序）与线性扫描完全一致，唯一 / 多个 / 未找到的判断交给调用方；
+未找到时提示用的去重描述列表也缓存在索引上。
+
+索引在配置解析时构建一次；映射被整体替换或条目数变化时由引擎重建。
+"""
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+GRAM = 3
+
+
+class NameIndex:
+    """{小写键: (文件名, 描述)} 映射的子串索引"""
+
+    __slots__ = ("mapping", "size", "keys", "_texts", "_postings", "_descriptions")
+
+    def __init__(self, mapping: Dict[str, Tuple[str, str]]):
+        self.mapping = mapping
+        self.size = len(mapping)
+        self.keys: List[str] = list(mapping)
+        self._texts: List[Tuple[str, str]] = [(k, d.lower()) for k, (_, d) in mapping.items()]
+        postings: Dict[str, list] = {}
+        get = postings.get
+        for i, texts in enumerate(self._texts):
+            grams = {text[j:j + n] for text in texts for n in range(1, GRAM + 1)
+                     for j in range(len(text) - n + 1)}
+            for gram in grams:
+                ids = get(gram)
+                if ids is None:
+                    postings[gram] = [i]
+                else:
+                    ids.append(i)
+        # 紧凑存储：每个下标 4 字节
+        self._postings: Dict[str, array] = {g: array("I", ids) for g, ids in postings.items()}
+        self._descriptions: Optional[List[str]] = None
+
+    def matches(self, mapping: dict) -> bool:
+        """索引是否仍对应该映射（同一对象且条目数未变）"""
+        return mapping is self.mapping and len(mapping) == self.size
+
+    def search(self, query: str) -> List[str]:
+        """返回 query 为其键或描述小写子串的所有键，顺序与映射一致（query 须已小写）"""
+        if not query:
+            return list(self.keys)
+        if len(query) <= GRAM:
+            return [self.keys[i] for i in self._postings.get(query, ())]
+        candidates = None
+        for j in range(len(query) - GRAM + 1):
+            ids = self._postings.get(query[j:j + GRAM])
+            if ids is None:
+                return []
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        texts = self._texts
+        return [self.keys[i] for i in candidates
+                if query in texts[i][0] or query in texts[i][1]]
+
+    def descriptions(self) -> List[str]:
+        """去重后的全部非空描述（未找到时提示可用项），首次调用时计算"""
+        if self._descriptions is None:
+            self._descriptions = list(set(v[1] for v in self.mapping.values() if v[1]))
+        return self._descriptions
@@ -0,0 +1,184 @@
+"""
+令牌桶限流 — 按用户、按群聊、全局三级
+
+每次提交任务前调用 check()：三级桶都至少有 1 个令牌时一起扣除并放行，否则返回需要等待的秒数。
+桶状态按墙钟时间计算，定期合并写入数据库，重启后恢复；已回满的桶从内存和数据库中移除。
+
+限流规则格式与配置一致："次数/分钟"，如 "5/10" 表示桶容量 5，每 10 分钟回满 5 个令牌。
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("RateLimiter")
+
+
+def parse_rule(rule: str) -> Optional[Tuple[float, float]]:
+    """解析 "次数/分钟" 为 (容量, 每秒回复令牌数)；为空或格式错误时返回 None（不限流）"""
+    rule = (rule or "").strip()
+    if not rule:
+        return None
+    try:
+        count, minutes = rule.split("/", 1)
+        capacity, minutes = float(count), float(minutes)
+    except ValueError:
+        logger.warning(f"限流规则格式错误（应为 次数/分钟）：{rule}")
+        return None
+    if capacity <= 0 or minutes <= 0:
+        return None
+    return capacity, capacity / (minutes * 60)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float, tokens: Optional[float] = None,
+                 updated: Optional[float] = None):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self.updated = updated or time.time()
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float, n: float = 1.0) -> float:
+        """取出 n 个令牌还需等待的秒数（不扣除）"""
+        self.refill(now)
+        if self.tokens >= n:
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """三级令牌桶限流器"""
+
+    # 桶状态写入数据库的合并间隔（秒）
+    PERSIST_DELAY = 5.0
+
+    def __init__(self, user_rule: str = "", group_rule: str = "", global_rule: str = "",
+                 store=None, scheduler=None):
+        """
+        Args:
+            user_rule / group_rule / global_rule: "次数/分钟"，为空表示该级不限流
+            store: 提供 save_rate_buckets / get_rate_buckets 的数据库对象，为 None 时不持久化
+            scheduler: DelayedScheduler，用于合并写入
+        """
+        self.rules = {"u": parse_rule(user_rule), "g": parse_rule(group_rule),
+                      "global": parse_rule(global_rule)}
+        self.store = store
+        self.scheduler = scheduler
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._dirty: set = set()
+        self._persist_pending = False
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.rules.values())
+
+    def _keys(self, user_id: str, group_id: Optional[str]) -> List[Tuple[str, str]]:
+        keys = [("u", f"u:{user_id}")]
+        if group_id:
+            keys.append(("g", f"g:{group_id}"))
+        keys.append(("global", "global"))
+        return [(kind, key) for kind, key in keys if self.rules[kind]]
+
+    def _bucket(self, kind: str, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            capacity, rate = self.rules[kind]
+            bucket = self._buckets[key] = TokenBucket(capacity, rate)
+        return bucket
+
+    def check(self, user_id: str, group_id: Optional[str] = None) -> float:
+        """
+        尝试为一次提交扣除令牌
+
+        Returns:
+            0 表示放行（已扣除）；否则为需要等待的秒数（未扣除）
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.time()
+        buckets = [(key, self._bucket(kind, key)) for kind, key in self._keys(user_id, group_id)]
+        wait = max(b.wait_time(now) for _, b in buckets)
+        if wait > 0:
+            return wait
+        for key, bucket in buckets:
+            bucket.tokens -= 1
+            self._dirty.add(key)
+        self._request_persist()
+        return 0.0
+
+    def refund(self, user_id: str, group_id: Optional[str] = None):
+        """提交最终被拒绝（并发上限、队列已满等）时退回令牌"""
+        if not self.enabled:
+            return
+        for kind, key in self._keys(user_id, group_id):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+                self._dirty.add(key)
+        self._request_persist()
+
+    # ==================== 持久化 ====================
+
+    def _request_persist(self):
+        if self.store is None or self.scheduler is None or self._persist_pending:
+            return
+        self._persist_pending = True
+        self.scheduler.call_later(self.PERSIST_DELAY, self.persist)
+
+    async def persist(self):
+        """写入变化的桶；已回满的桶删除（等价于新桶）"""
+        self._persist_pending = False
+        if self.store is None or not self._dirty:
+            return
+        now = time.time()
+        save, drop = [], []
+        for key in self._dirty:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            bucket.refill(now)
+            if bucket.full:
+                drop.append(key)
+                del self._buckets[key]
+            else:
+                save.append((key, bucket.tokens, bucket.updated))
+        self._dirty.clear()
+        try:
+            await self.store.save_rate_buckets(save, drop)
+        except Exception as e:
+            logger.error(f"保存限流状态失败: {e}")
+
+    async def restore(self) -> int:
+        if self.store is None or not self.enabled:
+            return 0
+        rows = await self.store.get_rate_buckets()
+        for key, tokens, updated in rows:
+            kind = "global" if key == "global" else key.split(":", 1)[0]
+            rule = self.rules.get(kind)
+            if rule:
+                self._buckets[key] = TokenBucket(rule[0], rule[1], tokens, updated)
+                self._dirty.add(key)
+        return len(rows)
+
+    # ==================== 提示 ====================
+
+    @staticmethod
+    def format_wait(seconds: float) -> str:
+        seconds = max(1, int(seconds + 0.999))
+        if seconds < 60:
+            return f"{seconds}秒"
+        minutes, sec = divmod(seconds, 60)
+        if minutes < 60:
+            return f"{minutes}分{sec}秒" if sec else f"{minutes}分钟"
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}小时{minutes}分钟" if minutes else f"{hours}小时"
@@ -0,0 +1,215 @@
+"""
+延迟动作调度器 — 用一个最小堆和一个事件循环定时器代替「每个动作一个 sleep 任务」
+
+- call_later：到期时调用回调（协程函数则创建任务执行），可 cancel
+- delete_later：到期删除文件；待删除文件持久化到数据库，重启后继续删除
+- sweep_temp_dirs：启动时清理临时目录中遗留的过期文件
+
+无论有多少待撤回消息或待删除文件，常驻的只有堆中的条目和一个 TimerHandle。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger("DelayedScheduler")
+
+
+class ScheduledAction:
+    """堆条目；cancel 只做标记，出堆时跳过"""
+
+    __slots__ = ("when", "seq", "callback", "args")
+
+    def __init__(self, when: float, seq: int, callback: Callable, args: tuple):
+        self.when = when
+        self.seq = seq
+        self.callback: Optional[Callable] = callback
+        self.args = args
+
+    def __lt__(self, other: "ScheduledAction") -> bool:
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.callback = None
+        self.args = ()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.callback is None
+
+
+class DelayedScheduler:
+    """引擎内共享的延迟动作调度器"""
+
+    # 待删除文件写入数据库的合并间隔（秒）
+    PERSIST_DELAY = 1.0
+
+    def __init__(self, store=None):
+        """
+        Args:
+            store: 提供 save_pending_deletions / get_pending_deletions 的数据库对象，
+                   为 None 时不持久化
+        """
+        self.store = store
+        self._heap: List[ScheduledAction] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_when: Optional[float] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._persist_add: Dict[str, float] = {}
+        self._persist_remove: Set[str] = set()
+        self._persist_pending = False
+        self._closed = False
+
+    # ==================== 调度 ====================
+
+    def call_later(self, delay: float, callback: Callable, *args: Any) -> ScheduledAction:
+        """delay 秒后调用 callback(*args)；callback 可以是协程函数"""
+        loop = asyncio.get_event_loop()
+        action = ScheduledAction(loop.time() + max(0.0, delay), next(self._seq), callback, args)
+        heapq.heappush(self._heap, action)
+        if self._timer_when is None or action.when < self._timer_when:
+            self._arm(loop)
+        return action
+
+    def delete_later(self, path: str, delay: float) -> ScheduledAction:
+        """delay 秒后删除文件（持久化，重启后仍会删除）"""
+        if self.store is not None:
+            self._persist_add[path] = time.time() + delay
+            self._persist_remove.discard(path)
+            self._request_persist()
+        return self.call_later(delay, self._delete_file, path)
+
+    @property
+    def pending_count(self) -> int:
+        return sum(1 for a in self._heap if not a.cancelled)
+
+    def _arm(self, loop: asyncio.AbstractEventLoop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer, self._timer_when = None, None
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+        if self._heap and not self._closed:
+            self._timer_when = self._heap[0].when
+            self._timer = loop.call_at(self._timer_when, self._run_due)
+
+    def _run_due(self):
+        loop = asyncio.get_event_loop()
+        self._timer, self._timer_when = None, None
+        now = loop.time()
+        due_files: List[str] = []
+        while self._heap and self._heap[0].when <= now:
+            action = heapq.heappop(self._heap)
+            if action.cancelled:
+                continue
+            if action.callback == self._delete_file:
+                due_files.append(action.args[0])
+                continue
+            try:
+                result = action.callback(*action.args)
+                if asyncio.iscoroutine(result):
+                    task = loop.create_task(result)
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except Exception as e:
+                logger.warning(f"延迟动作执行失败: {e}")
+        if due_files:
+            # 一批到期文件合并成一次线程池调用
+            loop.run_in_executor(None, self._remove_files, due_files)
+            if self.store is not None:
+                for path in due_files:
+                    self._persist_add.pop(path, None)
+                    self._persist_remove.add(path)
+                self._request_persist()
+        self._arm(loop)
+
+    # ==================== 文件删除 ====================
+
+    @staticmethod
+    def _delete_file(path: str):
+        """占位回调：到期文件在 _run_due 中批量删除"""
+
+    @staticmethod
+    def _remove_files(paths: Iterable[str]):
+        for path in paths:
+            try:
+                os.remove(path)
+                logger.debug(f"临时文件已清理: {path}")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"清理临时文件失败 {path}: {e}")
+
+    # ==================== 持久化 ====================
+
+    def _request_persist(self):
+        if not self._persist_pending and not self._closed:
+            self._persist_pending = True
+            self.call_later(self.PERSIST_DELAY, self._persist)
+
+    async def _persist(self):
+        self._persist_pending = False
+        add, remove = self._persist_add, self._persist_remove
+        if not add and not remove:
+            return
+        self._persist_add, self._persist_remove = {}, set()
+        try:
+            await self.store.save_pending_deletions(list(add.items()), list(remove))
+        except Exception as e:
+            logger.error(f"保存待删除文件列表失败: {e}")
+            # 放回，下次合并写入
+            for path, due in add.items():
+                self._persist_add.setdefault(path, due)
+            self._persist_remove |= remove - set(self._persist_add)
+
+    async def restore(self) -> int:
+        """从数据库恢复上次未完成的文件删除，返回恢复的数量"""
+        if self.store is None:
+            return 0
+        rows = await self.store.get_pending_deletions()
+        now = time.time()
+        for path, due_at in rows:
+            self.call_later(max(0.0, due_at - now), self._delete_file, path)
+        if rows:
+            logger.info(f"恢复 {len(rows)} 个待删除的临时文件")
+        return len(rows)
+
+    async def sweep_temp_dirs(self, dirs: Iterable[str], max_age: float) -> int:
+        """删除临时目录中修改时间早于 max_age 秒前的文件，返回删除数量"""
+        def _sweep() -> int:
+            cutoff = time.time() - max_age
+            removed = 0
+            for d in dirs:
+                try:
+                    entries = list(os.scandir(d))
+                except FileNotFoundError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        pass
+            return removed
+
+        removed = await asyncio.get_event_loop().run_in_executor(None, _sweep)
+        if removed:
+            logger.info(f"启动清理：删除 {removed} 个过期临时文件")
+        return removed
+
+    # ==================== 关闭 ====================
+
+    async def close(self):
+        """停止定时器并写入待删除文件列表；未到期的回调被丢弃"""
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer, self._timer_when = None, None
+        self._heap.clear()
+        if self.store is not None:
+            await self._persist()
@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture
+def engine_config(tmp_path):
+    """以 _conf_schema.json 默认值构造引擎配置：无服务器、数据落在 tmp_path 下"""
+    with open(os.path.join(ROOT, "_conf_schema.json"), encoding="utf-8") as f:
+        defaults = {k: v.get("default") for k, v in json.load(f).items()}
+
+    def make(**overrides) -> dict:
+        config = dict(defaults)
+        config.update(comfyui_url=[], auto_save_directory=str(tmp_path / "output"),
+                      enable_metrics=False)
+        config.update(overrides)
+        return config
+    return make
+
+
+async def _shutdown(eng):
+    # 构造时启动的 _init_database 没有保存引用：先等它结束，避免关闭后又重新打开连接
+    init = [t for t in asyncio.all_tasks() if t.get_coro().__name__ == "_init_database"]
+    await asyncio.gather(*init, return_exceptions=True)
+    tasks = [eng.server_monitor_task, eng.retention_task, eng.transcode_task]
+    tasks += [s.worker for s in eng.comfyui_servers]
+    for task in tasks:
+        if task and not task.done():
+            task.cancel()
+    await asyncio.gather(*(t for t in tasks if t), return_exceptions=True)
+    await eng.close_database()
+
+
+@pytest.fixture
+def shutdown_engine():
+    """停止引擎后台任务与 worker 并关闭数据库（与插件卸载时的顺序一致）"""
+    return _shutdown
+
+
+@pytest.fixture
+def fake_comfyui():
+    """benchmarks/fake_comfyui.py 中的 ComfyUI 替身类"""
+    from fake_comfyui import FakeComfyUI
+    return FakeComfyUI
@@ -0,0 +1,52 @@
+"""BlobStore：硬链接去重、不支持硬链接时的普通保存、引用释放"""
+import os
+from pathlib import Path
+
+from blob_store import BlobStore, sha256_bytes
+
+
+def test_duplicate_content_shares_one_blob(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    a, b = tmp_path / "d1" / "a.png", tmp_path / "d2" / "b.png"
+    digest = store.store_bytes(b"payload", a)
+    assert store.store_bytes(b"payload", b) == digest == sha256_bytes(b"payload")
+    blob = store.blob_path(digest, ".png")
+    assert os.stat(blob).st_nlink == 3
+    os.remove(a)
+    assert not store.release(digest, ".png")
+    os.remove(b)
+    assert store.release(digest, ".png")
+    assert not blob.exists()
+
+
+def test_release_after_link_deleted_externally(tmp_path):
+    """链接文件被其他清理删除后，release 仍能回收 blob"""
+    store = BlobStore(str(tmp_path / "blobs"))
+    src = tmp_path / "input.jpg"
+    src.write_bytes(b"jpeg bytes")
+    dest = tmp_path / "img2img_inputs" / "x.jpg"
+    digest = store.store_file(str(src), dest)
+    os.remove(dest)
+    assert store.release(digest, ".jpg")
+    assert not (tmp_path / "blobs").exists() or not any((tmp_path / "blobs").rglob("*.jpg"))
+
+
+def test_without_hardlinks_files_are_stored_plain(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+    calls = []
+
+    def no_link(src, dst):
+        calls.append(dst)
+        raise OSError(1, "Operation not permitted")
+
+    monkeypatch.setattr(os, "link", no_link)
+    for i in range(3):
+        dest = tmp_path / "out" / f"{i}.png"
+        assert store.store_bytes(b"same", dest) is None
+        assert dest.read_bytes() == b"same"
+    src = tmp_path / "src.png"
+    src.write_bytes(b"file")
+    assert store.store_file(str(src), Path(tmp_path / "out" / "f.png")) is None
+    # 只探测一次，且不写 blob
+    assert len(calls) == 1
+    assert not any(p.is_file() for p in (tmp_path / "blobs").rglob("*"))
@@ -0,0 +1,89 @@
+"""取消任务：排队中的任务由 worker 取出时丢弃，执行中的任务被中断，已执行完的任务报告为 finished"""
+import asyncio
+import json
+
+from workflow_engine import WorkflowEngine
+
+
+def _task(i: int, results: dict) -> dict:
+    return {
+        "prompt": f"cancel-{i}", "current_seed": i, "current_width": 512, "current_height": 512,
+        "current_batch_size": 1, "lora_list": [], "selected_model": None, "user_id": "u1",
+        "callback": lambda result: results.setdefault(i, result.success),
+    }
+
+
+async def _wait(predicate, timeout: float = 10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.02)
+
+
+def test_cancelled_queue_slots_are_reusable(tmp_path, engine_config, shutdown_engine):
+    """没有 worker 取出时，取消的任务也不再占用队列容量"""
+    async def run():
+        eng = WorkflowEngine(engine_config(max_task_queue=2), plugin_dir=str(tmp_path))
+        try:
+            results: dict = {}
+            tasks = [_task(i, results) for i in range(3)]
+            assert await eng.submit_task(tasks[0])
+            assert await eng.submit_task(tasks[1])
+            assert eng.queue_full() and not await eng.submit_task(tasks[2])
+            assert await eng.cancel_task(tasks[0]) == "queued"
+            assert await eng.cancel_task(tasks[1]) == "queued"
+            assert eng.queued_count() == 0 and not eng.queue_full()
+            assert await eng.submit_task(tasks[2])
+            assert eng.queued_count() == 1
+            assert [td for td, _ in eng.get_user_tasks("u1")] == [tasks[2]]
+        finally:
+            await shutdown_engine(eng)
+
+    asyncio.run(run())
+
+
+def test_cancel_queued_running_and_finished_tasks(tmp_path, engine_config, shutdown_engine, fake_comfyui):
+    async def run():
+        fake = fake_comfyui(exec_delay=0.6, output_size=4096)
+        url = await fake.start()
+        config = engine_config(comfyui_url=[f"{url},fake1"], max_task_queue=3,
+                               max_concurrent_tasks_per_user=10, enable_auto_save=False)
+        eng = WorkflowEngine(config, plugin_dir=str(tmp_path))
+        try:
+            await _wait(lambda: any(s.worker for s in eng.comfyui_servers))
+            results: dict = {}
+            tasks = [_task(i, results) for i in range(3)]
+            for td in tasks:
+                assert await eng._increment_user_task_count("u1")
+                assert await eng.submit_task(td)
+            await _wait(lambda: fake.running is not None)
+
+            # 排队中的第 2 个任务：立即移出排队列表，释放用户任务数
+            assert await eng.cancel_task(tasks[1]) == "queued"
+            assert await eng.cancel_task(tasks[1]) == ""
+            assert [td for td, _ in eng.get_user_tasks("u1")] == [tasks[0], tasks[2]]
+            assert eng.user_task_counts["u1"] == 2
+
+            # ComfyUI 已执行完、引擎轮询（间隔 3 秒）尚未发现：不再可取消，结果照常发送
+            await _wait(lambda: len(fake.history) == 1)
+            assert eng.comfyui_servers[0].current_task is tasks[0]
+            assert await eng.cancel_task(tasks[0]) == "finished"
+            assert not tasks[0].get("cancelled")
+
+            # 第 3 个任务执行中：中断
+            await _wait(lambda: eng.comfyui_servers[0].current_task is tasks[2]
+                        and tasks[2].get("prompt_id") and fake.running is not None)
+            assert await eng.cancel_task(tasks[2]) == "running"
+            await _wait(lambda: eng.comfyui_servers[0].current_task is None)
+            await _wait(lambda: eng.task_queue.empty() and 0 in results)
+            return results, [fp.prompt for fp in fake.history.values() if not fp.interrupted], eng._cancelled_task_ids
+        finally:
+            await shutdown_engine(eng)
+            await fake.stop()
+
+    results, prompts, cancelled_ids = asyncio.run(run())
+    assert results == {0: True}
+    executed = json.dumps(prompts, ensure_ascii=False)
+    assert "cancel-0" in executed
+    assert "cancel-1" not in executed and "cancel-2" not in executed
+    assert not cancelled_ids
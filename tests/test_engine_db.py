@@ -0,0 +1,110 @@
+"""EngineDatabase 写后缓冲：关闭 / 引擎停止时落盘"""
+import asyncio
+import sqlite3
+
+from engine_db import CATEGORY_OUTPUTS, EngineDatabase
+from workflow_engine import WorkflowEngine
+
+
+def _count(db_path: str) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM image_records").fetchone()[0]
+
+
+def _add(db: EngineDatabase, n: int, start: int = 0):
+    for i in range(start, start + n):
+        db.add_image_record(f"img_{i}.png", "u1", file_path=f"/tmp/img_{i}.png",
+                            file_size=100 + i, category=CATEGORY_OUTPUTS)
+
+
+def test_close_flushes_buffered_rows(tmp_path):
+    db_path = str(tmp_path / "user.db")
+
+    async def run():
+        # 间隔足够长、行数阈值足够大：只有 close() 会触发落盘
+        db = EngineDatabase(db_path, flush_rows=1000, flush_interval=3600)
+        await db.connect()
+        _add(db, 25)
+        assert db.pending_count == 25
+        assert _count(db_path) == 0
+        await db.close()
+        assert db.pending_count == 0
+
+    asyncio.run(run())
+    assert _count(db_path) == 25
+
+
+def test_close_waits_for_in_flight_background_flush(tmp_path):
+    db_path = str(tmp_path / "user.db")
+
+    async def run():
+        db = EngineDatabase(db_path, flush_rows=10, flush_interval=3600)
+        await db.connect()
+        _add(db, 10)   # 达到阈值，后台落盘已启动
+        _add(db, 3, start=10)
+        await db.close()
+
+    asyncio.run(run())
+    assert _count(db_path) == 13
+
+
+def test_close_without_connection_opens_and_flushes(tmp_path):
+    db_path = str(tmp_path / "user.db")
+
+    async def run():
+        db = EngineDatabase(db_path, flush_rows=1000, flush_interval=3600)
+        _add(db, 4)
+        await db.close()
+
+    asyncio.run(run())
+    assert _count(db_path) == 4
+
+
+def test_interval_flush_and_reads_see_buffered_rows(tmp_path):
+    db_path = str(tmp_path / "user.db")
+
+    async def run():
+        db = EngineDatabase(db_path, flush_rows=1000, flush_interval=0.05)
+        await db.connect()
+        _add(db, 2)
+        # 查询前先落盘缓冲
+        assert sorted(await db.get_user_images("u1")) == ["img_0.png", "img_1.png"]
+        _add(db, 3, start=2)
+        await asyncio.sleep(0.3)
+        assert db.pending_count == 0
+        assert _count(db_path) == 5
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_rows_are_lost_only_without_close(tmp_path):
+    """未调用 close() 就退出（模拟崩溃）时，缓冲中的记录不会落盘"""
+    db_path = str(tmp_path / "user.db")
+
+    async def run():
+        db = EngineDatabase(db_path, flush_rows=1000, flush_interval=3600)
+        await db.connect()
+        _add(db, 5)
+        conn, db._conn = db._conn, None
+        db._flush_timer.cancel()
+        await conn.close()
+
+    asyncio.run(run())
+    assert _count(db_path) == 0
+
+
+def test_engine_close_database_flushes_catalogue(tmp_path, engine_config, shutdown_engine):
+    """插件卸载时 close_database() 把引擎缓冲中的目录记录落盘"""
+    config = engine_config(db_flush_rows=1000, db_flush_interval_ms=3_600_000)
+
+    async def run():
+        eng = WorkflowEngine(config, plugin_dir=str(tmp_path))
+        for i in range(7):
+            eng._record_image_generation(f"out_{i}.png", "u1", file_path=f"/x/out_{i}.png", file_size=10)
+        assert eng.db.pending_count == 7
+        await shutdown_engine(eng)
+        return eng.db_path
+
+    db_path = asyncio.run(run())
+    assert _count(db_path) == 7
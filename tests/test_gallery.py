@@ -0,0 +1,18 @@
+"""画廊缩略图缓存的命名"""
+import os
+
+from gallery_server import GalleryServer
+
+
+def test_thumb_name_distinguishes_extensions_and_replaced_sources(tmp_path):
+    png, webp = tmp_path / "x.png", tmp_path / "x.webp"
+    png.write_bytes(b"a" * 10)
+    webp.write_bytes(b"a" * 10)
+    first = GalleryServer._thumb_name(str(png))
+    assert first != GalleryServer._thumb_name(str(webp))
+    assert first == GalleryServer._thumb_name(str(png))
+    # 替换源文件（同样的 mtime，不同大小）后缩略图重新生成
+    st = os.stat(png)
+    png.write_bytes(b"b" * 20)
+    os.utime(png, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert GalleryServer._thumb_name(str(png)) != first
@@ -0,0 +1,212 @@
+"""
+输入图片校验的模糊测试：截断、损坏、尾部附加数据
+
+_probe_image_header 只依赖两个尺寸上限属性，这里绕过 __init__ 构造引擎，
+避免启动后台任务和数据库。
+"""
+import io
+import random
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from workflow_engine import WorkflowEngine
+
+SEED = 20261019
+_rng = random.Random(SEED)
+
+
+@pytest.fixture(scope="module")
+def engine():
+    eng = WorkflowEngine.__new__(WorkflowEngine)
+    eng.max_input_image_side = 8192
+    eng.max_input_image_pixels = 8192 * 8192
+    return eng
+
+
+def _noise(size=(160, 120)) -> Image.Image:
+    rng = random.Random(SEED)
+    return Image.frombytes("RGB", size, bytes(rng.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+
+
+def _encode(fmt: str, **kw) -> bytes:
+    buf = io.BytesIO()
+    _noise().save(buf, format=fmt, **kw)
+    return buf.getvalue()
+
+
+def _with_exif_thumbnail() -> bytes:
+    """APP1 中嵌入一张自带 EOI 的 JPEG 缩略图"""
+    thumb = io.BytesIO()
+    _noise((32, 24)).save(thumb, format="JPEG")
+    exif = Image.Exif()
+    exif[0x010E] = "thumb"
+    payload = exif.tobytes() + thumb.getvalue()
+    buf = io.BytesIO()
+    _noise().save(buf, format="JPEG", exif=payload, quality=95)
+    return buf.getvalue()
+
+
+def _mpo() -> bytes:
+    """多图 JPEG（MPF）：主图之后附带一张较小的图像，Pillow 识别为 MPO 且 is_animated"""
+    buf = io.BytesIO()
+    _noise().save(buf, format="MPO", save_all=True, append_images=[_noise((80, 60))], quality=95)
+    return buf.getvalue()
+
+
+SAMPLES = {
+    "jpeg": _encode("JPEG", quality=95),
+    "jpeg_progressive": _encode("JPEG", quality=95, progressive=True),
+    "jpeg_exif_thumb": _with_exif_thumbnail(),
+    "mpo": _mpo(),
+    "png": _encode("PNG"),
+    "webp": _encode("WEBP", quality=95),
+    "bmp": _encode("BMP"),
+}
+
+
+def _png_small_idat() -> bytes:
+    """拆成多个 IDAT 块的 PNG，覆盖逐块跳转"""
+    raw = SAMPLES["png"]
+    pos, chunks = 8, []
+    while pos < len(raw):
+        length = struct.unpack(">I", raw[pos:pos + 4])[0]
+        chunks.append((raw[pos + 4:pos + 8], raw[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    idat = b"".join(d for t, d in chunks if t == b"IDAT")
+    out = [raw[:8]]
+    for ctype, data in chunks:
+        if ctype == b"IDAT":
+            if idat is None:
+                continue
+            pieces, idat = [idat[i:i + 4096] for i in range(0, len(idat), 4096)], None
+        else:
+            pieces = [data]
+        for piece in pieces:
+            out.append(struct.pack(">I", len(piece)) + ctype + piece
+                       + struct.pack(">I", zlib.crc32(ctype + piece) & 0xFFFFFFFF))
+    return b"".join(out)
+
+
+SAMPLES["png_small_idat"] = _png_small_idat()
+
+
+def _write(tmp_path, name: str, data: bytes) -> str:
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize("kind", sorted(SAMPLES))
+def test_valid_images_pass(engine, tmp_path, kind):
+    assert engine._probe_image_header(_write(tmp_path, kind, SAMPLES[kind])) is None
+
+
+@pytest.mark.parametrize("kind", ["jpeg", "jpeg_progressive", "jpeg_exif_thumb", "png", "png_small_idat"])
+def test_every_truncation_is_rejected(engine, tmp_path, kind):
+    data = SAMPLES[kind]
+    path = str(tmp_path / kind)
+    cuts = set(random.Random(SEED).sample(range(1, len(data)), 200)) | {len(data) - 1, len(data) - 2}
+    for cut in sorted(cuts):
+        with open(path, "wb") as f:
+            f.write(data[:cut])
+        assert engine._probe_image_header(path) is not None, f"截断到 {cut}/{len(data)} 字节未被发现"
+
+
+def test_mpo_is_accepted_as_jpeg(engine, tmp_path):
+    data = SAMPLES["mpo"]
+    assert Image.open(io.BytesIO(data)).format == "MPO"
+    assert engine._probe_image_header(_write(tmp_path, "mpo", data)) is None
+    # 主图内的截断仍能发现（附加图像属于尾部数据）
+    main_end = data.index(b"\xff\xd9", data.index(b"\xff\xda")) + 2
+    path = str(tmp_path / "mpo_cut")
+    for cut in random.Random(SEED).sample(range(1, main_end), 100):
+        with open(path, "wb") as f:
+            f.write(data[:cut])
+        assert engine._probe_image_header(path) is not None, f"截断到 {cut} 字节未被发现"
+
+
+def test_animated_gif_is_rejected(engine, tmp_path):
+    frames = [_noise((160, 120)), _noise((160, 120)).rotate(90, expand=False)]
+    buf = io.BytesIO()
+    frames[0].save(buf, format="GIF", save_all=True, append_images=frames[1:])
+    assert engine._probe_image_header(_write(tmp_path, "anim", buf.getvalue())) == "不支持动图，请发送静态图片"
+
+
+@pytest.mark.parametrize("kind", ["webp", "bmp"])
+def test_truncation_by_declared_length(engine, tmp_path, kind):
+    data = SAMPLES[kind]
+    path = _write(tmp_path, kind, data[:len(data) - 100])
+    assert engine._probe_image_header(path) is not None
+
+
+@pytest.mark.parametrize("kind", ["jpeg", "jpeg_progressive", "mpo", "jpeg_exif_thumb", "png", "png_small_idat"])
+@pytest.mark.parametrize("trailer", [
+    # 动态照片：主图之后附带 MP4
+    b"\x00\x00\x00\x18ftypmp42" + _rng.randbytes(4096),
+    # 三星 SEFT 尾部
+    b"SEFH" + _rng.randbytes(512) + b"SEFT",
+    # 尾部数据中包含其他格式的结束标记
+    _rng.randbytes(300) + b"\xff\xd9IEND" + _rng.randbytes(300),
+])
+def test_trailing_payload_is_accepted(engine, tmp_path, kind, trailer):
+    path = _write(tmp_path, kind, SAMPLES[kind] + trailer)
+    assert engine._probe_image_header(path) is None
+
+
+@pytest.mark.filterwarnings("ignore:Image appears to be a malformed MPO file")
+@pytest.mark.parametrize("kind", sorted(SAMPLES))
+def test_corrupted_bytes_never_raise(engine, tmp_path, kind):
+    """随机改写字节：校验可以通过或拒绝，但不能抛异常"""
+    data = SAMPLES[kind]
+    rng = random.Random(SEED)
+    path = str(tmp_path / kind)
+    for _ in range(150):
+        buf = bytearray(data)
+        for _ in range(rng.randint(1, 16)):
+            buf[rng.randrange(len(buf))] = rng.getrandbits(8)
+        with open(path, "wb") as f:
+            f.write(bytes(buf))
+        result = engine._probe_image_header(path)
+        assert result is None or isinstance(result, str)
+
+
+def test_garbage_and_tiny_files_are_rejected(engine, tmp_path):
+    rng = random.Random(SEED)
+    assert engine._probe_image_header(_write(tmp_path, "tiny", SAMPLES["png"][:100])) is not None
+    assert engine._probe_image_header(_write(tmp_path, "noise", bytes(rng.getrandbits(8) for _ in range(20000)))) is not None
+    assert engine._probe_image_header(str(tmp_path / "missing")) == "图片下载失败"
+
+
+def _jpeg_truncated(data: bytes) -> bool:
+    return WorkflowEngine._jpeg_truncated(io.BytesIO(data), len(data))
+
+
+def test_jpeg_without_sos_is_truncated():
+    soi_app0 = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    assert _jpeg_truncated(soi_app0)
+    assert _jpeg_truncated(soi_app0 + b"\xff\xdb\x00\x43" + b"\x00" * 10)
+    assert not _jpeg_truncated(soi_app0 + b"\xff\xd9")
+
+
+def test_long_trailer_is_scanned_in_chunks():
+    """EOI 距文件末尾较远时分块查找，包括 FF D9 跨越两个读取块的情况"""
+    chunk = WorkflowEngine.JPEG_SCAN_CHUNK
+    assert not _jpeg_truncated(SAMPLES["jpeg"] + bytes(3 * chunk))
+    head = b"\xff\xd8\xff\xda\x00\x02"
+    scan = bytes(chunk - len(head) - 1)
+    assert not _jpeg_truncated(head + scan + b"\xff\xd9" + bytes(chunk))
+    assert _jpeg_truncated(head + scan + b"\xff\x00" + bytes(chunk))
+
+
+def test_jpeg_is_reencoded_only_for_large_savings(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, "upload_jpeg_quality", 95, raising=False)
+    path = _write(tmp_path, "photo.jpg", SAMPLES["jpeg"])
+    data, name = engine._prepare_upload_image(path, (1, 1, 40, 30))
+    assert name == "photo.jpg" and len(data) < len(SAMPLES["jpeg"]) // 2
+    assert Image.open(io.BytesIO(data)).size == (40, 30)
+    # 轻微缩小节省不到一半体积时不值得再做一次有损压缩，按原图上传
+    data, _ = engine._prepare_upload_image(path, (1, 1, 150, 112))
+    assert data == SAMPLES["jpeg"]
@@ -0,0 +1,58 @@
+"""当日压缩包：发送快照不受后续导出影响，往日目录由定期清理删除"""
+import asyncio
+import os
+import time
+import zipfile
+
+from workflow_engine import WorkflowEngine
+
+
+def _names(path: str) -> set:
+    with zipfile.ZipFile(path) as zf:
+        return set(zf.namelist())
+
+
+def test_snapshot_is_unaffected_by_later_exports(tmp_path, engine_config, shutdown_engine):
+    files = []
+    for i in range(3):
+        p = tmp_path / f"img{i}.png"
+        p.write_bytes(os.urandom(1000))
+        files.append(str(p))
+
+    async def run():
+        eng = WorkflowEngine(engine_config(), plugin_dir=str(tmp_path))
+        first = await eng.create_zip(files[:2], "u")
+        appended = await eng.create_zip(files, "u")
+        rebuilt = await eng.create_zip(files[1:], "u")
+        pending = {a.args[0] for a in eng.delay_scheduler._heap if a.args}
+        await shutdown_engine(eng)
+        return first, appended, rebuilt, pending
+
+    first, appended, rebuilt, pending = asyncio.run(run())
+    assert len({first, appended, rebuilt}) == 3
+    assert len({os.path.basename(p) for p in (first, appended, rebuilt)}) == 1
+    assert _names(first) == {"img0.png", "img1.png"}
+    assert _names(appended) == {"img0.png", "img1.png", "img2.png"}
+    assert _names(rebuilt) == {"img1.png", "img2.png"}
+    # 快照到期删除，当日压缩包本身保留
+    assert pending == {first, appended, rebuilt}
+
+
+def test_old_archive_days_are_swept_by_maintenance(tmp_path, engine_config, shutdown_engine):
+    archives = tmp_path / "output" / "archives"
+    stale, recent = archives / "2000-01-01", archives / "2000-01-02"
+    for d in (stale, recent):
+        d.mkdir(parents=True)
+        (d / "old.zip").write_bytes(b"x")
+    old = time.time() - 2 * WorkflowEngine.ZIP_SNAPSHOT_TTL
+    os.utime(stale, (old, old))
+
+    async def run():
+        eng = WorkflowEngine(engine_config(), plugin_dir=str(tmp_path))
+        await eng.run_maintenance()
+        await shutdown_engine(eng)
+
+    asyncio.run(run())
+    assert not stale.exists()
+    # 快照可能仍在发送：最近有改动的往日目录保留到快照过期
+    assert recent.exists()
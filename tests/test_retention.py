@@ -0,0 +1,83 @@
+"""保留策略：按内容去重统计容量，清理已不存在的输入图片记录"""
+import asyncio
+import os
+
+import pytest
+
+from engine_db import CATEGORY_IMG2IMG_INPUTS, CATEGORY_OUTPUTS, EngineDatabase
+from workflow_engine import WorkflowEngine
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def retention_config(engine_config):
+    def make(**kw) -> dict:
+        return engine_config(enable_auto_save=True, enable_dedup_store=True, **kw)
+    return make
+
+
+def test_usage_counts_shared_content_once(tmp_path):
+    async def run():
+        db = EngineDatabase(str(tmp_path / "user.db"))
+        for i in range(3):
+            await db.record_image(f"a{i}.png", "u", file_size=100, content_hash="h1")
+        await db.record_image("b.png", "u", file_size=40, content_hash="h2")
+        await db.record_image("c.png", "u", file_size=7)
+        await db.record_image("d.png", "u", file_size=7)
+        await db.record_image("in.png", "u", file_size=100, content_hash="h1",
+                              category=CATEGORY_IMG2IMG_INPUTS)
+        usage = await db.get_category_usage()
+        total = await db.get_total_usage()
+        await db.close()
+        return usage, total
+
+    usage, total = asyncio.run(run())
+    assert usage[CATEGORY_OUTPUTS] == (6, 154)
+    assert usage[CATEGORY_IMG2IMG_INPUTS] == (1, 100)
+    assert total == 154
+
+
+def test_quota_eviction_with_deduplicated_inputs(tmp_path, retention_config, shutdown_engine):
+    """同一输入图片保存多次只占一份配额，不会因重复计数多删文件"""
+    src = tmp_path / "in.png"
+    src.write_bytes(os.urandom(MB // 2))
+    other = tmp_path / "other.png"
+    other.write_bytes(os.urandom(MB // 2))
+
+    async def run():
+        eng = WorkflowEngine(retention_config(retention_quota_img2img_inputs_mb=1),
+                             plugin_dir=str(tmp_path))
+        paths = [await eng.save_input_image_permanently(str(src), "img2img", "u") for _ in range(4)]
+        paths.append(await eng.save_input_image_permanently(str(other), "img2img", "u"))
+        # 不再为永久保存的输入安排临时清理
+        for p in paths:
+            eng._schedule_cleanup(p)
+        assert eng.delay_scheduler.pending_count == 0
+        removed, _ = await eng.run_retention()
+        usage = await eng.db.get_category_usage()
+        await shutdown_engine(eng)
+        return removed, usage
+
+    removed, usage = asyncio.run(run())
+    assert removed == 0
+    assert usage[CATEGORY_IMG2IMG_INPUTS] == (5, MB)
+
+
+def test_missing_inputs_are_pruned_and_blobs_released(tmp_path, retention_config, shutdown_engine):
+    src = tmp_path / "in.png"
+    src.write_bytes(os.urandom(20000))
+
+    async def run():
+        eng = WorkflowEngine(retention_config(retention_max_total_mb=100), plugin_dir=str(tmp_path))
+        saved = await eng.save_input_image_permanently(str(src), "img2img", "u")
+        os.remove(saved)  # 旧版在上传后删除了永久保存的输入
+        await eng.run_retention()
+        usage = await eng.db.get_category_usage()
+        await shutdown_engine(eng)
+        return usage
+
+    usage = asyncio.run(run())
+    assert CATEGORY_IMG2IMG_INPUTS not in usage
+    blobs = tmp_path / "output" / "blobs"
+    assert not blobs.exists() or not any(p.is_file() for p in blobs.rglob("*"))
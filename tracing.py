@@ -0,0 +1,122 @@
+"""
+任务追踪 — 每个任务一个 trace_id，记录各阶段的时间段，结束后写入 JSONL
+
+阶段：queue（入队→派发给 worker）→ upload → prompt（下发 prompt）→ execute
+（下发后→轮询到完成）→ download（自动保存，可有多段）→ send（适配层回调发送结果）。
+attrs.comfy_exec 是 ComfyUI 历史记录中的实际执行时长，execute 减去它即排队与轮询延迟。
+
+每行一个任务：
+    {"trace_id", "task_id", "user_id", "kind", "server", "status",
+     "ts"（入队时的 Unix 时间）, "total"（秒）,
+     "spans": [[阶段, 相对入队的开始秒数, 持续秒数], ...], "attrs": {...}}
+
+写入采用缓冲：攒够 FLUSH_LINES 行或 FLUSH_DELAY 秒后在线程池中一次追加；
+文件超过 max_bytes 时轮转为 .1 ~ .N。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("TaskTracer")
+
+
+class TaskTrace:
+    """单个任务的追踪记录（挂在 task_data["trace"] 上）"""
+
+    __slots__ = ("trace_id", "wall_start", "start", "spans", "attrs")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.spans: List[list] = []
+        self.attrs: Dict[str, Any] = {}
+
+    def add(self, name: str, start: float, end: Optional[float] = None):
+        """记录一段（start/end 为 time.monotonic()）"""
+        end = time.monotonic() if end is None else end
+        self.spans.append([name, round(start - self.start, 4), round(end - start, 4)])
+
+
+class TaskTracer:
+    """缓冲、轮转的 JSONL 追踪写入器"""
+
+    FLUSH_LINES = 64
+    FLUSH_DELAY = 5.0
+
+    def __init__(self, path: str, max_bytes: int = 20 * 1024 * 1024, backups: int = 3,
+                 scheduler=None):
+        """
+        Args:
+            path: JSONL 文件路径
+            max_bytes: 单个文件上限，超过后轮转
+            backups: 保留的轮转文件数
+            scheduler: DelayedScheduler，用于定时刷新缓冲
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.scheduler = scheduler
+        self._buffer: List[str] = []
+        self._flush_pending = False
+        self._flush_lock = asyncio.Lock()
+
+    @staticmethod
+    def start() -> TaskTrace:
+        return TaskTrace()
+
+    def finish(self, trace: TaskTrace, task_data: dict, status: str,
+               server: str = "", kind: str = ""):
+        """任务结束：生成一行记录放入缓冲"""
+        record = {
+            "trace_id": trace.trace_id,
+            "task_id": task_data.get("task_id"),
+            "user_id": task_data.get("user_id", ""),
+            "kind": kind,
+            "server": server,
+            "status": status,
+            "ts": round(trace.wall_start, 3),
+            "total": round(time.monotonic() - trace.start, 4),
+            "spans": trace.spans,
+        }
+        if trace.attrs:
+            record["attrs"] = trace.attrs
+        self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        if len(self._buffer) >= self.FLUSH_LINES:
+            asyncio.get_event_loop().create_task(self.flush())
+        elif not self._flush_pending and self.scheduler is not None:
+            self._flush_pending = True
+            self.scheduler.call_later(self.FLUSH_DELAY, self.flush)
+
+    async def flush(self):
+        self._flush_pending = False
+        if not self._buffer:
+            return
+        async with self._flush_lock:
+            lines, self._buffer = self._buffer, []
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self._write, lines)
+            except Exception as e:
+                logger.error(f"写入任务追踪失败: {e}")
+
+    def _write(self, lines: List[str]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _rotate(self):
+        for i in range(self.backups, 0, -1):
+            src = self.path if i == 1 else f"{self.path}.{i - 1}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i}")
+        if self.backups <= 0:
+            os.remove(self.path)
@@ -0,0 +1,70 @@
+"""
+输出图片转码 — 在独立进程中把归档的 PNG 重新编码为 WebP
+
+本模块只依赖 PIL，供 ProcessPoolExecutor 在子进程中调用（需可被 pickle 的模块级函数）。
+PNG 中的文本块（ComfyUI 写入的 prompt / workflow）按 ComfyUI 保存 WebP 的方式写入 EXIF：
+0x0110 存 "prompt:<json>"，其余键从 0x010F 起递减存 "<key>:<value>"，ComfyUI 可直接读回工作流。
+"""
+import os
+from typing import Optional
+
+from PIL import Image
+
+EXIF_PROMPT_TAG = 0x0110
+EXIF_FIRST_EXTRA_TAG = 0x010F
+
+
+def lower_priority():
+    """进程池初始化：降低转码进程的调度优先级，避免与实时任务争抢 CPU"""
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+
+
+def transcode_to_webp(src: str, dst: str, quality: int = 0) -> Optional[int]:
+    """
+    把 src 编码为 WebP 写入 dst
+
+    Args:
+        quality: 0 表示无损，1~100 为有损质量
+
+    Returns:
+        写入的字节数；动图、无法解码或结果不比原文件小时返回 None（不写 dst）
+    """
+    tmp = f"{dst}.tmp"
+    try:
+        with Image.open(src) as img:
+            if getattr(img, "n_frames", 1) > 1:
+                return None
+            img.load()
+            text = dict(getattr(img, "text", {}) or {})
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+
+            exif = Image.Exif()
+            tag = EXIF_FIRST_EXTRA_TAG
+            for key, value in text.items():
+                if key == "prompt":
+                    exif[EXIF_PROMPT_TAG] = f"prompt:{value}"
+                else:
+                    exif[tag] = f"{key}:{value}"
+                    tag -= 1
+
+            params = {"method": 4, "exif": exif.tobytes()}
+            if quality <= 0:
+                params.update(lossless=True, quality=80)
+            else:
+                params.update(quality=min(quality, 100))
+            img.save(tmp, format="WEBP", **params)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+    size = os.path.getsize(tmp)
+    if size >= os.path.getsize(src):
+        os.remove(tmp)
+        return None
+    os.replace(tmp, dst)
+    return size
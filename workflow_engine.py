@@ -17,8 +17,11 @@ ComfyUI 工作流处理引擎 — 与 AstrBot/QQ 平台解耦的纯业务逻辑
 import aiohttp
 import asyncio
 import copy
+import io
+import itertools
 import json
 import logging
+import mimetypes
 import os
 import random
 import re
@@ -28,14 +31,34 @@ import subprocess
 import threading
 import time
 import uuid
+import warnings
 import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from urllib.parse import quote
 
-import aiosqlite
+from PIL import Image, ImageOps
+
+from blob_store import BlobStore, sha256_bytes
+from engine_db import (
+    CATEGORY_IMG2IMG_INPUTS, CATEGORY_INPUTS, CATEGORY_OUTPUTS, CATEGORY_WORKFLOW_INPUTS,
+    EngineDatabase,
+)
+from eta_estimator import EtaEstimator, TaskShape
+from metrics import MetricsRegistry
+from name_index import NameIndex
+from tracing import TaskTracer
+from rate_limiter import RateLimiter
+from scheduler import DelayedScheduler
+from transcoder import lower_priority, transcode_to_webp
+
+# 部分平台的 mimetypes 表缺少 webp
+mimetypes.add_type("image/webp", ".webp")
 
 logger = logging.getLogger("WorkflowEngine")
 
@@ -55,6 +78,21 @@ class WorkflowResult:
     metadata: Dict[str, Any] = field(default_factory=dict)  # prompt, seed, batch_size, etc.
 
 
+class TaskCancelledError(Exception):
+    """任务被用户取消（不计入服务器失败，不再回调结果）"""
+
+
+@dataclass
+class TaskEvent:
+    """任务生命周期事件，通过 task_data["on_event"] 回调通知适配层"""
+    kind: str  # queued（排队位置变化）/ dispatched / progress / finished
+    position: int = 0  # queued：当前排队位置（从 1 开始）
+    eta: Optional[Tuple[float, float]] = None  # (距开始秒数, 距完成秒数)
+    server: str = ""
+    value: int = 0  # progress：当前步数 / 总步数
+    maximum: int = 0
+
+
 # ===== 引擎主类 =====
 
 class WorkflowEngine:
@@ -82,6 +120,10 @@ class WorkflowEngine:
         "beta", "normal", "linear_quadratic", "kl_optimal"
     ]
 
+    # ---- 图生图输入压缩（节点53 ImageCompressor）参数 ----
+    IMG2IMG_MIN_SIZE = 800
+    IMG2IMG_MAX_SIZE = 1600
+
     class ServerState:
         """ComfyUI 服务器状态"""
         def __init__(self, url: str, name: str, server_id: int):
@@ -94,6 +136,14 @@ class WorkflowEngine:
             self.failure_count = 0
             self.retry_after: Optional[datetime] = None
             self.worker: Optional[asyncio.Task] = None
+            # 健康检查时顺带保存的 /system_stats 快照（内存、显存、设备、PyTorch 版本）
+            self.system_stats: Optional[dict] = None
+            self.system_stats_at: Optional[datetime] = None
+            # 已上传的输入图片：内容哈希 -> 服务器上的文件名（LRU）
+            self.uploaded_images: "OrderedDict[str, str]" = OrderedDict()
+            # 正在执行的任务及其开始时间（time.monotonic），用于排队预估
+            self.current_task: Optional[dict] = None
+            self.current_started = 0.0
 
     # ==================== 初始化 & 单例 ====================
 
@@ -125,6 +175,15 @@ class WorkflowEngine:
             asyncio.create_task(self._init_database())
         except RuntimeError:
             pass
+        try:
+            self.retention_task = asyncio.create_task(self._start_retention_loop())
+        except RuntimeError:
+            pass
+        if self.enable_output_transcode:
+            try:
+                self.transcode_task = asyncio.create_task(self._start_transcode_loop())
+            except RuntimeError:
+                pass
 
     def _init_config(self, config: dict, plugin_dir: Optional[str] = None):
         """从配置字典初始化所有配置项"""
@@ -188,10 +247,12 @@ class WorkflowEngine:
         self.min_lora_strength = 0.0
         self.max_lora_strength = 2.0
         self.lora_name_map = self._parse_lora_config()
+        self.lora_index = NameIndex(self.lora_name_map)
         
         # ---- 模型 ----
         self.model_config = config.get("model_config", [])
         self.model_name_map = self._parse_model_config()
+        self.model_index = NameIndex(self.model_name_map)
         
         # ---- 时间 ----
         self.parsed_time_ranges = self._parse_time_ranges()
@@ -209,19 +270,84 @@ class WorkflowEngine:
         self.user_workflow_dir = Path(self.auto_save_dir) / "workflows"
         self.user_workflow_dir.mkdir(parents=True, exist_ok=True)
         
+        # 内容寻址存储：相同内容只保存一次，日期目录中为硬链接
+        self.enable_dedup_store = config.get("enable_dedup_store", True)
+        self.blobs = BlobStore(os.path.join(self.auto_save_dir, "blobs"))
+        
         # ---- 下载/输出 ----
         self.enable_output_zip = config.get("enable_output_zip", True)
         self.daily_download_limit = config.get("daily_download_limit", 1)
         self.only_own_images = config.get("only_own_images", False)
+        self._zip_locks: Dict[str, asyncio.Lock] = {}
+        # 随保留策略循环定期执行的同步清理函数（线程池中运行），画廊等组件可追加
+        self.maintenance_callbacks: List[Callable[[], None]] = [self._sweep_archives]
         self.max_concurrent_tasks_per_user = config.get("max_concurrent_tasks_per_user", 3)
         
         # ---- 数据库 ----
         self.db_dir = self.auto_save_dir
         self.db_path = os.path.join(self.db_dir, "user.db")
+        self.db = EngineDatabase(
+            self.db_path,
+            flush_rows=config.get("db_flush_rows", 50),
+            flush_interval=config.get("db_flush_interval_ms", 500) / 1000,
+        )
+        
+        # ---- 保存目录保留策略（0 表示不限制）----
+        self.retention_max_age_days = config.get("retention_max_age_days", 0)
+        self.retention_max_total_mb = config.get("retention_max_total_mb", 0)
+        self.retention_quotas_mb = {
+            CATEGORY_OUTPUTS: config.get("retention_quota_outputs_mb", 0),
+            CATEGORY_IMG2IMG_INPUTS: config.get("retention_quota_img2img_inputs_mb", 0),
+            CATEGORY_WORKFLOW_INPUTS: config.get("retention_quota_workflow_inputs_mb", 0),
+        }
+        self.retention_interval = config.get("retention_interval_minutes", 60) * 60
+        self._retention_pruned = False
+        
+        # ---- 归档输出转码（PNG -> WebP）----
+        self.enable_output_transcode = config.get("enable_output_transcode", False)
+        self.transcode_quality = config.get("transcode_quality", 0)
+        self.transcode_after_days = config.get("transcode_after_days", 1)
+        self.transcode_interval = config.get("transcode_interval_minutes", 30) * 60
+        self.transcode_workers = max(1, config.get("transcode_workers", 1))
+        
+        # ---- 延迟动作（临时文件清理、消息撤回）----
+        self.delay_scheduler = DelayedScheduler(self.db)
+        self.temp_file_max_age = config.get("temp_file_max_age_minutes", 60) * 60
+        # 启动时清理的临时目录（适配层可追加自己的目录）
+        self.temp_dirs: List[str] = [str(self.data_dir / "temp"), str(Path(self.plugin_dir) / "temp")]
+        
+        # ---- 提交限流（令牌桶："次数/分钟"，为空不限流）----
+        self.rate_limiter = RateLimiter(
+            user_rule=config.get("rate_limit_user", ""),
+            group_rule=config.get("rate_limit_group", ""),
+            global_rule=config.get("rate_limit_global", ""),
+            store=self.db, scheduler=self.delay_scheduler,
+        )
+        
+        # ---- 排队预估（按历史耗时）----
+        self.eta_estimator = EtaEstimator(store=self.db, scheduler=self.delay_scheduler)
+        
+        # ---- 任务追踪（JSONL）----
+        self.tracer: Optional[TaskTracer] = None
+        if config.get("enable_task_trace", False):
+            self.tracer = TaskTracer(
+                os.path.join(self.db_dir, "traces", "task_traces.jsonl"),
+                max_bytes=config.get("task_trace_max_mb", 20) * 1024 * 1024,
+                backups=config.get("task_trace_backups", 3),
+                scheduler=self.delay_scheduler,
+            )
         
         # ---- 视频发送 ----
         self.max_upload_size = config.get("max_upload_size", 100)
         
+        # ---- 输入图片上传前预处理 ----
+        self.enable_input_preprocess = config.get("enable_input_preprocess", True)
+        self.upload_jpeg_quality = config.get("upload_jpeg_quality", 95)
+        
+        # ---- 输入图片校验 ----
+        self.max_input_image_side = config.get("max_input_image_side", 8192)
+        self.max_input_image_pixels = config.get("max_input_image_pixels", 40_000_000)
+        
         # ---- Workflow ----
         self.workflows: Dict[str, Dict[str, Any]] = {}
         self.workflow_prefixes: Dict[str, str] = {}
@@ -231,11 +357,61 @@ class WorkflowEngine:
 
     def _init_state(self):
         """初始化运行时状态"""
-        self.task_queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_task_queue)
+        # 容量由 queue_full() 按未取消的排队任务数控制：取消的任务留在队列中直到被 worker 丢弃
+        self.task_queue: asyncio.Queue = asyncio.Queue()
         self.server_monitor_task: Optional[asyncio.Task] = None
+        self.retention_task: Optional[asyncio.Task] = None
+        self.transcode_task: Optional[asyncio.Task] = None
+        self._transcode_pool: Optional[ProcessPoolExecutor] = None
+        self._transcode_cursor = 0
+        self.transcode_bytes_saved = 0
         self.server_monitor_running: bool = False
         self.user_task_counts: Dict[str, int] = {}
         self.user_task_lock = asyncio.Lock()
+        # 已请求取消、尚在 poll_task_status 中等待的 prompt_id
+        self._cancelled_prompts: set = set()
+        # 排队中的任务（task_id -> task_data，按入队顺序），用于列出/取消排队任务
+        self._queued_tasks: Dict[int, dict] = {}
+        # 排队中被取消的 task_id：任务仍留在 task_queue 中，worker 取出时直接丢弃并释放队列位置
+        self._cancelled_task_ids: set = set()
+        self._task_seq = itertools.count(1)
+        self._init_metrics()
+
+    def _init_metrics(self):
+        """指标定义；热路径上只做 labels() 查找和一次 inc/observe"""
+        m = self.metrics = MetricsRegistry(prefix="comfyui_")
+        self.m_tasks_submitted = m.counter(
+            "tasks_submitted_total", "提交到引擎队列的任务数", ("kind",))
+        self.m_tasks_finished = m.counter(
+            "tasks_finished_total", "结束的任务数（status: success/failed/cancelled）", ("server", "status"))
+        self.m_rate_limited = m.counter("rate_limited_total", "被限流拒绝的提交数")
+        self.m_queue_wait = m.histogram(
+            "queue_wait_seconds", "任务从入队到被 worker 取出的等待时间")
+        self.m_task_seconds = m.histogram(
+            "task_seconds", "任务在服务器上的总耗时（上传到保存完成）", ("server", "kind"))
+        self.m_stage_seconds = m.histogram(
+            "stage_seconds", "任务各阶段耗时（upload/submit/execute/download）", ("server", "stage"))
+        self.m_server_failures = m.counter(
+            "server_failures_total", "服务器请求失败次数", ("server",))
+        self.m_upload_cache = m.counter(
+            "upload_cache_total", "输入图片上传缓存（result: hit/miss）", ("result",))
+        self.m_downloaded_bytes = m.counter(
+            "downloaded_bytes_total", "自动保存下载的输出字节数", ("server",))
+        m.gauge("queue_depth", "排队中的任务数", callback=self.queued_count)
+        m.gauge("queue_capacity", "任务队列容量", callback=lambda: self.max_task_queue)
+        m.gauge("user_tasks_inflight", "排队和执行中的用户任务数",
+                callback=lambda: sum(self.user_task_counts.values()))
+        m.gauge("server_healthy", "服务器是否健康", ("server",),
+                callback=lambda: {(s.name,): int(s.healthy) for s in self.comfyui_servers})
+        m.gauge("server_busy", "服务器是否正在执行任务", ("server",),
+                callback=lambda: {(s.name,): int(s.busy) for s in self.comfyui_servers})
+        m.gauge("upload_cache_entries", "各服务器记住的已上传输入图片数", ("server",),
+                callback=lambda: {(s.name,): len(s.uploaded_images) for s in self.comfyui_servers})
+        m.gauge("db_pending_records", "等待批量写入的图片记录数", callback=lambda: self.db.pending_count)
+        m.gauge("scheduled_actions", "延迟调度器中待执行的动作数",
+                callback=lambda: self.delay_scheduler.pending_count)
+        m.gauge("transcode_bytes_saved", "本次运行中转码节省的字节数",
+                callback=lambda: self.transcode_bytes_saved)
         self.server_poll_lock = asyncio.Lock()
         self.server_state_lock = asyncio.Lock()
 
@@ -563,9 +739,35 @@ class WorkflowEngine:
         Returns:
             是否成功入队
         """
-        if self.task_queue.full():
+        if self.queue_full():
             return False
+        task_data.setdefault("task_id", next(self._task_seq))
+        if self.tracer is not None:
+            task_data["trace"] = self.tracer.start()
+        task_data["enqueued_at"] = time.monotonic()
+        await self._enqueue(task_data)
+        self.m_tasks_submitted.labels(self._task_kind(task_data)).inc()
+        return True
+
+    def queued_count(self) -> int:
+        """排队中（未取消）的任务数"""
+        return len(self._queued_tasks)
+
+    def queue_full(self) -> bool:
+        return len(self._queued_tasks) >= self.max_task_queue
+
+    async def _enqueue(self, task_data: dict):
+        task_data.pop("executed", None)
+        self._queued_tasks[task_data["task_id"]] = task_data
         await self.task_queue.put(task_data)
+
+    def _take_dequeued(self, task_data: dict) -> bool:
+        """从 task_queue 取出任务后调用：返回 False 表示该任务排队时已取消，应直接丢弃"""
+        task_id = task_data.get("task_id")
+        if task_id in self._cancelled_task_ids:
+            self._cancelled_task_ids.discard(task_id)
+            return False
+        self._queued_tasks.pop(task_id, None)
         return True
 
     async def _increment_user_task_count(self, user_id: str) -> bool:
@@ -584,6 +786,271 @@ class WorkflowEngine:
                 if self.user_task_counts[user_id] == 0:
                     del self.user_task_counts[user_id]
 
+    def check_rate_limit(self, user_id: str, group_id: Optional[str] = None) -> float:
+        """令牌桶限流检查（O(1)）：放行返回 0 并扣除令牌，否则返回需等待的秒数"""
+        wait = self.rate_limiter.check(user_id, group_id)
+        if wait:
+            self.m_rate_limited.inc()
+        return wait
+
+    def refund_rate_limit(self, user_id: str, group_id: Optional[str] = None):
+        """限流放行后提交仍被拒绝时退回令牌"""
+        self.rate_limiter.refund(user_id, group_id)
+
+    @staticmethod
+    def rate_limit_message(wait: float) -> str:
+        return f"提交过于频繁，请{RateLimiter.format_wait(wait)}后再试"
+
+    # ==================== 排队预估 ====================
+
+    @staticmethod
+    def _task_kind(task_data: dict) -> str:
+        if task_data.get("is_workflow"):
+            return f"wf:{task_data.get('workflow_name', '')}"
+        return "img2img" if task_data.get("img_path") else "txt2img"
+
+    @staticmethod
+    def _task_shape(task_data: dict) -> TaskShape:
+        """任务的耗时统计维度：(类型或工作流名, 宽, 高, 批量)"""
+        if task_data.get("is_workflow"):
+            width = height = 0
+            batch = 1
+            # 自定义工作流从图中第一个带尺寸的节点取分辨率和批量
+            for node in (task_data.get("prompt") or {}).values():
+                inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+                if isinstance(inputs.get("width"), int) and isinstance(inputs.get("height"), int):
+                    width, height = inputs["width"], inputs["height"]
+                    if isinstance(inputs.get("batch_size"), int):
+                        batch = inputs["batch_size"]
+                    break
+            return WorkflowEngine._task_kind(task_data), width, height, batch
+        return (WorkflowEngine._task_kind(task_data), task_data.get("current_width") or 0, task_data.get("current_height") or 0,
+                task_data.get("current_batch_size") or 1)
+
+    def estimate_task_eta(self, task_data: dict) -> Optional[Tuple[float, float]]:
+        """
+        估算任务距开始和距完成的秒数
+        
+        task_data 已入队时按其在队列中的位置估算，未入队时按排在队尾估算；
+        可供准入策略在提交前调用。没有可用服务器时返回 None。
+        """
+        now = time.monotonic()
+        servers = []
+        for srv in self.comfyui_servers:
+            if not srv.healthy:
+                continue
+            if srv.current_task is None:
+                servers.append((srv.name, 0.0))
+                continue
+            elapsed = now - srv.current_started
+            total = self.eta_estimator.estimate(self._task_shape(srv.current_task), srv.name)
+            if srv.current_task is task_data:
+                return 0.0, max(total - elapsed, 0.0)
+            servers.append((srv.name, max(total - elapsed, 0.0)))
+        queued = list(self._queued_tasks.values())
+        position = next((i for i, td in enumerate(queued) if td is task_data), None)
+        if position is None:
+            queued.append(task_data)
+            position = len(queued) - 1
+        return self.eta_estimator.simulate(
+            servers, (self._task_shape(td) for td in queued), position)
+
+    def format_task_eta(self, task_data: dict) -> str:
+        """确认消息中的预估文本，无法估算时为空"""
+        eta = self.estimate_task_eta(task_data)
+        if eta is None:
+            return ""
+        start, finish = eta
+        fmt = EtaEstimator.format_duration
+        if start < 1:
+            return f"预计{fmt(finish)}后完成"
+        return f"预计{fmt(start)}后开始，约{fmt(finish)}后完成"
+
+    # ==================== 任务取消 ====================
+
+    def get_user_tasks(self, user_id: str) -> List[Tuple[dict, Optional[ServerState]]]:
+        """用户尚未结束的任务（排队中的 server 为 None），按提交顺序排列"""
+        tasks = [(td, None) for td in self._queued_tasks.values() if td.get("user_id") == user_id]
+        tasks += [(srv.current_task, srv) for srv in self.comfyui_servers
+                  if srv.current_task is not None and srv.current_task.get("user_id") == user_id]
+        return sorted(tasks, key=lambda t: t[0].get("task_id", 0))
+
+    async def cancel_task(self, task_data: dict) -> str:
+        """
+        取消任务
+        
+        Returns:
+            "queued"：已标记为取消并释放用户任务数，worker 取出时直接丢弃；
+            "running"：已请求 ComfyUI 中断/删除该 prompt，worker 随后结束该任务；
+            "finished"：ComfyUI 已执行完毕，正在下载/发送结果，无法取消；
+            ""：任务已结束或已取消
+        """
+        if task_data.get("cancelled"):
+            return ""
+        task_id = task_data.get("task_id")
+        if self._queued_tasks.get(task_id) is task_data:
+            del self._queued_tasks[task_id]
+            self._cancelled_task_ids.add(task_id)
+            task_data["cancelled"] = True
+            if uid := task_data.get("user_id"):
+                await self._decrement_user_task_count(uid)
+            self.m_tasks_finished.labels("", "cancelled").inc()
+            self._finish_trace(task_data, "cancelled")
+            self._emit_task_event(task_data, "finished")
+            self._notify_queue_positions()
+            return "queued"
+        server = next((s for s in self.comfyui_servers if s.current_task is task_data), None)
+        if server is None:
+            return ""
+        if task_data.get("executed"):
+            return "finished"
+        prompt_id = task_data.get("prompt_id")
+        # ComfyUI 已执行完、轮询尚未发现时不中断，结果照常发送
+        if prompt_id and await self._prompt_completed(server, prompt_id):
+            return "finished"
+        task_data["cancelled"] = True
+        if prompt_id:
+            self._cancelled_prompts.add(prompt_id)
+            await self.interrupt_comfyui_prompt(server, prompt_id)
+        # 尚未下发 prompt（上传输入图片中）时，由 _check_cancelled 在下发后立即中断
+        return "running"
+
+    async def cancel_user_tasks(self, user_id: str, all_tasks: bool = False) -> Dict[str, int]:
+        """取消用户最近提交的一个（或全部）任务，返回 {"queued": n, "running": m, "finished": k}"""
+        tasks = self.get_user_tasks(user_id)
+        if not all_tasks:
+            tasks = tasks[-1:]
+        counts = {"queued": 0, "running": 0, "finished": 0}
+        for td, _ in reversed(tasks):
+            state = await self.cancel_task(td)
+            if state:
+                counts[state] += 1
+        return counts
+
+    async def _check_cancelled(self, server: ServerState, task_data: dict, prompt_id: str):
+        """prompt 下发后调用：记录 prompt_id，下发前已被取消时立即中断"""
+        task_data["prompt_id"] = prompt_id
+        if task_data.get("cancelled"):
+            await self.interrupt_comfyui_prompt(server, prompt_id)
+            raise TaskCancelledError(prompt_id)
+
+    # ==================== 任务追踪 ====================
+
+    @staticmethod
+    def _trace_span(task_data: dict, name: str, start: float, end: Optional[float] = None):
+        """记录任务的一个阶段（未开启追踪时为空操作）"""
+        trace = task_data.get("trace")
+        if trace is not None:
+            trace.add(name, start, end)
+
+    def _finish_trace(self, task_data: dict, status: str, server: str = ""):
+        trace = task_data.pop("trace", None)
+        if trace is not None and self.tracer is not None:
+            self.tracer.finish(trace, task_data, status, server, self._task_kind(task_data))
+
+    @staticmethod
+    def _comfy_exec_seconds(history_data: dict) -> Optional[float]:
+        """ComfyUI 历史记录中 execution_start 到 execution_success 的时长（服务器时钟）"""
+        stamps = {}
+        for msg in history_data.get("status", {}).get("messages") or []:
+            if isinstance(msg, list) and len(msg) == 2 and isinstance(msg[1], dict):
+                stamps[msg[0]] = msg[1].get("timestamp")
+        start, end = stamps.get("execution_start"), stamps.get("execution_success")
+        if isinstance(start, (int, float)) and isinstance(end, (int, float)):
+            return round((end - start) / 1000, 4)
+        return None
+
+    async def _deliver_result(self, task_data: dict, result: WorkflowResult, server: ServerState):
+        """调用结果回调（适配层发送消息），记录 send 阶段并结束追踪"""
+        start = time.monotonic()
+        try:
+            if cb := task_data.get("callback"):
+                if asyncio.iscoroutinefunction(cb):
+                    await cb(result)
+                else:
+                    # 同步回调直接调用
+                    cb(result)
+        except Exception as e:
+            logger.error(f"结果回调失败：{e}")
+        finally:
+            self._trace_span(task_data, "send", start)
+            self._finish_trace(task_data, "success" if result.success else "failed", server.name)
+
+    # ==================== 任务事件 ====================
+
+    def _emit_task_event(self, task_data: dict, kind: str, **fields):
+        """调用任务的 on_event 回调（协程回调在新任务中执行，不阻塞 worker）"""
+        cb = task_data.get("on_event")
+        if not cb:
+            return
+        try:
+            res = cb(TaskEvent(kind=kind, **fields))
+            if asyncio.iscoroutine(res):
+                asyncio.create_task(res)
+        except Exception as e:
+            logger.debug(f"任务事件回调失败: {e}")
+
+    def _notify_queue_positions(self):
+        """队列前端的任务被取走后，通知其余排队任务新的位置"""
+        for pos, td in enumerate(list(self._queued_tasks.values()), 1):
+            if td.get("on_event"):
+                self._emit_task_event(td, "queued", position=pos, eta=self.estimate_task_eta(td))
+
+    @staticmethod
+    def _ws_url(server: ServerState, client_id: str) -> str:
+        return f"ws{server.url[4:]}/ws?clientId={client_id}"
+
+    @asynccontextmanager
+    async def _progress_listener(self, server: ServerState, task_data: dict):
+        """
+        任务执行期间订阅 ComfyUI websocket 推送的采样进度，产出提交 prompt 用的 client_id
+        
+        ComfyUI 只把 progress 消息发给提交 prompt 的 client_id，因此每个任务用独立的
+        client_id 建一条连接，无需按 prompt_id 过滤，也不产生额外的轮询请求。
+        任务未注册 on_event 或连接失败时不订阅，不影响任务执行。
+        """
+        client_id = str(uuid.uuid4())
+        if not task_data.get("on_event"):
+            yield client_id
+            return
+        session = aiohttp.ClientSession()
+        reader: Optional[asyncio.Task] = None
+        try:
+            try:
+                ws = await session.ws_connect(self._ws_url(server, client_id),
+                                              timeout=10, heartbeat=30)
+                reader = asyncio.create_task(self._read_progress(ws, server, task_data))
+            except Exception as e:
+                logger.debug(f"服务器{server.name}进度订阅失败，仅在完成时通知: {e}")
+            yield client_id
+        finally:
+            if reader:
+                reader.cancel()
+                try:
+                    await reader
+                except (asyncio.CancelledError, Exception):
+                    pass
+            await session.close()
+
+    async def _read_progress(self, ws: aiohttp.ClientWebSocketResponse,
+                             server: ServerState, task_data: dict):
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    # 预览图等二进制帧
+                    continue
+                try:
+                    data = json.loads(msg.data)
+                except ValueError:
+                    continue
+                if data.get("type") == "progress":
+                    body = data.get("data") or {}
+                    self._emit_task_event(task_data, "progress", server=server.name,
+                                          value=int(body.get("value") or 0),
+                                          maximum=int(body.get("max") or 0))
+        finally:
+            await ws.close()
+
     async def _check_user_task_limit(self, user_id: str) -> bool:
         async with self.user_task_lock:
             return self.user_task_counts.get(user_id, 0) < self.max_concurrent_tasks_per_user
@@ -612,6 +1079,8 @@ class WorkflowEngine:
                 async with self.server_state_lock:
                     if is_healthy != srv.healthy:
                         srv.healthy = is_healthy
+                        # 服务器可能重启过，已上传文件不再可信
+                        srv.uploaded_images.clear()
                         status = "恢复正常" if is_healthy else "异常"
                         logger.info(f"服务器{srv.name}状态变化：{status}")
                         await self._manage_worker_for_server(srv)
@@ -641,13 +1110,17 @@ class WorkflowEngine:
     async def _check_and_clear_queue_if_no_healthy_servers(self):
         has_healthy = any(s.healthy for s in self.comfyui_servers)
         if not has_healthy and self.task_queue.qsize() > 0:
-            logger.warning(f"所有服务器均不健康，清空任务队列（{self.task_queue.qsize()}个任务）")
+            logger.warning(f"所有服务器均不健康，清空任务队列（{self.queued_count()}个任务）")
             while not self.task_queue.empty():
                 try:
                     td = await asyncio.wait_for(self.task_queue.get(), timeout=1.0)
+                    if not self._take_dequeued(td):
+                        self.task_queue.task_done()
+                        continue
                     uid = td.get("user_id")
                     if uid:
                         await self._decrement_user_task_count(uid)
+                    self._finish_trace(td, "dropped")
                     self.task_queue.task_done()
                 except asyncio.TimeoutError:
                     break
@@ -655,23 +1128,27 @@ class WorkflowEngine:
                     logger.error(f"清空任务队列时出错：{e}")
 
     async def _check_server_health(self, server: ServerState) -> bool:
+        """请求 /system_stats 判断健康状态，并把返回内容保存为服务器的系统信息快照"""
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(f"{server.url}/system_stats", timeout=10) as resp:
-                    return resp.status == 200
+                    if resp.status != 200:
+                        return False
+                    try:
+                        stats = await resp.json(content_type=None)
+                    except (ValueError, aiohttp.ContentTypeError):
+                        stats = None
+                    if isinstance(stats, dict):
+                        server.system_stats = stats
+                        server.system_stats_at = datetime.now()
+                    return True
         except Exception as e:
             logger.warning(f"服务器{server.name}健康检查失败：{str(e)}")
             return False
 
-    async def _get_server_system_info(self, server: ServerState) -> Optional[dict]:
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{server.url}/system_stats", timeout=10) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-        except Exception:
-            pass
-        return None
+    def _get_server_system_info(self, server: ServerState) -> Optional[dict]:
+        """返回健康监控最近一次获取的 /system_stats 快照（不发起网络请求）"""
+        return server.system_stats
 
     async def _get_next_available_server(self) -> Optional[ServerState]:
         if not self.comfyui_servers:
@@ -691,6 +1168,7 @@ class WorkflowEngine:
             server.busy = busy
 
     async def _handle_server_failure(self, server: ServerState):
+        self.m_server_failures.labels(server.name).inc()
         async with self.server_state_lock:
             server.failure_count += 1
             if server.failure_count >= self.max_failure_count:
@@ -721,17 +1199,23 @@ class WorkflowEngine:
                     if not server.healthy:
                         return
                     continue
+                if not self._take_dequeued(task_data):
+                    self.task_queue.task_done()
+                    continue
+                if enqueued_at := task_data.get("enqueued_at"):
+                    picked = time.monotonic()
+                    self.m_queue_wait.observe(picked - enqueued_at)
+                    self._trace_span(task_data, "queue", enqueued_at, picked)
+                self._notify_queue_positions()
                 try:
                     if not server.healthy:
-                        await self.task_queue.put(task_data)
+                        await self._enqueue(task_data)
                         return
                     result = await self._process_task_on_server(server, task_data)
-                    if cb := task_data.get("callback"):
-                        if asyncio.iscoroutinefunction(cb):
-                            asyncio.create_task(cb(result))
-                        else:
-                            # 同步回调直接调用
-                            cb(result)
+                    asyncio.create_task(self._deliver_result(task_data, result, server))
+                except TaskCancelledError:
+                    logger.info(f"{worker_name}上的任务{task_data.get('task_id')}已取消")
+                    self._finish_trace(task_data, "cancelled", server.name)
                 except Exception as e:
                     uid = task_data.get("user_id")
                     if uid:
@@ -739,16 +1223,12 @@ class WorkflowEngine:
                     if not server.healthy:
                         logger.info(f"{worker_name}检测到服务器{server.name}故障，将任务放回队列")
                         task_data.pop("callback", None)
-                        await self.task_queue.put(task_data)
+                        await self._enqueue(task_data)
                         return
                     logger.error(f"{worker_name}处理任务失败：{str(e)[:500]}")
                     # 通过回调通知用户错误
                     err_result = WorkflowResult(success=False, error=str(e)[:1000])
-                    if cb := task_data.get("callback"):
-                        if asyncio.iscoroutinefunction(cb):
-                            asyncio.create_task(cb(err_result))
-                        else:
-                            cb(err_result)
+                    asyncio.create_task(self._deliver_result(task_data, err_result, server))
                 finally:
                     self.task_queue.task_done()
         except asyncio.CancelledError:
@@ -767,6 +1247,11 @@ class WorkflowEngine:
         """
         is_workflow = task_data.get("is_workflow", False)
         user_id = task_data.get("user_id")
+        server.current_task = task_data
+        server.current_started = time.monotonic()
+        self._emit_task_event(task_data, "dispatched", server=server.name,
+                              eta=self.estimate_task_eta(task_data))
+        status = "failed"
         
         try:
             if is_workflow:
@@ -774,42 +1259,212 @@ class WorkflowEngine:
             else:
                 result = await self._process_comfyui_task(server, task_data)
             await self._reset_server_failure(server)
+            if result.success:
+                status = "success"
+                self.eta_estimator.record(self._task_shape(task_data), server.name,
+                                          time.monotonic() - server.current_started)
             return result
+        except TaskCancelledError:
+            status = "cancelled"
+            raise
         except Exception as e:
             await self._handle_server_failure(server)
             raise
         finally:
+            self.m_tasks_finished.labels(server.name, status).inc()
+            self.m_task_seconds.labels(server.name, self._task_kind(task_data)).observe(
+                time.monotonic() - server.current_started)
+            server.current_task = None
+            self._cancelled_prompts.discard(task_data.get("prompt_id"))
+            self._emit_task_event(task_data, "finished", server=server.name)
             if user_id:
                 await self._decrement_user_task_count(user_id)
             await self._mark_server_busy(server, False)
 
     # ==================== ComfyUI API ====================
 
-    async def upload_image_to_comfyui(self, server: ServerState, img_path: str) -> str:
-        """上传图片到 ComfyUI 服务器，返回上传后的文件名"""
+    # 每个服务器记住的已上传输入图片数
+    UPLOAD_CACHE_SIZE = 512
+
+    async def upload_image_to_comfyui(self, server: ServerState, img_path: str,
+                                      size_limits: Optional[Tuple[int, int, int, int]] = None) -> str:
+        """
+        上传图片到 ComfyUI 服务器，返回上传后的文件名
+        
+        Args:
+            size_limits: 图中对该输入的尺寸约束 (min_w, min_h, max_w, max_h)，
+                         提供时先在线程池中按约束预缩放并重新编码，再上传
+        """
         if not os.path.exists(img_path):
             raise Exception(f"PERMANENT_ERROR:图片文件不存在：{img_path}")
         
         loop = asyncio.get_event_loop()
-        img_data = await loop.run_in_executor(None, lambda: open(img_path, "rb").read())
+        if size_limits and self.enable_input_preprocess:
+            img_data, upload_name = await loop.run_in_executor(
+                None, self._prepare_upload_image, img_path, size_limits)
+        else:
+            img_data = await loop.run_in_executor(None, lambda: open(img_path, "rb").read())
+            upload_name = os.path.basename(img_path)
+        
+        # 以内容哈希命名上传文件：同一服务器上相同内容只上传一次
+        digest = await loop.run_in_executor(None, sha256_bytes, img_data)
+        cached = server.uploaded_images.get(digest)
+        if cached:
+            server.uploaded_images.move_to_end(digest)
+            self.m_upload_cache.labels("hit").inc()
+            logger.debug(f"输入图片已在服务器{server.name}上，跳过上传: {cached}")
+            return cached
+        self.m_upload_cache.labels("miss").inc()
+        upload_name = f"{digest[:32]}{os.path.splitext(upload_name)[1].lower()}"
+        t0 = time.perf_counter()
         
         form = aiohttp.FormData()
-        form.add_field("image", img_data, filename=os.path.basename(img_path), content_type="image/*")
+        form.add_field("image", img_data, filename=upload_name, content_type="image/*")
+        form.add_field("overwrite", "true")
         async with aiohttp.ClientSession() as session:
             async with session.post(f"{server.url}/upload/image", data=form) as resp:
                 if resp.status != 200:
                     text = await resp.text()
                     raise Exception(f"图片上传失败（HTTP {resp.status}）：{self._filter_server_urls(text[:50])}")
                 data = await resp.json()
-                return data.get("name", "")
+        self.m_stage_seconds.labels(server.name, "upload").observe(time.perf_counter() - t0)
+        name = data.get("name", "")
+        if name:
+            server.uploaded_images[digest] = name
+            while len(server.uploaded_images) > self.UPLOAD_CACHE_SIZE:
+                server.uploaded_images.popitem(last=False)
+        return name
 
-    async def send_comfyui_prompt(self, server: ServerState, prompt: dict) -> str:
-        """发送 prompt 到 ComfyUI，返回 prompt_id"""
+    @staticmethod
+    def _compressor_target_size(width: int, height: int,
+                                limits: Tuple[int, int, int, int]) -> Tuple[int, int]:
+        """与 ImageCompressor 节点一致的目标尺寸计算（先放大到最小值，再缩小到最大值以内）"""
+        min_w, min_h, max_w, max_h = limits
+        if width < min_w or height < min_h:
+            scale = max(min_w / width if width else 1.0, min_h / height if height else 1.0)
+            width, height = max(int(width * scale), min_w), max(int(height * scale), min_h)
+        if width > max_w or height > max_h:
+            scale = min(max_w / width, max_h / height)
+            width, height = max(int(width * scale), min_w), max(int(height * scale), min_h)
+        return width, height
+
+    # JPEG 原图重新编码后体积至少降到原文件的这个比例才值得多一次有损压缩
+    UPLOAD_JPEG_REENCODE_RATIO = 0.5
+
+    def _prepare_upload_image(self, img_path: str,
+                              limits: Tuple[int, int, int, int]) -> Tuple[bytes, str]:
+        """
+        按服务器端的尺寸约束预缩放并重新编码输入图片（在线程池中执行）
+        
+        只缩小到「等比且宽高均不小于服务器最终目标尺寸」的大小，服务器端的缩放
+        仍从不低于目标分辨率的图像开始。无需缩放时原样返回文件内容。
+        非 JPEG 原图一律保存为无损 PNG，比原文件小时才采用。
+        JPEG 原图缩放后需要重新编码，会带来一次额外的有损压缩，因此只在体积
+        不超过原文件的 UPLOAD_JPEG_REENCODE_RATIO 时采用，否则按原图上传。
+        """
+        with open(img_path, "rb") as f:
+            raw = f.read()
+        name = os.path.basename(img_path)
+        try:
+            with Image.open(io.BytesIO(raw)) as img:
+                if getattr(img, "n_frames", 1) > 1:
+                    return raw, name
+                source_format = img.format
+                img = ImageOps.exif_transpose(img)
+                width, height = img.size
+                target_w, target_h = self._compressor_target_size(width, height, limits)
+                scale = max(target_w / width, target_h / height)
+                if scale >= 1.0:
+                    return raw, name
+                new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+                img = img.resize(new_size, Image.Resampling.LANCZOS)
+                buf = io.BytesIO()
+                stem = os.path.splitext(name)[0]
+                has_alpha = img.mode in ("RGBA", "LA", "P") or "transparency" in img.info
+                if source_format == "JPEG" and not has_alpha:
+                    img.convert("RGB").save(buf, format="JPEG",
+                                            quality=self.upload_jpeg_quality, subsampling=0)
+                    out_name = f"{stem}.jpg"
+                else:
+                    img.save(buf, format="PNG", optimize=False)
+                    out_name = f"{stem}.png"
+                data = buf.getvalue()
+                max_size = len(raw) * (self.UPLOAD_JPEG_REENCODE_RATIO if out_name.endswith(".jpg") else 1)
+                if len(data) >= max_size:
+                    return raw, name
+                logger.info(f"输入图片已预缩放: {width}x{height} -> {new_size[0]}x{new_size[1]}，"
+                            f"{len(raw) // 1024}KB -> {len(data) // 1024}KB")
+                return data, out_name
+        except Exception as e:
+            logger.warning(f"输入图片预处理失败，按原图上传: {e}")
+            return raw, name
+
+    def _get_workflow_input_limits(self, prompt: dict, config: dict,
+                                   image_count: int) -> List[Optional[Tuple[int, int, int, int]]]:
+        """
+        推断 workflow 每张输入图片的尺寸约束
+        
+        优先使用 input_mappings 中声明的 max_width/max_height（可选 min_width/min_height），
+        否则要求该 LoadImage 的所有输出消费者都是 ImageCompressor 节点（任一其他节点直接
+        使用原图时不预处理）。同一图片被多个节点使用时取最宽松的约束；任一使用方无约束则不预处理。
+        """
+        input_mappings = config.get("input_mappings", {})
+        probe = copy.deepcopy(prompt)
+        placeholders = [f"__input_{i}__" for i in range(image_count)]
+        self._inject_images_to_prompt(probe, config, placeholders)
+        
+        # 每个节点的全部下游消费者（任意输入引用其任意输出）
+        consumers: Dict[str, List[Tuple[str, dict]]] = {}
+        for nid, node in prompt.items():
+            if not isinstance(node, dict):
+                continue
+            sources = {str(v[0]) for v in node.get("inputs", {}).values()
+                       if isinstance(v, list) and len(v) == 2 and isinstance(v[1], int)}
+            for src in sources:
+                consumers.setdefault(src, []).append((nid, node))
+        
+        def _node_limits(nid: str) -> Optional[Tuple[int, int, int, int]]:
+            mapping = input_mappings.get(nid, {})
+            if isinstance(mapping.get("max_width"), int) and isinstance(mapping.get("max_height"), int):
+                return (mapping.get("min_width", 1), mapping.get("min_height", 1),
+                        mapping["max_width"], mapping["max_height"])
+            found = []
+            for _, node in consumers.get(nid, []):
+                if node.get("class_type") != "ImageCompressor":
+                    return None
+                inputs = node.get("inputs", {})
+                vals = [inputs.get(k) for k in ("min_width", "min_height", "max_width", "max_height")]
+                if not all(isinstance(v, int) for v in vals):
+                    return None
+                found.append(tuple(vals))
+            if not found or len(found) != len(consumers.get(nid, [])):
+                return None
+            return (min(f[0] for f in found), min(f[1] for f in found),
+                    max(f[2] for f in found), max(f[3] for f in found))
+        
+        result: List[Optional[Tuple[int, int, int, int]]] = []
+        for ph in placeholders:
+            users = []
+            for nid, node in probe.items():
+                val = node.get("inputs", {}).get("image") if isinstance(node, dict) else None
+                if val == ph or (isinstance(val, list) and ph in val):
+                    users.append(nid)
+            limits = [_node_limits(nid) for nid in users]
+            if not limits or any(l is None for l in limits):
+                result.append(None)
+            else:
+                result.append((min(l[0] for l in limits), min(l[1] for l in limits),
+                               max(l[2] for l in limits), max(l[3] for l in limits)))
+        return result
+
+    async def send_comfyui_prompt(self, server: ServerState, prompt: dict,
+                                  client_id: Optional[str] = None) -> str:
+        """发送 prompt 到 ComfyUI，返回 prompt_id（client_id 与进度订阅的连接一致）"""
         async with aiohttp.ClientSession() as session:
             async with session.post(
                 f"{server.url}/prompt",
                 headers={"Content-Type": "application/json"},
-                json={"client_id": str(uuid.uuid4()), "prompt": prompt}
+                json={"client_id": client_id or str(uuid.uuid4()), "prompt": prompt}
             ) as resp:
                 if resp.status != 200:
                     text = await resp.text()
@@ -817,6 +1472,36 @@ class WorkflowEngine:
                 data = await resp.json()
                 return data.get("prompt_id", "")
 
+    async def interrupt_comfyui_prompt(self, server: ServerState, prompt_id: str) -> bool:
+        """从 ComfyUI 队列删除该 prompt，正在执行时中断（带 prompt_id，不影响其他客户端的任务）"""
+        ok = True
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{server.url}/queue", json={"delete": [prompt_id]},
+                                        timeout=10) as resp:
+                    ok = resp.status == 200
+                async with session.post(f"{server.url}/interrupt", json={"prompt_id": prompt_id},
+                                        timeout=10) as resp:
+                    ok = ok and resp.status == 200
+        except Exception as e:
+            logger.warning(f"服务器{server.name}中断任务失败：{e}")
+            return False
+        logger.info(f"已请求服务器{server.name}中断任务 {prompt_id}")
+        return ok
+
+    async def _prompt_completed(self, server: ServerState, prompt_id: str) -> bool:
+        """查询历史记录判断 prompt 是否已执行完成（请求失败视为未完成）"""
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{server.url}/history/{prompt_id}", timeout=10) as resp:
+                    if resp.status != 200:
+                        return False
+                    data = await resp.json()
+        except Exception:
+            return False
+        entry = data.get(prompt_id) if isinstance(data, dict) else None
+        return bool(entry and entry.get("status", {}).get("completed"))
+
     async def poll_task_status(self, server: ServerState, prompt_id: str,
                                 timeout: int = 600, interval: int = 3) -> dict:
         """轮询任务状态直到完成"""
@@ -829,6 +1514,9 @@ class WorkflowEngine:
             while True:
                 now_t = asyncio.get_event_loop().time()
                 elapsed = now_t - start_time
+                if prompt_id in self._cancelled_prompts:
+                    self._cancelled_prompts.discard(prompt_id)
+                    raise TaskCancelledError(prompt_id)
                 if not server.healthy:
                     raise Exception(f"服务器【{server.name}】不健康，无法完成任务")
                 if elapsed > timeout:
@@ -934,9 +1622,15 @@ class WorkflowEngine:
             if not os.path.exists(img_path):
                 raise Exception(f"PERMANENT_ERROR:图片文件不存在：{img_path}")
             filesize = os.path.getsize(img_path)
-            if filesize < 10240:
+            if filesize < self.MIN_INPUT_IMAGE_BYTES:
                 raise Exception(f"PERMANENT_ERROR:图片文件过小，可能已损坏")
-            image_filename = await self.upload_image_to_comfyui(server, img_path)
+            upload_start = time.monotonic()
+            image_filename = await self.upload_image_to_comfyui(
+                server, img_path,
+                size_limits=(self.IMG2IMG_MIN_SIZE, self.IMG2IMG_MIN_SIZE,
+                             self.IMG2IMG_MAX_SIZE, self.IMG2IMG_MAX_SIZE)
+            )
+            self._trace_span(task_data, "upload", upload_start)
             if not image_filename:
                 raise Exception(f"PERMANENT_ERROR:图片上传失败")
             self._schedule_cleanup(img_path)
@@ -945,8 +1639,21 @@ class WorkflowEngine:
             prompt, current_seed, current_width, current_height,
             image_filename, denoise, current_batch_size, lora_list, selected_model
         )
-        prompt_id = await self.send_comfyui_prompt(server, comfy_prompt)
-        history_data = await self.poll_task_status(server, prompt_id)
+        async with self._progress_listener(server, task_data) as client_id:
+            t0 = time.monotonic()
+            prompt_id = await self.send_comfyui_prompt(server, comfy_prompt, client_id)
+            t1 = time.monotonic()
+            self.m_stage_seconds.labels(server.name, "submit").observe(t1 - t0)
+            self._trace_span(task_data, "prompt", t0, t1)
+            await self._check_cancelled(server, task_data, prompt_id)
+            history_data = await self.poll_task_status(server, prompt_id)
+            # 已执行完毕，之后只剩下载/发送结果，不再可取消
+            task_data["executed"] = True
+            t2 = time.monotonic()
+            self.m_stage_seconds.labels(server.name, "execute").observe(t2 - t1)
+            self._trace_span(task_data, "execute", t1, t2)
+        if (trace := task_data.get("trace")) is not None and history_data:
+            trace.attrs["comfy_exec"] = self._comfy_exec_seconds(history_data)
         
         if not history_data or not history_data.get("status", {}).get("completed"):
             raise Exception("任务超时或未完成")
@@ -983,8 +1690,10 @@ class WorkflowEngine:
             
             # 自动保存
             if self.enable_auto_save:
+                save_start = time.monotonic()
                 await self.save_image_locally(server, fn,
                     prompt, task_data.get("user_id", ""), sf, ft)
+                self._trace_span(task_data, "download", save_start)
         
         return result
 
@@ -1005,26 +1714,41 @@ class WorkflowEngine:
         # 上传图片
         uploaded_images = []
         if image_paths and config.get("input_nodes"):
+            input_limits = self._get_workflow_input_limits(prompt, config, len(image_paths))
+            upload_start = time.monotonic()
             for i, ip in enumerate(image_paths):
                 if not os.path.exists(ip):
                     raise Exception(f"PERMANENT_ERROR:第 {i+1} 张图片不存在")
-                fn = await self.upload_image_to_comfyui(server, ip)
+                fn = await self.upload_image_to_comfyui(server, ip, size_limits=input_limits[i])
                 if not fn:
                     raise Exception(f"PERMANENT_ERROR:第 {i+1} 张图片上传失败")
                 uploaded_images.append(fn)
+            self._trace_span(task_data, "upload", upload_start)
             
             # 将上传的图片名注入 prompt
             if uploaded_images:
                 self._inject_images_to_prompt(prompt, config, uploaded_images)
             
-            # 清理临时文件
+            # 清理临时文件（永久保存的输入图片由保留策略管理）
             for ip in image_paths:
-                if "workflow_inputs" not in ip:
-                    self._schedule_cleanup(ip)
+                self._schedule_cleanup(ip)
         
         # 发送 workflow
-        prompt_id = await self.send_comfyui_prompt(server, prompt)
-        history_data = await self.poll_task_status(server, prompt_id)
+        async with self._progress_listener(server, task_data) as client_id:
+            t0 = time.monotonic()
+            prompt_id = await self.send_comfyui_prompt(server, prompt, client_id)
+            t1 = time.monotonic()
+            self.m_stage_seconds.labels(server.name, "submit").observe(t1 - t0)
+            self._trace_span(task_data, "prompt", t0, t1)
+            await self._check_cancelled(server, task_data, prompt_id)
+            history_data = await self.poll_task_status(server, prompt_id)
+            # 已执行完毕，之后只剩下载/发送结果，不再可取消
+            task_data["executed"] = True
+            t2 = time.monotonic()
+            self.m_stage_seconds.labels(server.name, "execute").observe(t2 - t1)
+            self._trace_span(task_data, "execute", t1, t2)
+        if (trace := task_data.get("trace")) is not None and history_data:
+            trace.attrs["comfy_exec"] = self._comfy_exec_seconds(history_data)
         
         if not history_data or not history_data.get("status", {}).get("completed"):
             raise Exception("任务超时或未完成")
@@ -1063,10 +1787,12 @@ class WorkflowEngine:
                         url = await self.get_image_url(server, fn, subfolder=sf, file_type=ft)
                         result.images.append({"url": url, "filename": fn, "subfolder": sf, "type": ft})
                     if self.enable_auto_save:
+                        save_start = time.monotonic()
                         await self.save_image_locally(
-                            server, fn, f"workflow_{workflow_name}",
-                            task_data.get("user_id", ""), sf, ft
+                            server, fn, "", task_data.get("user_id", ""), sf, ft,
+                            workflow=workflow_name
                         )
+                        self._trace_span(task_data, "download", save_start)
             
             # 音频
             if node_output.get("audio"):
@@ -1184,8 +1910,8 @@ class WorkflowEngine:
         if image_filename:
             nodes.update({
                 "51": {"inputs": {"image": image_filename}, "class_type": "LoadImage"},
-                "53": {"inputs": {"min_width": 800, "min_height": 800,
-                                  "max_width": 1600, "max_height": 1600,
+                "53": {"inputs": {"min_width": self.IMG2IMG_MIN_SIZE, "min_height": self.IMG2IMG_MIN_SIZE,
+                                  "max_width": self.IMG2IMG_MAX_SIZE, "max_height": self.IMG2IMG_MAX_SIZE,
                                   "image": ["51", 0]}, "class_type": "ImageCompressor"},
                 "54": {"inputs": {"pixels": ["53", 0], "vae": ["30", 2]},
                        "class_type": "VAEEncode"},
@@ -1300,6 +2026,14 @@ class WorkflowEngine:
 
     # ==================== 参数解析 ====================
 
+    def _name_index(self, attr: str, mapping: dict) -> NameIndex:
+        """取 LoRA / 模型的子串索引；映射被替换或条目数变化时重建"""
+        index = getattr(self, attr)
+        if not index.matches(mapping):
+            index = NameIndex(mapping)
+            setattr(self, attr, index)
+        return index
+
     def parse_lora_params(self, params: List[str]) -> Tuple[List[str], List[dict]]:
         """LoRA 参数解析"""
         pattern = r"^lora:([^:!]+)(?::([0-9.]+))?(?:!([0-9.]+))?$"
@@ -1319,8 +2053,7 @@ class WorkflowEngine:
                 exact_key = user_input
                 matched = self.lora_name_map[user_input]
             else:
-                fuzzy = [k for k, (_, d) in self.lora_name_map.items()
-                         if user_input in k or user_input in d.lower()]
+                fuzzy = self._name_index("lora_index", self.lora_name_map).search(user_input)
                 if len(fuzzy) == 1:
                     exact_key = fuzzy[0]
                     matched = self.lora_name_map[exact_key]
@@ -1328,7 +2061,7 @@ class WorkflowEngine:
                     descs = [self.lora_name_map[k][1] for k in fuzzy]
                     raise ValueError(f"找到多个匹配的LoRA：{', '.join(descs)}（输入：{user_input}）")
             if not matched:
-                avails = list(set(v[1] for v in self.lora_name_map.values() if v[1]))
+                avails = self._name_index("lora_index", self.lora_name_map).descriptions()
                 raise ValueError(f"未找到LoRA：{user_input}（可用：{', '.join(avails)}）")
             
             fn, desc = matched
@@ -1362,19 +2095,72 @@ class WorkflowEngine:
             if ui in self.model_name_map:
                 matched = self.model_name_map[ui]
             else:
-                fuzzy = [k for k, (_, d) in self.model_name_map.items()
-                         if ui in k or ui in d.lower()]
+                fuzzy = self._name_index("model_index", self.model_name_map).search(ui)
                 if len(fuzzy) == 1:
                     matched = self.model_name_map[fuzzy[0]]
                 elif len(fuzzy) > 1:
                     descs = list(set(self.model_name_map[k][1] for k in fuzzy))
                     raise ValueError(f"找到多个匹配的模型：{', '.join(descs)}（输入：{ui}）")
             if not matched:
-                avails = list(set(v[1] for v in self.model_name_map.values() if v[1]))
+                avails = self._name_index("model_index", self.model_name_map).descriptions()
                 raise ValueError(f"未找到模型：{ui}（可用：{', '.join(avails)}）")
             selected = matched[0]
         return non_model, selected
 
+    @staticmethod
+    def parse_command(full_text: str, keyword: str) -> Tuple[str, list]:
+        """拆分指令：返回 (@提及, 关键字之后的参数列表)，首个词不是 keyword 时返回 ("", [])"""
+        mention_pat = r'@[\w\d]+'
+        text = re.sub(mention_pat, '', full_text).strip()
+        parts = text.split()
+        if not parts or parts[0] != keyword:
+            return ("", [])
+        mentions = " ".join(re.findall(mention_pat, full_text))
+        return (mentions, parts[1:])
+
+    def tokenize_workflow_args(self, params_text: str, config: dict) -> List[str]:
+        """
+        把 workflow 指令前缀之后的文本切分为 ["参数名:值", ...]
+
+        参数名（含别名）后紧跟冒号才算参数，值延续到下一个参数名；
+        其余文本合并为「提示词:...」放在最前面。
+        """
+        node_configs = config.get("node_configs", {})
+        known_keys = set()
+        for _, nc in node_configs.items():
+            for pn, pi in nc.items():
+                known_keys.add(pn)
+                known_keys.update(pi.get("aliases", []))
+        param_pat = '|'.join(re.escape(k) for k in known_keys)
+        regex = rf'(?<!\S)({param_pat})(?=\s*:)'
+        matches = list(re.finditer(regex, params_text))
+        args = []
+        prompt_parts = []
+        last_end = 0
+        for idx, m in enumerate(matches):
+            ps = m.start()
+            if ps > last_end:
+                pp = params_text[last_end:ps].strip()
+                if pp:
+                    prompt_parts.append(pp)
+            cp = params_text.find(':', ps)
+            if cp == -1:
+                continue
+            nps = len(params_text)
+            if idx + 1 < len(matches):
+                nps = matches[idx + 1].start()
+            val = params_text[cp + 1:nps].strip()
+            args.append(f"{m.group(1)}:{val}")
+            last_end = nps
+        if last_end < len(params_text):
+            pp = params_text[last_end:].strip()
+            if pp:
+                prompt_parts.append(pp)
+        prompt_text = ' '.join(prompt_parts).strip()
+        if prompt_text:
+            args.insert(0, f"提示词:{prompt_text}")
+        return args
+
     def parse_workflow_params(self, args: List[str], config: dict) -> dict:
         """解析 workflow 参数"""
         params = {}
@@ -1475,17 +2261,21 @@ class WorkflowEngine:
 
     async def save_image_locally(self, server: ServerState, filename: str,
                                   prompt: str = "", user_id: str = "",
-                                  subfolder: str = "", file_type: str = "output") -> Optional[str]:
-        """从 ComfyUI 下载并保存文件到本地"""
+                                  subfolder: str = "", file_type: str = "output",
+                                  workflow: str = "") -> Optional[str]:
+        """从 ComfyUI 下载并保存文件到本地，并登记到输出目录表（image_records）"""
         if not self.enable_auto_save:
             return None
         try:
             url = await self.get_image_url(server, filename, subfolder=subfolder, file_type=file_type)
+            t0 = time.perf_counter()
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, timeout=30) as resp:
                     if resp.status != 200:
                         return None
                     data = await resp.read()
+            self.m_stage_seconds.labels(server.name, "download").observe(time.perf_counter() - t0)
+            self.m_downloaded_bytes.labels(server.name).inc(len(data))
             
             now = datetime.now()
             auto_path = Path(self.auto_save_dir)
@@ -1503,14 +2293,17 @@ class WorkflowEngine:
             saved = ts + orig
             path = save_dir / saved
             
-            def _write():
+            def _write() -> Optional[str]:
+                if self.enable_dedup_store:
+                    return self.blobs.store_bytes(data, path)
                 with open(path, 'wb') as f:
                     f.write(data)
-            await asyncio.get_event_loop().run_in_executor(None, _write)
+                return None
+            digest = await asyncio.get_event_loop().run_in_executor(None, _write)
             logger.info(f"文件已自动保存: {path}")
             
-            if user_id:
-                asyncio.create_task(self._record_image_generation(saved, user_id))
+            self._record_image_generation(saved, user_id, str(path), len(data), prompt, workflow,
+                                          content_hash=digest)
             return saved
         except Exception as e:
             logger.error(f"自动保存文件失败: {str(e)}")
@@ -1545,14 +2338,161 @@ class WorkflowEngine:
                 saved_fn = f"{ts}_input{ext}"
             save_path = save_dir / saved_fn
             
-            def _copy():
-                shutil.copy2(img_path, save_path)
-            await asyncio.get_event_loop().run_in_executor(None, _copy)
+            def _copy() -> Tuple[int, Optional[str]]:
+                digest = None
+                if self.enable_dedup_store:
+                    digest = self.blobs.store_file(img_path, save_path)
+                else:
+                    shutil.copy2(img_path, save_path)
+                return os.path.getsize(save_path), digest
+            size, digest = await asyncio.get_event_loop().run_in_executor(None, _copy)
+            record_category = {"img2img": CATEGORY_IMG2IMG_INPUTS,
+                               "workflow": CATEGORY_WORKFLOW_INPUTS}.get(category, CATEGORY_INPUTS)
+            self._record_image_generation(saved_fn, user_id, str(save_path), size,
+                                          workflow=workflow_name, category=record_category,
+                                          content_hash=digest)
             return str(save_path)
         except Exception as e:
             logger.error(f"永久保存输入图片失败: {str(e)}")
             return None
 
+    # 允许的输入图片格式
+    INPUT_IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "BMP", "GIF")
+    # 多图 JPEG（MPF：Ultra HDR、立体照片、很多手机相机照片）按 JPEG 处理，只校验主图
+    INPUT_FORMAT_ALIASES = {"MPO": "JPEG"}
+    # 只有这些格式的多帧图片才是动图
+    ANIMATED_FORMATS = ("GIF", "WEBP", "PNG")
+    MIN_INPUT_IMAGE_BYTES = 10240
+
+    async def validate_input_image(self, img_path: str) -> Optional[str]:
+        """
+        仅读取文件头校验输入图片（格式、尺寸、帧数、是否截断），不做完整解码
+        
+        Returns:
+            校验失败时返回面向用户的错误描述，通过返回 None
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._probe_image_header, img_path)
+
+    def _probe_image_header(self, img_path: str) -> Optional[str]:
+        try:
+            if not os.path.isfile(img_path):
+                return "图片下载失败"
+            filesize = os.path.getsize(img_path)
+            if filesize < self.MIN_INPUT_IMAGE_BYTES:
+                return "图片文件过小，可能已损坏"
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                with Image.open(img_path) as img:
+                    fmt = self.INPUT_FORMAT_ALIASES.get(img.format, img.format)
+                    width, height = img.size
+                    animated = getattr(img, "is_animated", False)
+        except Image.DecompressionBombError:
+            return "图片分辨率过大"
+        except Exception:
+            return "无法识别的图片格式或文件已损坏"
+        
+        if fmt not in self.INPUT_IMAGE_FORMATS:
+            return f"不支持的图片格式：{fmt}（支持：{'、'.join(self.INPUT_IMAGE_FORMATS)}）"
+        if animated and fmt in self.ANIMATED_FORMATS:
+            return "不支持动图，请发送静态图片"
+        if width <= 0 or height <= 0:
+            return "图片尺寸无效"
+        if max(width, height) > self.max_input_image_side or width * height > self.max_input_image_pixels:
+            return (f"图片分辨率过大（{width}x{height}，单边上限{self.max_input_image_side}，"
+                    f"总像素上限{self.max_input_image_pixels}）")
+        if self._is_truncated(img_path, fmt, filesize):
+            return "图片文件不完整，可能下载中断"
+        return None
+
+    @staticmethod
+    def _is_truncated(img_path: str, fmt: str, filesize: int) -> bool:
+        """
+        按文件结构判断是否截断
+        
+        JPEG / PNG 从文件头逐段遍历到 EOI / IEND，不要求结束标记位于文件末尾：
+        动态照片（尾部附带视频）、三星 SEFT、MPF 附加图像等尾部数据都视为完整。
+        WEBP / BMP 比较头部声明的长度，GIF 检查尾部结束符。
+        """
+        with open(img_path, "rb") as f:
+            if fmt == "JPEG":
+                return WorkflowEngine._jpeg_truncated(f, filesize)
+            if fmt == "PNG":
+                return WorkflowEngine._png_truncated(f, filesize)
+            if fmt == "WEBP":
+                head = f.read(8)
+                return int.from_bytes(head[4:8], "little") + 8 > filesize
+            if fmt == "GIF":
+                f.seek(max(0, filesize - 16))
+                return b"\x3b" not in f.read()
+            if fmt == "BMP":
+                head = f.read(6)
+                return int.from_bytes(head[2:6], "little") > filesize
+        return False
+
+    # 在熵编码数据中查找 EOI 时每次读取的字节数
+    JPEG_SCAN_CHUNK = 64 * 1024
+
+    @staticmethod
+    def _jpeg_truncated(f, filesize: int) -> bool:
+        """
+        从 SOI 按段长度逐段跳转到 SOS（只读取各段头部），再确认其后存在 EOI
+        
+        熵编码数据中的 0xFF 都经过填充（后跟 0x00 或 RST），SOS 之后第一个 FF D9
+        即主图像的 EOI；EXIF 缩略图自带的 EOI 位于 APP1 段内，已按段长度跳过。
+        EOI 位于文件末尾附近时只读尾部；否则（带尾部附加数据）分块向后查找。
+        """
+        if f.read(2) != b"\xff\xd8":
+            return True
+        pos, scan_start = 2, None
+        while scan_start is None and pos + 2 <= filesize:
+            f.seek(pos)
+            head = f.read(4)
+            if head[0] != 0xFF:
+                return True
+            marker = head[1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker == 0xD9:
+                return False
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                pos += 2
+                continue
+            end = pos + 2 + int.from_bytes(head[2:4], "big")
+            if len(head) < 4 or end > filesize:
+                return True
+            if marker == 0xDA:
+                scan_start = end
+            pos = end
+        if scan_start is None:
+            return True
+        f.seek(max(scan_start, filesize - 64))
+        if b"\xff\xd9" in f.read():
+            return False
+        f.seek(scan_start)
+        prev = b""
+        while chunk := f.read(WorkflowEngine.JPEG_SCAN_CHUNK):
+            if b"\xff\xd9" in prev + chunk:
+                return False
+            prev = chunk[-1:]
+        return True
+
+    @staticmethod
+    def _png_truncated(f, filesize: int) -> bool:
+        """从签名后按块长度逐块跳转到 IEND，只读取各块头部"""
+        pos = 8
+        while pos + 12 <= filesize:
+            f.seek(pos)
+            head = f.read(8)
+            length = int.from_bytes(head[:4], "big")
+            pos += 12 + length
+            if pos > filesize:
+                return True
+            if head[4:8] == b"IEND":
+                return False
+        return True
+
     async def download_file(self, url: str, timeout: int = 120) -> Optional[bytes]:
         """从 URL 下载文件"""
         try:
@@ -1564,56 +2504,141 @@ class WorkflowEngine:
             logger.warning(f"文件下载失败: {e}")
         return None
 
+    # 已压缩的媒体直接存储（ZIP_STORED），其余文件 deflate
+    ZIP_STORED_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.gif',
+                       '.mp4', '.webm', '.mov', '.mkv', '.mp3', '.ogg')
+    # 发送用压缩包快照的保留时间（秒）
+    ZIP_SNAPSHOT_TTL = 3600
+
     async def create_zip(self, image_files: List[str], user_id: str) -> Optional[str]:
-        """创建图片压缩包，返回本地路径"""
+        """
+        更新当日压缩包，返回供发送的快照路径
+        
+        每个用户（未开启 only_own_images 时全体共用）每天维护一个压缩包，
+        导出时只追加上次导出之后新保存的文件；压缩包内容与文件列表不一致时重建。
+        发送的是持锁期间生成的快照（硬链接，不支持时复制），上传过程中其他导出
+        追加或重建压缩包不会影响正在发送的文件；快照在 ZIP_SNAPSHOT_TTL 秒后删除。
+        """
         if not image_files:
             return None
         try:
-            now = datetime.now()
-            ts = now.strftime("%Y%m%d_%H%M%S")
-            fn = f"comfyui_images_{user_id}_{ts}.zip"
-            auto_path = Path(self.auto_save_dir)
-            zip_path = auto_path / fn
-            
-            def _zip():
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                    for f in image_files:
-                        if os.path.exists(f):
-                            zf.write(f, os.path.basename(f))
-            await asyncio.get_event_loop().run_in_executor(None, _zip)
-            logger.info(f"压缩包已创建: {zip_path}")
-            return str(zip_path)
+            today = datetime.now().strftime("%Y-%m-%d")
+            owner = user_id if self.only_own_images else "all"
+            archive_root = Path(self.auto_save_dir) / "archives"
+            zip_path = archive_root / today / f"comfyui_images_{owner}_{today}.zip"
+            loop = asyncio.get_event_loop()
+            # 同一压缩包的并发导出串行执行
+            async with self._zip_locks.setdefault(owner, asyncio.Lock()):
+                added = await loop.run_in_executor(None, self._update_zip, zip_path, image_files)
+                snapshot = await loop.run_in_executor(None, self._snapshot_zip, zip_path)
+            # 保存目录下的文件不走 _schedule_cleanup（会被视为目录内文件而跳过）
+            self.delay_scheduler.delete_later(str(snapshot), self.ZIP_SNAPSHOT_TTL)
+            logger.info(f"压缩包已更新: {zip_path}（新增 {added} 个文件）")
+            return str(snapshot)
         except Exception as e:
             logger.error(f"创建压缩包失败: {e}")
             return None
 
-    def _schedule_cleanup(self, file_path: str, delay: int = 10):
-        """安排延迟清理临时文件"""
-        async def _cleanup():
-            await asyncio.sleep(delay)
+    @classmethod
+    def _update_zip(cls, zip_path: Path, image_files: List[str]) -> int:
+        """增量写入压缩包（在线程池中执行），返回新增文件数"""
+        wanted = {}
+        for f in image_files:
+            if os.path.exists(f):
+                wanted.setdefault(os.path.basename(f), f)
+        
+        zip_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        existing: set = set()
+        if zip_path.exists():
             try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"临时文件已清理: {file_path}")
-            except Exception as e:
-                logger.warning(f"清理临时文件失败: {e}")
-        asyncio.create_task(_cleanup())
+                with zipfile.ZipFile(zip_path) as zf:
+                    existing = set(zf.namelist())
+            except zipfile.BadZipFile:
+                existing = None
+            if existing is None or not existing <= wanted.keys():
+                zip_path.unlink()
+                existing = set()
+        
+        new_names = [n for n in wanted if n not in existing]
+        if not new_names and existing:
+            return 0
+        if existing and zip_path.stat().st_nlink > 1:
+            # 仍有发送中的快照与压缩包共用 inode：先复制出独立的文件再追加，快照内容不变
+            tmp = zip_path.with_name(f"{zip_path.name}.tmp")
+            shutil.copyfile(zip_path, tmp)
+            os.replace(tmp, zip_path)
+        try:
+            with zipfile.ZipFile(zip_path, 'a' if existing else 'w') as zf:
+                for name in new_names:
+                    compress = (zipfile.ZIP_STORED if name.lower().endswith(cls.ZIP_STORED_EXTS)
+                                else zipfile.ZIP_DEFLATED)
+                    # ZipFile.write 按块流式读取源文件，不整体载入内存
+                    zf.write(wanted[name], name, compress_type=compress)
+        except Exception:
+            # 追加中途失败的压缩包不可信，下次整体重建
+            if zip_path.exists():
+                zip_path.unlink()
+            raise
+        return len(new_names)
+
+    @staticmethod
+    def _snapshot_zip(zip_path: Path) -> Path:
+        """为压缩包生成同名快照（在线程池中执行），每个快照单独一个子目录"""
+        snapshot = zip_path.parent / uuid.uuid4().hex[:16] / zip_path.name
+        snapshot.parent.mkdir()
+        try:
+            os.link(zip_path, snapshot)
+        except OSError:
+            shutil.copyfile(zip_path, snapshot)
+        return snapshot
+
+    def _sweep_archives(self):
+        """删除往日的压缩包目录（在线程池中执行）；最近仍有快照生成的目录保留到快照过期"""
+        archive_root = Path(self.auto_save_dir) / "archives"
+        if not archive_root.exists():
+            return
+        today = datetime.now().strftime("%Y-%m-%d")
+        cutoff = time.time() - self.ZIP_SNAPSHOT_TTL
+        for d in archive_root.iterdir():
+            try:
+                if d.is_dir() and d.name != today and d.stat().st_mtime < cutoff:
+                    shutil.rmtree(d, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _schedule_cleanup(self, file_path: str, delay: int = 10):
+        """
+        安排延迟清理临时文件（共享调度器，重启后仍会清理）
+        
+        保存目录中的文件（永久保存的输入图片）登记在目录表中，由保留策略统一清理，这里跳过。
+        """
+        if self._is_catalogued(file_path):
+            return
+        self.delay_scheduler.delete_later(file_path, delay)
+
+    def _is_catalogued(self, file_path: str) -> bool:
+        """文件是否位于保存目录（auto_save_dir）下"""
+        root = os.path.abspath(self.auto_save_dir)
+        return os.path.abspath(file_path).startswith(root + os.sep)
+
+    # 输出压缩包收录的媒体类型
+    ZIP_MEDIA_TYPES = ("image/png", "image/jpeg", "image/webp")
 
     async def get_today_images(self, user_id: Optional[str] = None) -> List[str]:
-        """获取今日生成的图片文件列表"""
+        """获取今日生成的图片文件列表（查询 image_records 索引，不扫描目录）"""
         try:
             now = datetime.now()
-            auto_path = Path(self.auto_save_dir)
-            today_dir = auto_path / str(now.year) / f"{now.month:02d}" / f"{now.day:02d}"
-            if not today_dir.exists():
-                return []
-            files = []
-            for ext in ['*.png', '*.jpg', '*.jpeg', '*.webp']:
-                files.extend(today_dir.glob(ext))
-            if self.only_own_images and user_id:
-                user_imgs = set(await self._get_user_images_today(user_id))
-                files = [f for f in files if f.name in user_imgs]
-            return [str(f) for f in files]
+            today_dir = Path(self.auto_save_dir) / str(now.year) / f"{now.month:02d}" / f"{now.day:02d}"
+            owner = user_id if (self.only_own_images and user_id) else None
+            rows = await self.db.get_image_records(now.strftime("%Y-%m-%d"), owner)
+            files: Dict[str, None] = {}
+            for filename, file_path, media_type in rows:
+                # 升级前的记录没有路径和类型，按保存规则推导
+                media_type = media_type or mimetypes.guess_type(filename)[0]
+                if media_type in self.ZIP_MEDIA_TYPES:
+                    files[file_path or str(today_dir / filename)] = None
+            return list(files)
         except Exception as e:
             logger.error(f"获取今日图片列表失败: {e}")
             return []
@@ -1631,75 +2656,329 @@ class WorkflowEngine:
             elif not os.path.exists(db_dir):
                 await loop.run_in_executor(None, os.makedirs, db_dir, True)
             
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute('''CREATE TABLE IF NOT EXISTS user_downloads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    download_date TEXT NOT NULL,
-                    download_count INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, download_date))''')
-                await conn.execute('''CREATE TABLE IF NOT EXISTS image_records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    generate_date TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-                await conn.commit()
+            await self.db.connect()
             logger.info(f"数据库初始化完成: {self.db_path}")
+            await self.delay_scheduler.restore()
+            await self.delay_scheduler.sweep_temp_dirs(self.temp_dirs, self.temp_file_max_age)
+            await self.rate_limiter.restore()
+            await self.eta_estimator.restore()
         except Exception as e:
             logger.error(f"数据库初始化失败: {e}")
 
+    async def close_database(self):
+        try:
+            await self.rate_limiter.persist()
+            await self.eta_estimator.persist()
+            if self.tracer is not None:
+                await self.tracer.flush()
+        except Exception as e:
+            logger.error(f"保存限流状态/耗时统计失败: {e}")
+        try:
+            await self.delay_scheduler.close()
+        except Exception as e:
+            logger.error(f"关闭调度器失败: {e}")
+        try:
+            await self.db.close()
+        except Exception as e:
+            logger.error(f"关闭数据库失败: {e}")
+
     async def check_download_limit(self, user_id: str) -> Tuple[bool, int]:
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute('''INSERT OR IGNORE INTO user_downloads
-                    (user_id, download_date, download_count) VALUES (?, ?, 0)''', (user_id, today))
-                await conn.commit()
-                cur = await conn.execute('''SELECT download_count FROM user_downloads
-                    WHERE user_id=? AND download_date=?''', (user_id, today))
-                row = await cur.fetchone()
-                cnt = row[0] if row else 0
-                return cnt < self.daily_download_limit, cnt
+            cnt = await self.db.get_download_count(user_id)
+            return cnt < self.daily_download_limit, cnt
         except Exception as e:
             logger.error(f"检查下载限制失败: {e}")
             return False, 0
 
     async def increment_download_count(self, user_id: str):
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute('''INSERT OR IGNORE INTO user_downloads
-                    (user_id, download_date, download_count) VALUES (?, ?, 0)''', (user_id, today))
-                await conn.execute('''UPDATE user_downloads SET download_count=download_count+1,
-                    updated_at=CURRENT_TIMESTAMP WHERE user_id=? AND download_date=?''', (user_id, today))
-                await conn.commit()
+            await self.db.increment_download_count(user_id)
         except Exception as e:
             logger.error(f"更新下载次数失败: {e}")
 
-    async def _record_image_generation(self, filename: str, user_id: str):
+    def _record_image_generation(self, filename: str, user_id: str, file_path: str = None,
+                                 file_size: int = None, prompt: str = "", workflow: str = "",
+                                 category: str = CATEGORY_OUTPUTS, content_hash: str = None):
+        """记录保存的文件到目录表（写后缓冲，批量落盘）"""
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            async with aiosqlite.connect(self.db_path) as conn:
-                await conn.execute('''INSERT INTO image_records
-                    (filename, user_id, generate_date) VALUES (?, ?, ?)''', (filename, user_id, today))
-                await conn.commit()
+            self.db.add_image_record(
+                filename, user_id or "", file_path=file_path, file_size=file_size,
+                media_type=mimetypes.guess_type(filename)[0],
+                prompt=prompt or None, workflow=workflow or None, category=category,
+                content_hash=content_hash)
         except Exception as e:
             logger.error(f"记录图片生成信息失败: {e}")
 
     async def _get_user_images_today(self, user_id: str) -> List[str]:
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            async with aiosqlite.connect(self.db_path) as conn:
-                cur = await conn.execute('''SELECT filename FROM image_records
-                    WHERE user_id=? AND generate_date=?''', (user_id, today))
-                return [row[0] for row in await cur.fetchall()]
+            return await self.db.get_user_images(user_id)
         except Exception as e:
             logger.error(f"获取用户图片列表失败: {e}")
             return []
 
+    # ==================== 保存目录保留策略 ====================
+
+    RETENTION_BATCH = 200
+
+    def _retention_enabled(self) -> bool:
+        return (self.retention_max_age_days > 0 or self.retention_max_total_mb > 0
+                or any(q > 0 for q in self.retention_quotas_mb.values()))
+
+    async def _start_retention_loop(self):
+        """定期执行保留策略（已配置时）和 maintenance_callbacks 中的清理任务"""
+        if self._retention_enabled():
+            logger.info(f"启动保存目录保留策略，检查间隔：{self.retention_interval}秒")
+        while True:
+            try:
+                if self._retention_enabled():
+                    await self.run_retention()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"执行保留策略失败: {e}")
+            await self.run_maintenance()
+            await asyncio.sleep(self.retention_interval)
+
+    async def run_maintenance(self):
+        """在线程池中依次执行 maintenance_callbacks（往日压缩包、画廊缩略图等缓存的清理）"""
+        loop = asyncio.get_event_loop()
+        for callback in list(self.maintenance_callbacks):
+            try:
+                await loop.run_in_executor(None, callback)
+            except Exception as e:
+                logger.error(f"执行定期清理失败: {e}")
+
+    async def run_retention(self) -> Tuple[int, int]:
+        """
+        执行一次保留策略：依次按最长保留天数、类别配额、总容量淘汰最旧的文件
+        
+        淘汰顺序和容量统计都来自 image_records 目录表，不遍历目录；
+        目录表之外的文件（如升级前保存的输入图片）不受管理。
+        容量按内容哈希去重统计：硬链接到同一 blob 的多个文件只计一次。
+        每次启动后的首轮先移除文件已不存在的输入图片记录。
+        
+        Returns:
+            (删除的文件数, 释放的字节数)
+        """
+        removed, freed = 0, 0
+        mb = 1024 * 1024
+        
+        if not self._retention_pruned:
+            _, freed = await self._prune_missing_inputs()
+            self._retention_pruned = True
+        
+        if self.retention_max_age_days > 0:
+            cutoff = (datetime.now() - timedelta(days=self.retention_max_age_days)).strftime("%Y-%m-%d")
+            while True:
+                rows = await self.db.get_oldest_records(self.RETENTION_BATCH, before_date=cutoff)
+                if not rows:
+                    break
+                n, b = await self._evict_records(rows)
+                removed, freed = removed + n, freed + b
+        
+        for category, quota_mb in self.retention_quotas_mb.items():
+            if quota_mb > 0:
+                n, b = await self._evict_to_quota(quota_mb * mb, category)
+                removed, freed = removed + n, freed + b
+        
+        if self.retention_max_total_mb > 0:
+            n, b = await self._evict_to_quota(self.retention_max_total_mb * mb, None)
+            removed, freed = removed + n, freed + b
+        
+        if removed:
+            logger.info(f"保留策略：已清理 {removed} 个文件，释放 {freed / mb:.1f}MB")
+        return removed, freed
+
+    async def _usage_bytes(self, category: Optional[str]) -> int:
+        if category is None:
+            return await self.db.get_total_usage()
+        return (await self.db.get_category_usage()).get(category, (0, 0))[1]
+
+    async def _evict_to_quota(self, quota: int, category: Optional[str]) -> Tuple[int, int]:
+        """
+        从最旧的记录开始淘汰，直到（按内容去重的）登记容量不超过 quota
+        
+        同一内容的其他链接仍在时删除一条记录不会减少容量，因此每批之后重新统计。
+        """
+        removed, freed = 0, 0
+        while True:
+            excess = await self._usage_bytes(category) - quota
+            if excess <= 0:
+                break
+            rows = await self.db.get_oldest_records(self.RETENTION_BATCH, category=category)
+            if not rows:
+                break
+            batch = []
+            for row in rows:
+                batch.append(row)
+                excess -= row[3] or 0
+                if excess <= 0:
+                    break
+            n, b = await self._evict_records(batch)
+            removed, freed = removed + n, freed + b
+        return removed, freed
+
+    async def _prune_missing_inputs(self) -> Tuple[int, int]:
+        """
+        移除文件已被删除的输入图片记录（并释放其 blob），返回 (记录数, 释放的字节数)
+        
+        旧版会在上传后清理永久保存的图生图输入，留下的记录仍会计入配额。
+        """
+        pruned, freed = 0, 0
+        loop = asyncio.get_event_loop()
+        for category in (CATEGORY_IMG2IMG_INPUTS, CATEGORY_WORKFLOW_INPUTS, CATEGORY_INPUTS):
+            after_id = 0
+            while True:
+                rows = await self.db.get_records_in_category(category, after_id, self.RETENTION_BATCH)
+                if not rows:
+                    break
+                after_id = rows[-1][0]
+                missing = await loop.run_in_executor(
+                    None, lambda: [r for r in rows if r[2] and not os.path.exists(r[2])])
+                if missing:
+                    _, b = await self._evict_records(missing)
+                    pruned, freed = pruned + len(missing), freed + b
+        if pruned:
+            logger.info(f"保留策略：移除 {pruned} 条文件已不存在的输入图片记录")
+        return pruned, freed
+
+    async def _evict_records(self, rows: List[tuple]) -> Tuple[int, int]:
+        """删除记录对应的文件（线程池中执行）及目录表中的记录"""
+        entries = []
+        for _, filename, file_path, _, generate_date, _, content_hash in rows:
+            if not file_path:
+                # 升级前的输出记录没有路径，按保存规则推导
+                file_path = str(Path(self.auto_save_dir).joinpath(*generate_date.split("-"), filename))
+            entries.append((file_path, content_hash))
+        
+        def _remove() -> Tuple[int, int]:
+            count, size = 0, 0
+            for path, content_hash in entries:
+                try:
+                    st = os.stat(path)
+                    os.remove(path)
+                    count += 1
+                except FileNotFoundError:
+                    # 文件已被删除（如旧版清理了永久保存的输入图片）：仍要释放 blob
+                    if content_hash:
+                        ext = os.path.splitext(path)[1]
+                        try:
+                            blob_size = os.path.getsize(self.blobs.blob_path(content_hash, ext))
+                        except OSError:
+                            blob_size = 0
+                        if self.blobs.release(content_hash, ext):
+                            size += blob_size
+                    continue
+                except OSError as e:
+                    logger.warning(f"删除文件失败 {path}: {e}")
+                    continue
+                # 硬链接到 blob 的文件：最后一个引用删除后才真正释放空间
+                released = bool(content_hash) and self.blobs.release(
+                    content_hash, os.path.splitext(path)[1])
+                if st.st_nlink == 1 or released:
+                    size += st.st_size
+                try:
+                    os.rmdir(os.path.dirname(path))  # 仅在日期目录已空时成功
+                except OSError:
+                    pass
+            return count, size
+        
+        result = await asyncio.get_event_loop().run_in_executor(None, _remove)
+        await self.db.delete_records([row[0] for row in rows])
+        return result
+
+    # ==================== 归档输出转码 ====================
+
+    TRANSCODE_BATCH = 20
+
+    def _is_idle(self) -> bool:
+        """队列为空且没有进行中的任务"""
+        return not self._queued_tasks and not self.user_task_counts
+
+    async def _start_transcode_loop(self):
+        mode = "无损" if self.transcode_quality <= 0 else f"质量{self.transcode_quality}"
+        logger.info(f"启动归档输出转码（WebP {mode}），检查间隔：{self.transcode_interval}秒")
+        while True:
+            await asyncio.sleep(self.transcode_interval)
+            try:
+                await self.run_transcode()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"归档输出转码失败: {e}")
+
+    async def run_transcode(self) -> Tuple[int, int]:
+        """
+        把 transcode_after_days 天前保存的 PNG 输出转码为 WebP，并更新目录表
+        
+        只在空闲时执行，每个文件之前都检查一次，有新任务就让出，下次从断点继续；
+        编码在低优先级的进程池中进行。结果不比原文件小或为动图的文件跳过。
+        
+        Returns:
+            (转码的文件数, 节省的字节数)
+        """
+        cutoff = (datetime.now() - timedelta(days=self.transcode_after_days)).strftime("%Y-%m-%d")
+        loop = asyncio.get_event_loop()
+        if self._transcode_pool is None:
+            self._transcode_pool = ProcessPoolExecutor(
+                max_workers=self.transcode_workers, initializer=lower_priority)
+        converted, saved = 0, 0
+        try:
+            while self._is_idle():
+                rows = await self.db.get_transcode_candidates(
+                    cutoff, self._transcode_cursor, self.TRANSCODE_BATCH)
+                if not rows:
+                    break
+                for record_id, _, file_path, file_size, content_hash in rows:
+                    if not self._is_idle():
+                        break
+                    self._transcode_cursor = record_id
+                    if not file_path or not os.path.isfile(file_path):
+                        continue
+                    new_path = os.path.splitext(file_path)[0] + ".webp"
+                    part = new_path + ".part"
+                    size = await loop.run_in_executor(
+                        self._transcode_pool, transcode_to_webp, file_path, part, self.transcode_quality)
+                    if size is None:
+                        continue
+                    digest = await loop.run_in_executor(
+                        None, self._place_transcoded, part, new_path)
+                    await self.db.update_record_file(record_id, os.path.basename(new_path), new_path,
+                                                     size, "image/webp", digest)
+                    await loop.run_in_executor(None, self._remove_saved_file, file_path, content_hash)
+                    converted += 1
+                    saved += (file_size or 0) - size
+        finally:
+            if converted:
+                self.transcode_bytes_saved += saved
+                mb = 1024 * 1024
+                logger.info(f"归档输出转码：{converted} 个文件，节省 {saved / mb:.1f}MB"
+                            f"（累计 {self.transcode_bytes_saved / mb:.1f}MB）")
+        return converted, saved
+
+    def _place_transcoded(self, part: str, new_path: str) -> Optional[str]:
+        """把转码结果放到日期目录（去重存储时写入 blob 并建立链接），返回内容哈希"""
+        if not self.enable_dedup_store:
+            os.replace(part, new_path)
+            return None
+        try:
+            return self.blobs.store_file(part, Path(new_path))
+        finally:
+            os.remove(part)
+
+    def _remove_saved_file(self, path: str, content_hash: Optional[str]):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if content_hash:
+            self.blobs.release(content_hash, os.path.splitext(path)[1])
+
+    def shutdown_transcoder(self):
+        if self._transcode_pool is not None:
+            self._transcode_pool.shutdown(wait=False, cancel_futures=True)
+            self._transcode_pool = None
+
     # ==================== 错误解析 ====================
 
     @staticmethod